@@ -111,24 +111,30 @@ normalize_audio() {
     local loudnorm_log="$temp_dir/loudnorm.log"
     local stats_json="$temp_dir/stats.json"
     local ffmpeg_status=0
+    local precomputed_stats="$5" # 可選：下載時已完成的 loudnorm 分析結果 (invidious_downloader.py --analyze-loudness)
 
-    echo -e "${YELLOW}執行第一遍音量分析...${RESET}"
-    # <<< 修正語法錯誤 >>>
-    log_message "INFO" "執行第一遍音量分析: $audio_wav"
-    ffmpeg -y -i "$audio_wav" -af loudnorm=I=-12:TP=-1.5:LRA=11:print_format=json -f null - 2> "$loudnorm_log"
-    if [ $? -ne 0 ]; then
+    if [ -n "$precomputed_stats" ] && [ -s "$precomputed_stats" ] && cp "$precomputed_stats" "$stats_json"; then
+        log_message "INFO" "沿用下載時的音量分析結果，跳過第一遍分析: $precomputed_stats"
+        echo -e "${GREEN}沿用下載時的音量分析結果，跳過第一遍分析${RESET}"
+    else
+        echo -e "${YELLOW}執行第一遍音量分析...${RESET}"
         # <<< 修正語法錯誤 >>>
-        log_message "ERROR" "第一遍音量分析失敗！檢查 $loudnorm_log"
-        echo -e "${RED}錯誤：音量分析失敗${RESET}"; cat "$loudnorm_log"; return 1
-    fi
-    echo -e "${GREEN}第一遍音量分析完成${RESET}"
-
-    echo -e "${YELLOW}解析音量分析結果...${RESET}"
-    awk '/^\{/{flag=1}/^\}/{print;flag=0}flag' "$loudnorm_log" > "$stats_json"
-    if [ ! -s "$stats_json" ]; then
-         # <<< 修正語法錯誤 >>>
-         log_message "ERROR" "解析音量分析參數失敗 (awk 未能提取 JSON?)。檢查 $loudnorm_log"
-         echo -e "${RED}錯誤：解析音量參數失敗 (JSON 為空)${RESET}"; return 1
+        log_message "INFO" "執行第一遍音量分析: $audio_wav"
+        ffmpeg -y -i "$audio_wav" -af loudnorm=I=-12:TP=-1.5:LRA=11:print_format=json -f null - 2> "$loudnorm_log"
+        if [ $? -ne 0 ]; then
+            # <<< 修正語法錯誤 >>>
+            log_message "ERROR" "第一遍音量分析失敗！檢查 $loudnorm_log"
+            echo -e "${RED}錯誤：音量分析失敗${RESET}"; cat "$loudnorm_log"; return 1
+        fi
+        echo -e "${GREEN}第一遍音量分析完成${RESET}"
+
+        echo -e "${YELLOW}解析音量分析結果...${RESET}"
+        awk '/^\{/{flag=1}/^\}/{print;flag=0}flag' "$loudnorm_log" > "$stats_json"
+        if [ ! -s "$stats_json" ]; then
+             # <<< 修正語法錯誤 >>>
+             log_message "ERROR" "解析音量分析參數失敗 (awk 未能提取 JSON?)。檢查 $loudnorm_log"
+             echo -e "${RED}錯誤：解析音量參數失敗 (JSON 為空)${RESET}"; return 1
+        fi
     fi
     local measured_I=$(jq -r '.input_i // empty' "$stats_json")
     local measured_TP=$(jq -r '.input_tp // empty' "$stats_json")
@@ -195,6 +201,7 @@ process_media() {
     local result=0
     local python_enricher_success=false 
     local cover_image=""
+    local precomputed_stats=""
 
     # --- 初始化 ---
     log_message "INFO" "開始處理輸入: $input"
@@ -209,6 +216,8 @@ process_media() {
     if [ -f "$input" ]; then
         is_local=true; audio_file="$input"; base_name="$(basename "$audio_file" | sed 's/\.[^.]*$//')";
         wav_audio="$temp_dir/${base_name}.wav"; log_message "INFO" "處理本機音訊檔案：$audio_file"
+        # 下載器 (--analyze-loudness) 留下的響度分析結果
+        [ -s "$audio_file.loudnorm.json" ] && precomputed_stats="$audio_file.loudnorm.json"
         video_title="$base_name"; artist_name="[不明]"; uploader_name="[不明]"
     else
         is_local=false; media_url="$input"; log_message "INFO" "處理網路媒體：$media_url"
@@ -292,7 +301,7 @@ process_media() {
 
     # --- 3. 調用 normalize_audio 函數 ---
     echo -e "${YELLOW}開始音量標準化並轉換為 MP3...${RESET}"
-    if normalize_audio "$wav_audio" "$normalized_mp3" "$temp_dir" false; then
+    if normalize_audio "$wav_audio" "$normalized_mp3" "$temp_dir" false "$precomputed_stats"; then
         log_message "INFO" "音量標準化並轉換為初步 MP3 成功: $normalized_mp3"
         safe_remove "$wav_audio"
 
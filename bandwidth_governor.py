@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨行程頻寬預算 (token bucket)。
+
+invidious_downloader.py、sync_helper.py (rsync) 等同時執行時共用一個總頻寬預算，依優先權加權分配：
+- 動態用戶 (Python 下載器) 在本行程內以 token bucket 限速，約每秒向共用登記表回報實際用量並重新取得配額；
+  用不完的配額會分給其他用戶，因此總吞吐量不會因為某個用戶閒置而下降。
+- 固定用戶 (rsync --bwlimit、yt-dlp --limit-rate) 啟動後無法調整速率，啟動時取得一個固定配額並保留到結束。
+登記表是 APP_DATA_DIR 下的 JSON 檔，以 fcntl.flock 鎖定的鎖檔保護；已結束的行程會被自動移除。
+未設定總預算 (0) 時完全不限速。
+"""
+
+import sys
+import os
+import json
+import time
+import socket
+import threading
+import argparse
+import atexit
+try:
+    import fcntl
+except ImportError: # 非 POSIX 平台：沒有跨行程鎖，只能停用
+    fcntl = None
+
+# --- 設定 ---
+APP_DATA_DIR = os.environ.get("MEDIA_PROCESSOR_DATA_DIR", os.path.join(os.path.expanduser("~"), ".media_processor"))
+GOVERNOR_STATE_PATH = os.path.join(APP_DATA_DIR, "bandwidth_governor.json")
+GOVERNOR_LOCK_PATH = os.path.join(APP_DATA_DIR, "bandwidth_governor.lock")
+GOVERNOR_TOTAL_ENV = "MEDIA_PROCESSOR_BANDWIDTH_KBPS" # 覆寫登記表中的總預算 (KB/s)
+PRIORITY_WEIGHTS = {'interactive': 4, 'normal': 2, 'background': 1}
+FIXED_RESERVE_PRIORITY = 'interactive' # 固定用戶取得配額時，若沒有互動式用戶在執行，仍為它預留一份
+GOVERNOR_REFRESH_INTERVAL = 1.0   # 動態用戶回報用量、重新取得配額的間隔 (秒)
+GOVERNOR_STALE_AFTER = 10.0       # 動態用戶超過此秒數未回報即視為已結束
+GOVERNOR_MIN_RATE = 64 * 1024     # 每個用戶的最低配額 (bytes/s)，避免被完全餓死
+GOVERNOR_DEMAND_HEADROOM = 1.5    # 估計需求 = 實際速率 x 此倍數 (讓受限的用戶仍能爬升)
+GOVERNOR_BURST_SECONDS = 0.5      # token bucket 容量 (以秒計的配額)
+SCRIPT_VERSION = "1.0.0"
+
+def log_message(level, message):
+    print(f"[{level}] {message}", file=sys.stderr)
+
+# --- 共用登記表 ---
+class _LockedState:
+    """with 區塊內持有跨行程獨占鎖並提供可修改的登記表；離開時寫回。"""
+    def __enter__(self):
+        os.makedirs(APP_DATA_DIR, exist_ok=True)
+        self._lock_file = open(GOVERNOR_LOCK_PATH, 'a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            with open(GOVERNOR_STATE_PATH, 'r', encoding='utf-8') as f: self.state = json.load(f)
+            if not isinstance(self.state, dict): raise ValueError
+        except (OSError, ValueError):
+            self.state = {}
+        self.state.setdefault('total_kbps', 0)
+        self.state.setdefault('clients', {})
+        return self.state
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                tmp_path = f"{GOVERNOR_STATE_PATH}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(self.state, f)
+                os.replace(tmp_path, GOVERNOR_STATE_PATH)
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+
+def _pid_alive(pid):
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: return True
+    return True
+
+def _prune(clients, now):
+    for client_id, client in list(clients.items()):
+        stale = client.get('kind') == 'dynamic' and now - client.get('last_seen', 0) > GOVERNOR_STALE_AFTER
+        if stale or not _pid_alive(client.get('pid', 0)): del clients[client_id]
+
+def total_budget(state):
+    """總預算 (bytes/s)；0 表示不限速。"""
+    kbps = os.environ.get(GOVERNOR_TOTAL_ENV)
+    try: kbps = int(kbps) if kbps else int(state.get('total_kbps') or 0)
+    except ValueError: kbps = 0
+    return max(0, kbps) * 1024
+
+def _configured():
+    """從未設定過預算時不建立任何檔案。"""
+    return fcntl is not None and (bool(os.environ.get(GOVERNOR_TOTAL_ENV)) or os.path.exists(GOVERNOR_STATE_PATH))
+
+def _weight(client): return PRIORITY_WEIGHTS.get(client.get('priority'), PRIORITY_WEIGHTS['normal'])
+
+def allocate(total, clients):
+    """
+    依登記表計算每個動態用戶的配額 {client_id: bytes/s}。
+    固定用戶的保留量先扣除，其餘以加權的 max-min 公平分配 (water-filling)：需求低於公平份額的用戶只拿需求，
+    剩下的再依權重分給其他人；全部滿足後的餘量依權重分給所有動態用戶。
+    """
+    dynamic = {cid: c for cid, c in clients.items() if c.get('kind') == 'dynamic'}
+    if not dynamic: return {}
+    fixed = sum(c.get('rate', 0) for c in clients.values() if c.get('kind') == 'fixed')
+    capacity = max(total - fixed, GOVERNOR_MIN_RATE * len(dynamic))
+    demands = {cid: (c['observed'] * GOVERNOR_DEMAND_HEADROOM + GOVERNOR_MIN_RATE) if c.get('observed') is not None else float('inf')
+               for cid, c in dynamic.items()}
+    allocation, active, remaining = {}, set(dynamic), capacity
+    while active:
+        total_weight = sum(_weight(dynamic[cid]) for cid in active)
+        satisfied = {cid for cid in active if demands[cid] <= remaining * _weight(dynamic[cid]) / total_weight}
+        if not satisfied:
+            for cid in active: allocation[cid] = remaining * _weight(dynamic[cid]) / total_weight
+            remaining = 0
+            break
+        for cid in satisfied:
+            allocation[cid] = demands[cid]; remaining -= demands[cid]
+        active -= satisfied
+    if remaining > 0:
+        total_weight = sum(_weight(c) for c in dynamic.values())
+        for cid, c in dynamic.items(): allocation[cid] += remaining * _weight(c) / total_weight
+    return {cid: max(rate, GOVERNOR_MIN_RATE) for cid, rate in allocation.items()}
+
+def fixed_share(total, clients, priority):
+    """新的固定用戶可取得的配額 (bytes/s)；若沒有互動式用戶，仍為其預留一份 (固定用戶之後無法讓出頻寬)。"""
+    weights = [_weight(c) for c in clients.values()]
+    if not any(c.get('priority') == FIXED_RESERVE_PRIORITY for c in clients.values()) and priority != FIXED_RESERVE_PRIORITY:
+        weights.append(PRIORITY_WEIGHTS[FIXED_RESERVE_PRIORITY])
+    own = PRIORITY_WEIGHTS.get(priority, PRIORITY_WEIGHTS['normal'])
+    return max(GOVERNOR_MIN_RATE, int(total * own / (sum(weights) + own)))
+
+def _client_id(): return f"{socket.gethostname()}:{os.getpid()}:dynamic"
+
+# --- 動態用戶 (本行程內 token bucket) ---
+class BandwidthGovernor:
+    """在本行程內限速；consume(n) 在超出配額時阻塞。可由多個執行緒共用。"""
+    def __init__(self, priority='normal', name=None):
+        self.priority = priority
+        self.name = name or os.path.basename(sys.argv[0])
+        self.client_id = _client_id()
+        self.lock = threading.Lock()
+        self.rate = None
+        self.tokens = 0.0
+        self.last_fill = time.monotonic()
+        self.used_since_refresh = 0
+        self.last_refresh = float('-inf')
+        self.observed = None
+        self._refresh()
+
+    @classmethod
+    def join(cls, priority='normal', name=None):
+        """加入共用預算；未設定總預算或平台不支援時回傳 None (即不限速)。"""
+        if not _configured(): return None
+        try:
+            governor = cls(priority, name)
+        except OSError as e:
+            log_message("WARN", f"無法使用頻寬預算登記表: {e}")
+            return None
+        if governor.rate is None:
+            governor.close()
+            return None
+        return governor
+
+    def _refresh(self):
+        now_wall, now = time.time(), time.monotonic()
+        if self.last_refresh != float('-inf'):
+            self.observed = self.used_since_refresh / max(now - self.last_refresh, 1e-3)
+        self.used_since_refresh, self.last_refresh = 0, now
+        with _LockedState() as state:
+            _prune(state['clients'], now_wall)
+            state['clients'][self.client_id] = {'pid': os.getpid(), 'name': self.name, 'priority': self.priority, 'kind': 'dynamic',
+                                                'observed': self.observed, 'last_seen': now_wall}
+            total = total_budget(state)
+            rate = allocate(total, state['clients']).get(self.client_id) if total else None
+            if rate is not None: state['clients'][self.client_id]['rate'] = int(rate)
+        if rate is not None and self.rate is None: self.tokens = rate * GOVERNOR_BURST_SECONDS
+        self.rate = rate
+
+    def consume(self, n):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_refresh >= GOVERNOR_REFRESH_INTERVAL:
+                try: self._refresh()
+                except OSError: pass # 登記表暫時不可用時沿用目前配額
+            self.used_since_refresh += n
+            if self.rate is None: return
+            self.tokens = min(self.tokens + (now - self.last_fill) * self.rate, self.rate * GOVERNOR_BURST_SECONDS)
+            self.last_fill = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0: time.sleep(wait)
+
+    def close(self):
+        try:
+            with _LockedState() as state: state['clients'].pop(self.client_id, None)
+        except OSError: pass
+
+# --- 固定用戶 (rsync / yt-dlp) ---
+class FixedLease:
+    """固定速率的配額，保留到 release() 或行程結束。"""
+    def __init__(self, client_id, rate):
+        self.client_id, self.rate = client_id, rate
+        atexit.register(self.release)
+
+    @property
+    def kbps(self): return max(1, self.rate // 1024)
+
+    def release(self):
+        if self.client_id is None: return
+        try:
+            with _LockedState() as state: state['clients'].pop(self.client_id, None)
+        except OSError: pass
+        self.client_id = None
+
+def reserve_fixed(priority='background', name=None, limit_kbps=None, pid=None):
+    """
+    為無法動態調整速率的程式取得固定配額；回傳 FixedLease (其 kbps 可直接用於 rsync --bwlimit)。
+    limit_kbps: 呼叫者自己的上限。未設定總預算時回傳 None。pid: 由哪個行程持有 (預設為本行程)。
+    """
+    if not _configured(): return None
+    client_id = f"{socket.gethostname()}:{pid or os.getpid()}:fixed"
+    with _LockedState() as state:
+        now = time.time()
+        _prune(state['clients'], now)
+        total = total_budget(state)
+        if not total: return None
+        rate = fixed_share(total, state['clients'], priority)
+        if limit_kbps: rate = min(rate, limit_kbps * 1024)
+        state['clients'][client_id] = {'pid': pid or os.getpid(), 'name': name or os.path.basename(sys.argv[0]), 'priority': priority,
+                                       'kind': 'fixed', 'rate': rate, 'last_seen': now}
+    return FixedLease(client_id, rate)
+
+def main():
+    parser = argparse.ArgumentParser(description=f"跨行程頻寬預算 v{SCRIPT_VERSION}")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="輸出總預算與目前的用戶 (JSON)")
+    set_total = subparsers.add_parser("set-total", help="設定總預算")
+    set_total.add_argument("kbps", type=int, help="KB/s，0 為不限速")
+    limit = subparsers.add_parser("limit", help="為固定速率的程式 (例如 yt-dlp --limit-rate) 保留配額並輸出 KB/s；0 表示不限速")
+    limit.add_argument("--priority", choices=sorted(PRIORITY_WEIGHTS), default='normal')
+    limit.add_argument("--pid", type=int, required=True, help="持有配額的行程 (例如 shell 的 $$)；該行程結束或執行 release 後釋放")
+    limit.add_argument("--name", default=None)
+    release = subparsers.add_parser("release", help="釋放 limit 保留的配額")
+    release.add_argument("--pid", type=int, required=True)
+    args = parser.parse_args()
+    if fcntl is None:
+        log_message("ERROR", "此平台不支援頻寬預算 (缺少 fcntl)。"); sys.exit(1)
+    if args.command == "status":
+        with _LockedState() as state:
+            _prune(state['clients'], time.time())
+            print(json.dumps({'total_kbps': total_budget(state) // 1024, 'clients': state['clients']}, ensure_ascii=False, indent=2))
+    elif args.command == "set-total":
+        with _LockedState() as state: state['total_kbps'] = max(0, args.kbps)
+    elif args.command == "limit":
+        lease = reserve_fixed(args.priority, args.name, pid=args.pid)
+        if lease is not None: atexit.unregister(lease.release) # 由 --pid 的行程持有，不隨本指令結束而釋放
+        print(lease.kbps if lease else 0)
+    elif args.command == "release":
+        with _LockedState() as state: state['clients'].pop(f"{socket.gethostname()}:{args.pid}:fixed", None)
+
+if __name__ == "__main__":
+    main()
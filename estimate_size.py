@@ -9,45 +9,169 @@ import json
 import argparse
 import shutil # To find yt-dlp executable
 import re     # For parsing format selectors
+import functools # For memoising compiled selectors
 import os     # For checking file existence
 import traceback # For detailed exception logging
+from concurrent.futures import ThreadPoolExecutor, as_completed # Batch mode worker pool
+import time      # For info-JSON cache expiry
+import hashlib   # For cache keys of URLs without a known video ID
+from urllib.parse import urlparse, parse_qs, urljoin
+import http.client # Keep-alive connections for size probing
+import threading
+from xml.etree import ElementTree # DASH manifest parsing
+import sqlite3    # Estimate ledger
+import math
+import contextlib
+import atexit     # Emits --timings on every exit path
+import tempfile   # Atomic info JSON writes and fixture recording
 
 # --- Global Variables ---
-SCRIPT_VERSION = "v1.3.0(Refactored-BitrateFallback-Debug)" # <<< 新版本號
-DEBUG_ENABLED = True # Keep debugging enabled
+SCRIPT_VERSION = "v1.19.0(Piped)" # <<< 新版本號
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40, 'silent': 100}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get("ESTIMATE_SIZE_LOG_LEVEL", "warning").lower(), LOG_LEVELS['warning']) # Overridden by --log-level
+DEBUG_ENABLED = LOG_LEVEL <= LOG_LEVELS['debug'] # Cheap guard for callers that would build expensive debug arguments
+
+# --- Info-JSON Cache Settings ---
+# One yt-dlp extraction per video is shared by the estimate, the download (--load-info-json) and enrichment.
+APP_DATA_DIR = os.environ.get("MEDIA_PROCESSOR_DATA_DIR", os.path.join(os.path.expanduser("~"), ".media_processor"))
+INFO_JSON_CACHE_DIR = os.path.join(APP_DATA_DIR, "info_json_cache")
+INFO_JSON_DEFAULT_TTL = 3600      # Seconds; used when no signed URL carries an 'expire=' timestamp
+INFO_JSON_EXPIRY_MARGIN = 300     # Treat entries as expired this many seconds early so downloads don't start on a dying URL
+# Large subtrees nothing downstream reads ('subtitles' is kept for yt-dlp --write-subs --load-info-json)
+PRUNED_INFO_KEYS = frozenset(['automatic_captions', 'thumbnails', 'heatmap'])
+PRUNE_INFO = True                 # --keep-all-fields turns pruning off
+BATCH_DEFAULT_JOBS = 4            # Concurrent extractions in --batch mode (kept low for phones and rate limits)
+
+# --- Estimate Ledger Settings ---
+LEDGER_PATH = os.path.join(APP_DATA_DIR, "estimate_ledger.sqlite3")
+LEDGER_MIN_SAMPLES = 3 # Completed estimates needed before a category's learned factor is trusted
+# Default log-scale uncertainty per size method, used for the confidence band until enough samples exist
+METHOD_DEFAULT_UNCERTAINTY = {'filesize': 0.01, 'probe': 0.01, 'manifest': 0.02, 'fragments': 0.03, 'approx': 0.10, 'bitrate': 0.25, 'none': 1.0}
+
+# --- Piped Backend Settings ---
+PIPED_INSTANCE = os.environ.get("PIPED_INSTANCE", "https://pipedapi.kavin.rocks") # Same default instance as invidious_downloader.py
+PIPED_TIMEOUT = 10                # Seconds for the /streams request before falling back to yt-dlp
+PIPED_STREAMS_CACHE_DIR = os.path.join(APP_DATA_DIR, "piped_streams_cache") # Shared with invidious_downloader.py, one <id>.json per video
+# Codec preference, worst -> best, used to rank Piped streams the way yt-dlp's default format sort does
+VCODEC_PREFERENCE = ('vp8', 'avc1', 'h264', 'hev1', 'hvc1', 'vp9', 'vp09', 'av01')
+ACODEC_PREFERENCE = ('mp3', 'mp4a', 'aac', 'vorbis', 'opus', 'flac')
+PIPED_MIME_EXTS = {'audio/mp4': 'm4a', 'audio/webm': 'webm', 'video/mp4': 'mp4', 'video/webm': 'webm', 'video/3gpp': '3gp'}
+
+# --- Fixture Regression Suite Settings ---
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "fixtures", "estimate") # Committed <name>.json fixtures plus baseline.json
+FIXTURE_DEFAULT_RUNS = 5          # Timed repetitions per case (the minimum is compared)
+FIXTURE_SPEED_TOLERANCE = 0.25    # A case regresses when slower than baseline * (1 + tolerance) ...
+FIXTURE_SPEED_SLACK_MS = 0.5      # ... plus this much, so sub-millisecond noise never fails a run
+FIXTURE_ERROR_SLACK_PCT = 0.5     # Allowed growth of a case's absolute estimation error (percentage points)
+IGNORE_INFO_EXPIRY = False        # Set when reading recorded fixture info JSON whose signed URLs have long expired
+
+# --- Budget Selection Settings ---
+BUDGET_DEFAULT_SELECTOR = "bv*+ba/b"  # Used with --max-bytes / --time-budget when no selector is given
+THROUGHPUT_SAMPLE_BYTES = 1024 * 1024 # Range request size used to measure link throughput for --time-budget
+THROUGHPUT_SAMPLE_SECONDS = 5.0   # Stop sampling after this long even if fewer bytes arrived
+THROUGHPUT_READ_CHUNK = 64 * 1024 # Bytes per read while sampling
+
+# --- Pipeline Disk Prediction Settings (mirrors media_processor.sh normalize_audio) ---
+PIPELINES = ('mp3', 'mp4', 'mkv')
+PCM_BYTES_PER_SECOND = 44100 * 2 * 2 # audio.wav / step1_dyn.wav / normalized.wav: 44.1 kHz, s16, stereo (~10 MB/min each)
+PIPELINE_AUDIO_BITRATES = {'mp3': 320000, 'mp4': 256000, 'mkv': 256000} # Final encode: libmp3lame 320k, or aac 256k for video
+PIPELINE_CONTAINER_OVERHEAD = 1.01 # Muxing/tag overhead on encoded outputs
+
+# --- Section Estimation Settings ---
+SECTION_KEYFRAME_OVERHEAD_SECONDS = 5.0 # Extra video fetched per section because cuts begin at the previous keyframe (typical GOP)
+
+# --- Size Probe Settings ---
+PROBE_CACHE_PATH = os.path.join(APP_DATA_DIR, "probe_cache.json")
+PROBE_DEFAULT_JOBS = 4            # Concurrent HEAD/Range requests
+PROBE_TIMEOUT = 10                # Seconds per probe request
 
 # --- Logging Helpers ---
-def debug_print(*args, **kwargs):
-    if DEBUG_ENABLED: print("DEBUG:", *args, file=sys.stderr, **kwargs)
-def error_print(*args, **kwargs): print("ERROR:", *args, file=sys.stderr, **kwargs)
-def warning_print(*args, **kwargs): print("WARNING:", *args, file=sys.stderr, **kwargs)
+# Messages are %-style templates formatted only when their level is enabled, so disabled
+# debug lines cost one comparison: debug_print("Retrieved %s formats.", len(formats)).
+def set_log_level(name):
+    global LOG_LEVEL, DEBUG_ENABLED
+    LOG_LEVEL = LOG_LEVELS[name]
+    DEBUG_ENABLED = LOG_LEVEL <= LOG_LEVELS['debug']
+
+def _log(level, prefix, message, args):
+    if level < LOG_LEVEL: return
+    print(prefix, (message % args) if args else message, file=sys.stderr)
+
+def debug_print(message, *args):
+    if DEBUG_ENABLED: _log(LOG_LEVELS['debug'], "DEBUG:", message, args)
+def info_print(message, *args): _log(LOG_LEVELS['info'], "INFO:", message, args)
+def warning_print(message, *args): _log(LOG_LEVELS['warning'], "WARNING:", message, args)
+def error_print(message, *args): _log(LOG_LEVELS['error'], "ERROR:", message, args)
+
+class LazyJoin:
+    """Defers ' '.join(items) until a log message is actually formatted."""
+    __slots__ = ('items',)
+    def __init__(self, items): self.items = items
+    def __str__(self): return ' '.join(map(str, self.items))
+
+# --- Phase Timings (--timings) ---
+TIMINGS_ENABLED = False
+_timings = {}
+_timings_lock = threading.Lock()
+
+def add_timing(name, seconds):
+    """Accumulates seconds under a phase name (thread-safe; batch mode sums over items)."""
+    with _timings_lock:
+        entry = _timings.setdefault(name, {'seconds': 0.0, 'count': 0})
+        entry['seconds'] += seconds; entry['count'] += 1
+
+@contextlib.contextmanager
+def timed(name):
+    if not TIMINGS_ENABLED:
+        yield; return
+    start = time.perf_counter()
+    try: yield
+    finally: add_timing(name, time.perf_counter() - start)
+
+def emit_timings(start):
+    """Prints one machine-readable 'TIMINGS {json}' line to stderr."""
+    add_timing('total', time.perf_counter() - start)
+    with _timings_lock:
+        phases = {name: {'seconds': round(entry['seconds'], 6), 'count': entry['count']} for name, entry in _timings.items()}
+    print("TIMINGS " + json.dumps(phases, sort_keys=True), file=sys.stderr, flush=True)
 
 # --- Helper Function to Get Size (with Bitrate Fallback) ---
-def get_format_size(format_info):
+def get_format_size(format_info, duration=None):
     """
     Gets the size of a format.
     1. Prioritize 'filesize'.
-    2. Fallback to 'filesize_approx'.
-    3. Fallback to calculation using duration and bitrate (tbr or vbr+abr).
+    2. Fallback to the sum of per-fragment sizes / byte ranges of fragmented (DASH/HLS) formats.
+    3. Fallback to 'filesize_approx'.
+    4. Fallback to calculation using duration and bitrate (tbr or vbr+abr).
+       yt-dlp formats carry no 'duration' of their own, so the video's duration can be passed in.
     Returns size in bytes or 0 if all methods fail.
     """
-    if not isinstance(format_info, dict): return 0
+    return get_format_size_with_method(format_info, duration)[0]
+
+def get_format_size_with_method(format_info, duration=None):
+    """Same as get_format_size, but returns (size, method) with method 'filesize', 'fragments', 'approx', 'bitrate' or 'none'."""
+    if not isinstance(format_info, dict): return 0, 'none'
     format_id = format_info.get('format_id', 'N/A')
 
     # 1. Try filesize
     filesize = format_info.get('filesize')
     if isinstance(filesize, (int, float)) and filesize > 0:
-        # debug_print(f"    get_format_size({format_id}): Using 'filesize' = {int(filesize)}")
-        return int(filesize)
+        # debug_print("    get_format_size(%s): Using 'filesize' = %s", format_id, int(filesize))
+        return int(filesize), 'filesize'
+
+    # 2. Try fragment sizes / byte ranges
+    if format_info.get('fragments'):
+        fragment_size = size_from_segments(segments_from_fragments(format_info), total_duration=format_info.get('duration') or duration)
+        if fragment_size: return fragment_size, 'fragments'
 
-    # 2. Try filesize_approx
+    # 3. Try filesize_approx
     filesize_approx = format_info.get('filesize_approx')
     if isinstance(filesize_approx, (int, float)) and filesize_approx > 0:
-        # debug_print(f"    get_format_size({format_id}): Using 'filesize_approx' = {int(filesize_approx)}")
-        return int(filesize_approx)
+        # debug_print("    get_format_size(%s): Using 'filesize_approx' = %s", format_id, int(filesize_approx))
+        return int(filesize_approx), 'approx'
 
-    # 3. Try duration * bitrate calculation
-    duration = format_info.get('duration')
+    # 4. Try duration * bitrate calculation
+    duration = format_info.get('duration') or duration
     if isinstance(duration, (int, float)) and duration > 0:
         tbr = format_info.get('tbr') # Total bitrate (kbps)
         vbr = format_info.get('vbr') # Video bitrate (kbps)
@@ -57,246 +181,1546 @@ def get_format_size(format_info):
         # Prefer tbr if available
         if isinstance(tbr, (int, float)) and tbr > 0:
             total_bitrate_kbps = tbr
-            # debug_print(f"    get_format_size({format_id}): Using tbr={tbr} kbps for calculation.")
+            # debug_print("    get_format_size(%s): Using tbr=%s kbps for calculation.", format_id, tbr)
         else:
             # Otherwise, try summing vbr and abr
             calculated_tbr = 0
             if isinstance(vbr, (int, float)) and vbr > 0:
                 calculated_tbr += vbr
-                # debug_print(f"    get_format_size({format_id}): Adding vbr={vbr} kbps.")
+                # debug_print("    get_format_size(%s): Adding vbr=%s kbps.", format_id, vbr)
             if isinstance(abr, (int, float)) and abr > 0:
                 calculated_tbr += abr
-                # debug_print(f"    get_format_size({format_id}): Adding abr={abr} kbps.")
+                # debug_print("    get_format_size(%s): Adding abr=%s kbps.", format_id, abr)
             total_bitrate_kbps = calculated_tbr
 
         if total_bitrate_kbps > 0:
             # Convert kbps to bytes per second: (kbps * 1000) / 8
             bytes_per_second = (total_bitrate_kbps * 1000) / 8
             estimated_size = int(bytes_per_second * duration)
-            debug_print(f"    get_format_size({format_id}): Calculated size from bitrate ({total_bitrate_kbps} kbps) and duration ({duration}s) = {estimated_size} bytes")
-            return estimated_size
+            debug_print("    get_format_size(%s): Calculated size from bitrate (%s kbps) and duration (%ss) = %s bytes", format_id, total_bitrate_kbps, duration, estimated_size)
+            return estimated_size, 'bitrate'
         # else:
-            # debug_print(f"    get_format_size({format_id}): Bitrate/duration calculation failed (no valid bitrate).")
+            # debug_print("    get_format_size(%s): Bitrate/duration calculation failed (no valid bitrate).", format_id)
 
     # All methods failed
-    # debug_print(f"    get_format_size({format_id}): All methods failed to get size. Returning 0.")
-    return 0
+    # debug_print("    get_format_size(%s): All methods failed to get size. Returning 0.", format_id)
+    return 0, 'none'
+
+# --- Format Selector Compiler ---
+# Selectors are compiled once into a plan (nested tuples) and evaluated against a per-format feature table.
+# Precedence follows yt-dlp: ',' (download several) < '/' (fallback) < '+' (merge) < '[...]' (filters).
+#   ('list', [nodes]) | ('alt', [nodes]) | ('merge', [nodes]) | ('select', spec, filters) | ('group', node, filters)
+# A filter is (key, op, value, optional, negate); op is one of < <= > >= = != ^= $= *= ~=.
+NUMERIC_FILTER_KEYS = frozenset(['width', 'height', 'tbr', 'abr', 'vbr', 'asr', 'filesize', 'filesize_approx', 'fps', 'audio_channels', 'aspect_ratio'])
+STRING_FILTER_KEYS = frozenset(['ext', 'acodec', 'vcodec', 'container', 'protocol', 'format_id', 'language', 'dynamic_range', 'format_note', 'format', 'resolution'])
+AUDIO_SELECTOR_EXTS = frozenset(['m4a', 'mka', 'mp3', 'ogg', 'opus', 'aac', 'flac', 'wav'])
+VIDEO_SELECTOR_EXTS = frozenset(['mp4', 'webm', 'mkv', 'flv', 'mov', 'avi', '3gp'])
+FINGERPRINT_KEYS = ('format_id', 'ext', 'vcodec', 'acodec', 'width', 'height', 'fps', 'tbr', 'vbr', 'abr', 'asr', 'filesize', 'filesize_approx', 'protocol', 'language', 'format_note', 'dynamic_range', 'container', 'audio_channels')
+SELECTION_MEMO_LIMIT = 4096 # Entries in the (fingerprint, selector) -> selection memo before it is reset
+
+NUMERIC_FILTER_PATTERN = re.compile(r"^\s*(?P<key>[a-zA-Z_][a-zA-Z0-9_]*)\s*(?P<op><=|>=|<|>|!=|=)(?P<opt>\?)?\s*(?P<value>[0-9.]+(?:[kKmMgGtT]i?[bB]?)?)\s*$")
+STRING_FILTER_PATTERN = re.compile(r"^\s*(?P<key>[a-zA-Z_][a-zA-Z0-9_]*)\s*(?P<neg>!)?(?P<op>=|\^=|\$=|\*=|~=)(?P<opt>\?)?\s*(?P<quote>[\"']?)(?P<value>.*?)(?P=quote)\s*$")
+SELECT_SPEC_PATTERN = re.compile(r"^(?P<bw>best|worst|b|w)(?P<type>video|audio|v|a)?(?P<mod>\*)?(?:\.(?P<n>[1-9]\d*))?$")
+SIZE_SUFFIX_POWERS = {'k': 1, 'm': 2, 'g': 3, 't': 4}
+
+def _parse_numeric_value(value):
+    """Parses '720', '2.5', '500K', '1.5MiB' (yt-dlp style filesize suffixes). Returns None if not numeric."""
+    match = re.match(r"^([0-9]*\.?[0-9]+)\s*(?:([kKmMgGtT])(i)?[bB]?)?$", value.strip())
+    if not match: return None
+    number = float(match.group(1))
+    if match.group(2): number *= (1024 if match.group(3) else 1000) ** SIZE_SUFFIX_POWERS[match.group(2).lower()]
+    return int(number) if number.is_integer() else number
 
-# --- Helper Function to Parse Filters (AI Corrected Regex) ---
 def parse_filter(filter_str):
-    """Parses simple filters like [height<=1080][ext=mp4]. Corrected Regex."""
-    filters = {}
-    pattern = r"\[([a-zA-Z_]+)\s*(<=|>=|=)?\s*([a-zA-Z0-9_.-]+)\]"
-    matches = re.findall(pattern, filter_str)
-    for key, op, value in matches:
-        op = op if op else '=='
-        if op == '=': op = '=='
-        val_processed = value
-        if op in ['<=', '>='] and key not in ['ext', 'format_id', 'acodec', 'vcodec', 'protocol']:
-            try: val_processed = int(value)
-            except ValueError: continue
-        filters[key] = (op, val_processed)
-    # debug_print(f"    parse_filter: Parsed filters={filters}") # Optional debug
+    """
+    Parses one or more chained filters like '[height>=720][height<=1080][ext=mp4]' into a list of
+    (key, op, value, optional, negate) tuples. Every filter is kept, so repeated keys all apply.
+    Raises ValueError on a filter yt-dlp would also reject.
+    """
+    filters = []
+    for body in re.findall(r"\[((?:[^\]\"']|\"[^\"]*\"|'[^']*')*)\]", filter_str):
+        match = NUMERIC_FILTER_PATTERN.match(body)
+        if match and match.group('key') not in STRING_FILTER_KEYS:
+            value = _parse_numeric_value(match.group('value'))
+            if value is not None:
+                filters.append((match.group('key'), match.group('op'), value, bool(match.group('opt')), False)); continue
+        match = STRING_FILTER_PATTERN.match(body)
+        if match:
+            op, negate = match.group('op'), bool(match.group('neg'))
+            value = match.group('value')
+            if op == '~=':
+                try: value = re.compile(value)
+                except re.error as e: raise ValueError(f"Invalid regex in filter '[{body}]': {e}")
+            filters.append((match.group('key'), op, value, bool(match.group('opt')), negate)); continue
+        raise ValueError(f"Invalid filter specification '[{body}]'")
     return filters
 
-# --- Helper Function to Match Filters (Prioritizing ext) ---
+def _filter_matches(format_info, flt):
+    key, op, expected, optional, negate = flt
+    actual = format_info.get(key)
+    if actual is None: return optional
+    if isinstance(expected, (int, float)) and not isinstance(expected, bool) and op in ('<', '<=', '>', '>=', '=', '!='):
+        if not isinstance(actual, (int, float)):
+            try: actual = float(actual)
+            except (TypeError, ValueError): return False
+        if op == '<': return actual < expected
+        if op == '<=': return actual <= expected
+        if op == '>': return actual > expected
+        if op == '>=': return actual >= expected
+        if op == '=': return actual == expected
+        return actual != expected
+    actual = str(actual)
+    if op == '=': result = actual == expected
+    elif op == '!=': result = actual != expected
+    elif op == '^=': result = actual.startswith(expected)
+    elif op == '$=': result = actual.endswith(expected)
+    elif op == '*=': result = expected in actual
+    else: result = expected.search(actual) is not None # '~='
+    return not result if negate else result
+
 def format_matches_filters(format_info, filters):
-    """Checks if a format dict matches filters, prioritizing 'ext'."""
+    """Checks if a format dict satisfies every filter returned by parse_filter."""
     if not isinstance(format_info, dict): return False
-    format_id = format_info.get('format_id', 'N/A')
+    return all(_filter_matches(format_info, flt) for flt in filters)
+
+def _tokenize_selector(selector):
+    tokens, i, n = [], 0, len(selector)
+    while i < n:
+        char = selector[i]
+        if char.isspace(): i += 1
+        elif char in '/+(),':
+            tokens.append((char, None)); i += 1
+        elif char == '[':
+            j, quote = i + 1, None
+            while j < n and (quote or selector[j] != ']'):
+                if selector[j] in '"\'': quote = None if quote == selector[j] else (quote or selector[j])
+                j += 1
+            if j >= n: raise ValueError(f"Unterminated filter in selector '{selector}'")
+            tokens.append(('filter', selector[i:j + 1])); i = j + 1
+        else:
+            j = i
+            while j < n and selector[j] not in '/+()[],' and not selector[j].isspace(): j += 1
+            tokens.append(('name', selector[i:j])); i = j
+    return tokens
+
+def _parse_selector_tokens(tokens, pos, level):
+    """Recursive-descent parser; level is 0 (',' list), 1 ('/' alternatives), 2 ('+' merge) or 3 (item)."""
+    if level < 3:
+        separator, kind = (',', 'list') if level == 0 else ('/', 'alt') if level == 1 else ('+', 'merge')
+        node, pos = _parse_selector_tokens(tokens, pos, level + 1)
+        children = [node]
+        while pos < len(tokens) and tokens[pos][0] == separator:
+            node, pos = _parse_selector_tokens(tokens, pos + 1, level + 1)
+            children.append(node)
+        return (children[0] if len(children) == 1 else (kind, children)), pos
+    if pos >= len(tokens): raise ValueError("Unexpected end of selector")
+    token, value = tokens[pos]
+    inner, spec = None, 'best' # A selector that starts with a filter means 'best[...]'
+    if token == '(':
+        inner, pos = _parse_selector_tokens(tokens, pos + 1, 0)
+        if pos >= len(tokens) or tokens[pos][0] != ')': raise ValueError("Unbalanced '(' in selector")
+        pos += 1
+    elif token == 'name': spec = value; pos += 1
+    elif token != 'filter': raise ValueError(f"Unexpected '{token}' in selector")
+    filters = []
+    while pos < len(tokens) and tokens[pos][0] == 'filter':
+        filters.extend(parse_filter(tokens[pos][1])); pos += 1
+    if inner is not None: return ('group', inner, tuple(filters)), pos
+    return ('select', spec, tuple(filters)), pos
+
+@functools.lru_cache(maxsize=256)
+def compile_selector(selector):
+    """Compiles a full yt-dlp format selector into a reusable plan. Raises ValueError on a malformed selector."""
+    tokens = _tokenize_selector(selector)
+    if not tokens: raise ValueError("Empty selector")
+    plan, pos = _parse_selector_tokens(tokens, 0, 0)
+    if pos != len(tokens): raise ValueError(f"Unexpected '{tokens[pos][0]}' in selector '{selector}'")
+    return plan
+
+def _plan_filter_keys(plan):
+    """Returns every format key referenced by filters in a plan."""
+    if plan[0] in ('list', 'alt', 'merge'): return set().union(*(_plan_filter_keys(child) for child in plan[1]))
+    keys = {flt[0] for flt in plan[2]}
+    if plan[0] == 'group': keys |= _plan_filter_keys(plan[1])
+    return keys
+
+# --- Per-Format Feature Table ---
+def build_format_table(available_formats, duration=None):
+    """
+    Precomputes per-format features once: type flags, size/method and rank.
+    Rank is the position in the formats list, which yt-dlp already sorts worst -> best, so
+    'best' means the highest-ranked match exactly as yt-dlp picks it.
+    """
+    formats = [fmt for fmt in available_formats if isinstance(fmt, dict)]
+    rows = []
+    for rank, fmt in enumerate(formats):
+        size, method = get_format_size_with_method(fmt, duration)
+        vcodec, acodec = fmt.get('vcodec'), fmt.get('acodec')
+        rows.append({'format': fmt, 'rank': rank, 'size': size, 'method': method, 'duration': fmt.get('duration') or duration,
+                     'has_video': vcodec != 'none', 'has_audio': acodec != 'none', 'ext': fmt.get('ext'),
+                     'segments': segments_from_fragments(fmt) if fmt.get('fragments') else None})
+    fingerprint = hash((duration, tuple(tuple(fmt.get(key) for key in FINGERPRINT_KEYS) for fmt in formats)))
+    incomplete = bool(rows) and (all(not row['has_video'] for row in rows) or all(not row['has_audio'] for row in rows))
+    return {'rows': rows, 'fingerprint': fingerprint, 'incomplete': incomplete, 'source': available_formats, 'duration': duration}
+
+_last_format_table = None
+
+def get_format_table(available_formats, duration=None):
+    """Returns the feature table for a formats list, reusing the previous one when called again with the same list."""
+    global _last_format_table
+    table = _last_format_table
+    if table is None or table['source'] is not available_formats or table['duration'] != duration:
+        table = build_format_table(available_formats, duration)
+        _last_format_table = table
+    return table
+
+def _select_rows(spec, rows, table):
+    """Applies one selector atom ('bv*', 'ba.2', 'mp4', a format ID, ...) to candidate rows; returns the chosen rows."""
+    if spec in ('all', 'mergeall'): return [row for row in rows if row['has_video'] or row['has_audio']] or None
+    match = SELECT_SPEC_PATTERN.match(spec)
+    fallback = False
+    if match:
+        index = int(match.group('n') or 1)
+        reverse = match.group('bw')[0] == 'b'
+        format_type = (match.group('type') or ' ')[0]
+        modified = match.group('mod') is not None
+        if format_type == 'v': predicate = (lambda row: row['has_video']) if modified else (lambda row: not row['has_audio'])
+        elif format_type == 'a': predicate = (lambda row: row['has_audio']) if modified else (lambda row: not row['has_video'])
+        elif not modified: predicate, fallback = (lambda row: row['has_video'] and row['has_audio']), True # b, w
+        else: predicate = lambda row: True # b*, w*
+        matches = [row for row in rows if predicate(row) and (row['has_video'] or row['has_audio'])]
+        if not matches and fallback and table['incomplete']: matches = rows # Audio-only (SoundCloud) or video-only sites
+    else:
+        index, reverse = 1, True
+        if spec in AUDIO_SELECTOR_EXTS: matches = [row for row in rows if row['ext'] == spec and row['has_audio']]
+        elif spec in VIDEO_SELECTOR_EXTS: matches = [row for row in rows if row['ext'] == spec and row['has_video'] and row['has_audio']]
+        else: matches = [row for row in rows if row['format'].get('format_id') == spec]
+    if len(matches) < index: return None
+    return [matches[-index] if reverse else matches[index - 1]]
+
+def _evaluate_plan(plan, rows, table):
+    """Evaluates a compiled plan; returns the list of chosen rows (one per downloaded part) or None."""
+    kind = plan[0]
+    if kind == 'alt':
+        for index, child in enumerate(plan[1], 1):
+            with timed(f"select_group_{index}") if TIMINGS_ENABLED else contextlib.nullcontext():
+                chosen = _evaluate_plan(child, rows, table)
+            if chosen: return chosen
+        return None
+    if kind in ('merge', 'list'):
+        chosen = []
+        for child in plan[1]:
+            part = _evaluate_plan(child, rows, table)
+            if not part: return None
+            chosen.extend(row for row in part if all(row is not seen for seen in chosen)) # Same format only downloaded once
+        return chosen
+    filters = plan[2]
+    if filters: rows = [row for row in rows if all(_filter_matches(row['format'], flt) for flt in filters)]
+    if kind == 'group': return _evaluate_plan(plan[1], rows, table)
+    return _select_rows(plan[1], rows, table)
+
+_selection_memo = {}
+_selection_memo_lock = threading.Lock() # Batch mode evaluates selectors from several worker threads
+_MEMO_MISS = object()
+
+def evaluate_selector(table, selector):
+    """
+    Returns the rows yt-dlp would download for a selector, memoised by (format-set fingerprint, selector).
+    Raises ValueError on a malformed selector.
+    """
+    plan = compile_selector(selector)
+    memo_key = (table['fingerprint'], selector)
+    cacheable = _plan_filter_keys(plan) <= set(FINGERPRINT_KEYS) # Filters on other keys aren't covered by the fingerprint
+    if cacheable:
+        with _selection_memo_lock: ranks = _selection_memo.get(memo_key, _MEMO_MISS)
+        if ranks is not _MEMO_MISS: return None if ranks is None else [table['rows'][rank] for rank in ranks]
+    chosen = _evaluate_plan(plan, table['rows'], table)
+    if cacheable:
+        with _selection_memo_lock:
+            if len(_selection_memo) >= SELECTION_MEMO_LIMIT: _selection_memo.clear()
+            _selection_memo[memo_key] = None if chosen is None else tuple(row['rank'] for row in chosen)
+    return chosen
+
+# --- select_best_filtered_format (Compiled Selector Engine) ---
+def select_best_filtered_format(available_formats, selector):
+    """Selects the format yt-dlp would pick for a single-part selector (e.g. 'bv[ext=mp4][height<=1440]')."""
+    if not available_formats or not selector: return None
+    try: chosen = evaluate_selector(get_format_table(available_formats), selector)
+    except ValueError as e:
+        error_print("  Invalid selector '%s': %s", selector, e)
+        return None
+    if not chosen: return None
+    debug_print("  Selected Best for '%s': ID=%s, Size=%s", selector, chosen[0]['format'].get('format_id', 'N/A'), chosen[0]['size'])
+    return chosen[0]['format']
+
+# --- Info-JSON Parsing ---
+# A --dump-json document for a long video is mostly automatic_captions/thumbnails/heatmap. The estimator,
+# the download (--load-info-json) and enrichment never read them, so they are dropped right after parsing
+# (the C json decoder is several times faster than skipping them in Python) and never cached or written back.
+def loads_info_json(text, drop_keys=None):
+    """json.loads for an info dict, then drops the top-level keys in drop_keys (default: PRUNED_INFO_KEYS when pruning is on)."""
+    if drop_keys is None: drop_keys = PRUNED_INFO_KEYS if PRUNE_INFO else ()
+    media_info = json.loads(text)
+    if isinstance(media_info, dict):
+        for key in drop_keys: media_info.pop(key, None)
+    return media_info
+
+def prune_info(media_info):
+    """Drops PRUNED_INFO_KEYS from an info dict in place (no-op when pruning is off)."""
+    if PRUNE_INFO and isinstance(media_info, dict):
+        for key in PRUNED_INFO_KEYS: media_info.pop(key, None)
+    return media_info
+
+# --- Info-JSON Cache Helpers ---
+YOUTUBE_ID_PATTERN = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/|/v/)([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])")
+BILIBILI_ID_PATTERN = re.compile(r"bilibili\.com/video/(BV[0-9A-Za-z]{10}|av\d+)", re.IGNORECASE)
+EXPIRE_PATH_PATTERN = re.compile(r"/expire/(\d+)")
 
-    # Prioritize ext filter
-    if 'ext' in filters:
-        op_ext, expected_ext = filters['ext']
-        actual_ext = format_info.get('ext', '')
-        if op_ext == '==' and str(actual_ext).lower() != str(expected_ext).lower():
-            return False # Ext mismatch
-
-    # Check other filters
-    for key, (op, expected_value) in filters.items():
-        if key == 'ext': continue # Already checked
-        actual_value = format_info.get(key)
-        if actual_value is None: return False # Key missing
+def cache_key_for_url(url):
+    """Returns the canonical cache key for a URL ('youtube_<id>'), or None if the ID can't be derived without extraction."""
+    if not url: return None
+    match = YOUTUBE_ID_PATTERN.search(url)
+    if match and ('youtube.com' in url or 'youtu.be' in url): return f"youtube_{match.group(1)}"
+    match = BILIBILI_ID_PATTERN.search(url)
+    if match: return f"bilibili_{match.group(1)}"
+    return None
+
+def cache_key_for_info(media_info):
+    """Returns the canonical cache key for an extracted info dict ('<extractor>_<id>')."""
+    video_id = media_info.get('id')
+    extractor = str(media_info.get('extractor_key') or media_info.get('extractor') or '').lower()
+    if not video_id or not extractor: return None
+    if extractor.startswith('youtube'): extractor = 'youtube'
+    if extractor.startswith('bili'): extractor = 'bilibili'
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', f"{extractor}_{video_id}")
+
+def cache_key_for_unknown_url(url):
+    """Fallback key for sites whose ID pattern is unknown; used only as an alias next to the canonical entry."""
+    return "url_" + hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+
+def _expire_from_url(url):
+    if not isinstance(url, str) or 'expire' not in url: return None
+    try:
+        values = parse_qs(urlparse(url).query).get('expire')
+        if values: return int(values[0])
+    except (ValueError, TypeError): return None
+    match = EXPIRE_PATH_PATTERN.search(url) # googlevideo manifest URLs carry /expire/<ts>/ in the path
+    return int(match.group(1)) if match else None
+
+def get_info_expiry(media_info):
+    """Returns the earliest 'expire=' timestamp found in the format URLs, or None if no URL is signed."""
+    expiries = []
+    for fmt in media_info.get('formats') or [media_info]:
+        if not isinstance(fmt, dict): continue
+        for field in ('url', 'manifest_url', 'fragment_base_url'):
+            expire = _expire_from_url(fmt.get(field))
+            if expire: expiries.append(expire)
+    return min(expiries) if expiries else None
+
+def read_info_json(path):
+    """Loads an info-JSON file if it exists and its signed URLs are still valid; returns None otherwise."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f: text = f.read()
+        with timed('json_parse'): media_info = loads_info_json(text)
+        del text
+    except FileNotFoundError: return None
+    except (OSError, ValueError) as e:
+        warning_print("Ignoring unreadable info JSON '%s': %s", path, e); return None
+    if isinstance(media_info, list): media_info = media_info[0] if media_info else None
+    if not isinstance(media_info, dict): return None
+    expires_at = get_info_expiry(media_info)
+    if expires_at is None:
+        try: expires_at = os.path.getmtime(path) + INFO_JSON_DEFAULT_TTL
+        except OSError: return None
+    if time.time() + INFO_JSON_EXPIRY_MARGIN >= expires_at and not IGNORE_INFO_EXPIRY:
+        debug_print("Info JSON '%s' expired at %s.", path, expires_at)
+        return None
+    return media_info
+
+def write_info_json(path, media_info):
+    """Writes an info dict atomically so concurrent readers never see a partial file."""
+    try:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Unique per writer: batch/probe worker threads of one process may write the same path concurrently
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{os.path.basename(path)}.", suffix=".tmp")
         try:
-            if op == '==':
-                if str(actual_value) != str(expected_value): return False
-            elif op == '<=':
-                if not (isinstance(actual_value, (int, float)) and actual_value <= expected_value): return False
-            elif op == '>=':
-                 if not (isinstance(actual_value, (int, float)) and actual_value >= expected_value): return False
+            with os.fdopen(fd, 'w', encoding='utf-8') as f: json.dump(media_info, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError): os.remove(tmp_path)
+            raise
+        return True
+    except OSError as e:
+        warning_print("Could not write info JSON '%s': %s", path, e)
+        return False
+
+def cache_path_for_key(key):
+    return os.path.join(INFO_JSON_CACHE_DIR, f"{key}.info.json")
+
+def load_cached_info(url):
+    """Looks up the info-JSON cache for a URL. Expired entries are removed."""
+    for key in (cache_key_for_url(url), cache_key_for_unknown_url(url)):
+        if not key: continue
+        path = cache_path_for_key(key)
+        media_info = read_info_json(path)
+        if media_info is not None:
+            debug_print("Info-JSON cache hit: %s", path)
+            return media_info
+        if os.path.exists(path):
+            try: os.remove(path)
+            except OSError: pass
+    return None
+
+def store_cached_info(url, media_info):
+    """Stores an info dict under its canonical video ID (plus a URL alias when the ID can't be derived from the URL)."""
+    key = cache_key_for_info(media_info) or cache_key_for_url(url)
+    if not key: return None
+    path = cache_path_for_key(key)
+    if not write_info_json(path, media_info): return None
+    if cache_key_for_url(url) is None:
+        alias_path = cache_path_for_key(cache_key_for_unknown_url(url))
+        try:
+            if os.path.lexists(alias_path): os.remove(alias_path)
+            os.symlink(os.path.basename(path), alias_path)
+        except OSError: write_info_json(alias_path, media_info)
+    return path
+
+# --- Metadata Extraction ---
+EXTRACTION_BACKENDS = ('auto', 'module', 'subprocess', 'piped')
+_yt_dlp_module = None # Lazily imported; None = not tried yet, False = not importable
+
+def load_yt_dlp_module():
+    """Imports yt_dlp once. Returns the module, or None if it isn't importable."""
+    global _yt_dlp_module
+    if _yt_dlp_module is None:
+        try:
+            import yt_dlp
+            _yt_dlp_module = yt_dlp
+        except Exception as e: # ImportError, or a broken install
+            debug_print("yt_dlp module not importable (%s); falling back to subprocess backend.", e)
+            _yt_dlp_module = False
+    return _yt_dlp_module or None
+
+def _first_entry(media_info):
+    """Mirrors the subprocess path, which only keeps the first entry of a playlist result."""
+    while isinstance(media_info, dict) and media_info.get('_type') == 'playlist':
+        entries = [e for e in (media_info.get('entries') or []) if e]
+        if not entries: raise ValueError("Playlist result contains no entries.")
+        media_info = entries[0]
+    return media_info
+
+def extract_media_info_module(url):
+    """Extracts metadata in-process via yt_dlp.YoutubeDL.extract_info(download=False). Raises on failure."""
+    yt_dlp = load_yt_dlp_module()
+    if yt_dlp is None: raise ImportError("yt_dlp module not importable.")
+    ydl_opts = {'quiet': True, 'no_warnings': True, 'skip_download': True, 'noprogress': True, 'noplaylist': True}
+    debug_print("Running: yt_dlp.YoutubeDL.extract_info('%s', download=False)", url)
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with timed('extract'): media_info = ydl.extract_info(url, download=False)
+        if not media_info: raise ValueError("yt_dlp returned no info.")
+        with timed('sanitize'): media_info = ydl.sanitize_info(prune_info(_first_entry(media_info))) # JSON-safe, same shape as --dump-json
+    if not isinstance(media_info, dict): raise TypeError("Extracted info not a dict.")
+    return media_info
+
+def extract_media_info_subprocess(url):
+    """Runs yt-dlp --dump-json for a URL and returns the parsed info dict. Raises on failure."""
+    yt_dlp_cmd = shutil.which("yt-dlp")
+    if not yt_dlp_cmd or not os.path.exists(yt_dlp_cmd): raise FileNotFoundError("yt-dlp not found.")
+    command = [yt_dlp_cmd, "--no-warnings", "--dump-json", url]
+    debug_print("Running: %s", LazyJoin(command))
+    with timed('extract'): process = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', check=False, timeout=60)
+    debug_print("yt-dlp exited with code %s", process.returncode)
+    if process.returncode != 0 or not process.stdout.strip(): raise ValueError(f"yt-dlp failed or empty output.\nstderr:\n{process.stderr}")
+    with timed('json_parse'): media_info = loads_info_json(process.stdout)
+    if isinstance(media_info, list): media_info = media_info[0] # Take first if list
+    if not isinstance(media_info, dict): raise TypeError("Parsed JSON not a dict.")
+    return media_info
+
+# --- Piped API Backend (YouTube only) ---
+# One small /streams/{id} request instead of a full yt-dlp extraction. Streams are mapped to yt-dlp-style
+# format dicts and sorted worst -> best so the selector engine works unchanged. The result is only good
+# for estimation: it is never written to the info-JSON cache or --info-json (yt-dlp can't download from it).
+def _codec_preference(codec, preference):
+    family = str(codec or '').split('.', 1)[0].lower()
+    return preference.index(family) if family in preference else -1
+
+def piped_stream_to_format(stream, duration=None, is_video=False):
+    """Maps one Piped audioStreams/videoStreams entry to a yt-dlp-style format dict."""
+    mime_type = str(stream.get('mimeType') or '').split(';', 1)[0].strip().lower()
+    codecs = [c.strip() for c in str(stream.get('codec') or '').split(',') if c.strip()]
+    if is_video:
+        vcodec = codecs[0] if codecs else 'unknown'
+        acodec = 'none' if stream.get('videoOnly', True) else (codecs[1] if len(codecs) > 1 else 'mp4a.40.2')
+    else: vcodec, acodec = 'none', codecs[0] if codecs else 'unknown'
+    bitrate = (stream.get('bitrate') or 0) / 1000 or None
+    format_id = str(stream.get('itag') or stream.get('quality') or 'piped')
+    if stream.get('audioTrackId'): format_id += f"-{stream['audioTrackId']}"
+    fmt = {'format_id': format_id, 'url': stream.get('url'), 'protocol': 'https', 'ext': PIPED_MIME_EXTS.get(mime_type, mime_type.split('/')[-1] or None),
+           'vcodec': vcodec, 'acodec': acodec, 'tbr': bitrate, 'filesize': stream.get('contentLength') or None, 'format_note': stream.get('quality'),
+           'language': stream.get('audioTrackLocale'), 'audio_track_type': stream.get('audioTrackType')}
+    if is_video:
+        fmt.update(width=stream.get('width') or None, height=stream.get('height') or None, fps=stream.get('fps') or None)
+        if acodec == 'none': fmt['vbr'] = bitrate
+    else: fmt['abr'] = bitrate
+    if duration: fmt['duration'] = duration
+    return fmt
+
+def _piped_sort_key(fmt):
+    """Approximates yt-dlp's default sort: video before audio-only, original audio track, resolution, fps, codec, bitrate."""
+    has_video = fmt['vcodec'] != 'none'
+    original_track = str(fmt.get('audio_track_type') or 'original').lower() == 'original'
+    return (has_video, original_track, fmt.get('height') or 0, fmt.get('fps') or 0, _codec_preference(fmt['vcodec'], VCODEC_PREFERENCE),
+            _codec_preference(fmt['acodec'], ACODEC_PREFERENCE), fmt.get('tbr') or 0)
+
+def piped_streams_to_info(data, video_id):
+    """Converts a Piped /streams response to an info dict with yt-dlp-style 'formats' (sorted worst -> best)."""
+    duration = data.get('duration') or None
+    formats = [piped_stream_to_format(s, duration) for s in data.get('audioStreams') or [] if s.get('url')]
+    formats += [piped_stream_to_format(s, duration, is_video=True) for s in data.get('videoStreams') or [] if s.get('url')]
+    if not formats: raise ValueError("Piped response has no audio or video streams.")
+    formats.sort(key=_piped_sort_key)
+    return {'id': video_id, 'title': data.get('title') or video_id, 'duration': duration, 'uploader': data.get('uploader'),
+            'extractor': 'youtube', 'extractor_key': 'Youtube', 'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'formats': formats, '_source': 'piped'}
+
+def read_cached_piped_streams(video_id):
+    """Returns the cached /streams response for a video while its signed URLs are still valid, else None."""
+    try:
+        with open(os.path.join(PIPED_STREAMS_CACHE_DIR, f"{video_id}.json"), 'r', encoding='utf-8') as f: entry = json.load(f)
+    except (OSError, ValueError): return None
+    if not isinstance(entry, dict) or not isinstance(entry.get('data'), dict): return None
+    if time.time() + INFO_JSON_EXPIRY_MARGIN >= entry.get('expires_at', 0) and not IGNORE_INFO_EXPIRY: return None
+    return entry['data']
+
+def extract_media_info_piped(url, instance=None, timeout=PIPED_TIMEOUT, use_cache=True):
+    """Fetches /streams/{id} from a Piped instance (or the shared streams cache) for a YouTube URL. Raises on failure."""
+    key = cache_key_for_url(url)
+    if not key or not key.startswith('youtube_'): raise ValueError("Piped backend only handles YouTube video URLs.")
+    video_id = key[len('youtube_'):]
+    data = read_cached_piped_streams(video_id) if use_cache else None
+    if data is not None:
+        debug_print("Using cached Piped streams for %s.", video_id)
+        return piped_streams_to_info(data, video_id)
+    api_url = f"{(instance or PIPED_INSTANCE).rstrip('/')}/streams/{video_id}"
+    debug_print("Fetching Piped streams: %s", api_url)
+    with timed('extract'): response, body = _probe_request('GET', api_url, {'User-Agent': 'Mozilla/5.0', 'Accept': 'application/json'}, timeout)
+    if response.status != 200: raise ValueError(f"Piped returned HTTP {response.status}.")
+    with timed('json_parse'): data = json.loads(body)
+    if data.get('error'): raise ValueError(f"Piped error: {data.get('message') or data['error']}")
+    info = piped_streams_to_info(data, video_id)
+    write_info_json(os.path.join(PIPED_STREAMS_CACHE_DIR, f"{video_id}.json"), {
+        'video_id': video_id, 'fetched_at': int(time.time()), 'data': data,
+        'expires_at': get_info_expiry(info) or int(time.time()) + INFO_JSON_DEFAULT_TTL})
+    return info
+
+def extract_media_info(url, backend='auto'):
+    """
+    Extracts the info dict for a URL.
+    'module' runs yt-dlp in this interpreter (no second interpreter start-up, no JSON round trip);
+    'subprocess' shells out to the yt-dlp executable; 'auto' uses the module when it is importable.
+    'piped' asks a Piped instance for YouTube URLs and falls back to 'auto' on any failure.
+    """
+    if backend == 'piped':
+        try: return extract_media_info_piped(url)
         except Exception as e:
-             warning_print(f"      Filter comparison error: key='{key}', error={e}")
-             return False
-    return True # Passed all checks
+            debug_print("Piped backend failed (%s); falling back to yt-dlp.", e)
+            backend = 'auto'
+    if backend == 'subprocess': return extract_media_info_subprocess(url)
+    if backend == 'module' or load_yt_dlp_module() is not None: return extract_media_info_module(url)
+    return extract_media_info_subprocess(url)
 
-# --- select_best_filtered_format (Using Corrected Type Match & Filters) ---
-def select_best_filtered_format(available_formats, selector):
-    """Selects the best format based on type, filters, and sorting preference."""
-    debug_print(f"\n===== Running select_best_filtered_format for selector: '{selector}' =====")
-    if not available_formats or not selector: return None # Exit A
-
-    base_selector = selector.split('[', 1)[0]
-    filter_str = '[' + selector.split('[', 1)[1] if '[' in selector else ''
-    filters = parse_filter(filter_str)
-    debug_print(f"  Base selector='{base_selector}', Parsed filters={filters}")
-
-    # --- Step 1: Filter by TYPE ---
-    type_matched_formats = []
-    debug_print(f"  Step 1: Filtering {len(available_formats)} formats by TYPE ('{base_selector}')...")
-    for fmt in available_formats:
-        format_id = fmt.get('format_id', 'N/A')
-        vcodec = fmt.get('vcodec')
-        acodec = fmt.get('acodec')
-        has_video = vcodec is not None and vcodec != 'none'
-        has_audio = acodec is not None and acodec != 'none'
-        is_video_only = has_video and not has_audio
-        is_audio_only = has_audio and not has_video
-        is_merged = has_video and has_audio
-
-        type_match_passed = False
-        if base_selector.startswith('bv'):
-            if is_video_only: type_match_passed = True
-        elif base_selector.startswith('ba'):
-            if is_audio_only: type_match_passed = True
-        elif base_selector == 'b' or base_selector == 'best':
-             if is_video_only or is_audio_only or is_merged: type_match_passed = True
-        elif base_selector not in ['bv', 'ba', 'b', 'best']: # Corrected else if
-             type_match_passed = True # Assume specific ID
-
-        if type_match_passed: type_matched_formats.append(fmt)
-
-    debug_print(f"  Step 1 Result: {len(type_matched_formats)} formats passed TYPE filter.")
-    if not type_matched_formats: return None # Exit B1
-
-    # --- Step 2: Filter by explicit FILTERS ---
-    filtered_formats = []
-    debug_print(f"  Step 2: Applying explicit filters {filters} to {len(type_matched_formats)} candidates...")
-    if filters:
-        for fmt in type_matched_formats:
-            if format_matches_filters(fmt, filters): # <<< Use corrected function
-                filtered_formats.append(fmt)
-        debug_print(f"  Step 2 Result: {len(filtered_formats)} formats passed explicit filters.")
+def benchmark_backends(url, runs=3):
+    """Times each extraction backend on the same URL (cache bypassed) and returns {backend: stats}."""
+    results = {}
+    import_start = time.perf_counter()
+    module_available = load_yt_dlp_module() is not None
+    import_seconds = time.perf_counter() - import_start
+    for backend in ('module', 'subprocess', 'piped'):
+        if backend == 'module' and not module_available:
+            results[backend] = {'error': 'yt_dlp module not importable'}; continue
+        if backend == 'piped' and not str(cache_key_for_url(url)).startswith('youtube_'): continue
+        timings = []
+        try:
+            for _ in range(max(1, runs)):
+                start = time.perf_counter()
+                if backend == 'piped': extract_media_info_piped(url, use_cache=False) # No silent fallback while benchmarking
+                else: extract_media_info(url, backend=backend)
+                timings.append(time.perf_counter() - start)
+        except Exception as e:
+            results[backend] = {'error': str(e)}; continue
+        timings.sort()
+        results[backend] = {'runs': len(timings), 'min_s': round(timings[0], 3), 'median_s': round(timings[len(timings) // 2], 3), 'max_s': round(timings[-1], 3)}
+    if module_available: results['module']['import_s'] = round(import_seconds, 3) # One-off cost per estimate_size.py run
+    return results
+
+def get_media_info(url, info_json_path=None, use_cache=True, backend='auto'):
+    """
+    Returns the info dict for a URL, extracting at most once per video:
+    1. A still-valid --info-json file.
+    2. The on-disk info-JSON cache (keyed by canonical video ID).
+    3. A fresh yt-dlp extraction (see extract_media_info), which is then written to both.
+    """
+    media_info = read_info_json(info_json_path) if info_json_path else None
+    if media_info is not None:
+        debug_print("Using info JSON from '%s'.", info_json_path)
+        return media_info
+    if use_cache and url: media_info = load_cached_info(url)
+    if media_info is None:
+        if not url: raise ValueError("No URL given and no valid info JSON available.")
+        media_info = extract_media_info(url, backend=backend)
+        if media_info.get('_source') == 'piped': return media_info # Estimation only; yt-dlp can't --load-info-json it
+        if use_cache: store_cached_info(url, media_info)
+    if info_json_path: write_info_json(info_json_path, media_info)
+    return media_info
+
+# --- Exact Size Probing (HEAD / Range: bytes=0-0) ---
+_probe_local = threading.local() # Per-thread keep-alive connections: {(scheme, netloc): HTTPConnection}
+_probe_cache = None              # {url_hash: {'size': int, 'expires_at': float}}, loaded lazily from PROBE_CACHE_PATH
+_probe_cache_lock = threading.RLock() # Guards _probe_cache (load, reads, updates, snapshot) and the pool
+_probe_pool = None               # Shared worker pool, so its threads' keep-alive connections outlive a single estimate
+CONTENT_RANGE_PATTERN = re.compile(r"bytes\s+\d+-\d+/(\d+)")
+
+def _get_probe_connection(scheme, netloc, timeout):
+    connections = getattr(_probe_local, 'connections', None)
+    if connections is None: connections = _probe_local.connections = {}
+    conn = connections.get((scheme, netloc))
+    if conn is None:
+        conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        conn = connections[(scheme, netloc)] = conn_class(netloc, timeout=timeout)
+    return conn
+
+def _drop_probe_connection(scheme, netloc):
+    conn = getattr(_probe_local, 'connections', {}).pop((scheme, netloc), None)
+    if conn is not None: conn.close()
+
+def _probe_request(method, url, headers, timeout, read_body=True):
+    """
+    Sends one request over the pooled connection for url's host (retrying once on a stale keep-alive socket); returns (response, body).
+    With read_body=False the body is left unread (body is None) and the caller must drain it or drop the connection.
+    """
+    parsed = urlparse(url)
+    path = parsed.path or '/'
+    if parsed.query: path += '?' + parsed.query
+    for attempt in (1, 2):
+        conn = _get_probe_connection(parsed.scheme, parsed.netloc, timeout)
+        try:
+            conn.request(method, path, headers=headers)
+            response = conn.getresponse()
+            if not read_body: return response, None
+            if 'Range' in headers and response.status != 206:
+                # The server ignored the Range: never pull a whole media file into memory just to reuse the socket
+                _drop_probe_connection(parsed.scheme, parsed.netloc)
+                return response, b''
+            body = response.read() # Drain (HEAD: empty, Range: 1 byte) so the connection can be reused
+            return response, body
+        except (http.client.HTTPException, OSError):
+            _drop_probe_connection(parsed.scheme, parsed.netloc)
+            if attempt == 2: raise
+
+def probe_url_size(url, headers=None, timeout=PROBE_TIMEOUT):
+    """Returns the exact byte size of a URL from Content-Length (HEAD) or Content-Range (Range: bytes=0-0), or None."""
+    headers = dict(headers or {})
+    for method, extra in (('HEAD', {}), ('GET', {'Range': 'bytes=0-0'})):
+        target = url
+        for _ in range(4): # Follow up to 3 redirects
+            response, _ = _probe_request(method, target, dict(headers, **extra), timeout)
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                target = urljoin(target, response.getheader('Location')); continue
+            break
+        if method == 'HEAD' and response.status == 200:
+            length = response.getheader('Content-Length')
+            if length and length.isdigit() and int(length) > 0: return int(length)
+        elif method == 'GET' and response.status == 206:
+            match = CONTENT_RANGE_PATTERN.search(response.getheader('Content-Range') or '')
+            if match: return int(match.group(1))
+        elif method == 'GET' and response.status == 200: # Range ignored: the full-body Content-Length is still the size
+            length = response.getheader('Content-Length')
+            if length and length.isdigit() and int(length) > 0: return int(length)
+    return None
+
+def _load_probe_cache():
+    global _probe_cache
+    with _probe_cache_lock:
+        if _probe_cache is None:
+            try:
+                with open(PROBE_CACHE_PATH, 'r', encoding='utf-8') as f: _probe_cache = json.load(f)
+                if not isinstance(_probe_cache, dict): _probe_cache = {}
+            except (OSError, ValueError): _probe_cache = {}
+        return _probe_cache
+
+def _save_probe_cache():
+    now = time.time()
+    with _probe_cache_lock:
+        cache = {key: entry for key, entry in _load_probe_cache().items() if entry.get('expires_at', 0) > now}
+    write_info_json(PROBE_CACHE_PATH, cache)
+
+def _probe_cache_key(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+def is_probeable(format_info):
+    """Only plain HTTP(S) downloads can be sized by a single request; manifests and fragments are handled elsewhere."""
+    url = format_info.get('url')
+    protocol = format_info.get('protocol') or 'https'
+    return isinstance(url, str) and url.startswith(('http://', 'https://')) and protocol in ('http', 'https') and not format_info.get('fragments')
+
+def _get_probe_pool():
+    global _probe_pool
+    with _probe_cache_lock:
+        if _probe_pool is None: _probe_pool = ThreadPoolExecutor(max_workers=PROBE_DEFAULT_JOBS, thread_name_prefix="probe")
+    return _probe_pool
+
+def is_manifest_format(format_info):
+    return (format_info.get('protocol') or '') in MANIFEST_PROTOCOLS
+
+def probe_row_sizes(rows, timeout=PROBE_TIMEOUT):
+    """
+    Replaces bitrate/unknown sizes of the given feature-table rows with exact sizes: 'probe' for plain HTTP
+    formats, 'manifest' for DASH/HLS formats whose manifest lists segment byte ranges.
+    Rows that already carry 'filesize'/'approx' are left alone; results are cached on disk until the URL expires.
+    """
+    pending = []
+    seen = set()
+    cache = _load_probe_cache()
+    now = time.time()
+    for row in rows:
+        if row['method'] not in ('bitrate', 'none') or id(row) in seen: continue
+        if not (is_probeable(row['format']) or is_manifest_format(row['format'])): continue
+        seen.add(id(row))
+        with _probe_cache_lock: entry = cache.get(_probe_cache_key(row['format']['url']))
+        if entry and entry.get('expires_at', 0) > now:
+            row['size'], row['method'] = entry['size'], entry.get('method', 'probe')
+        else: pending.append(row)
+    if not pending: return
+    def probe(row):
+        fmt = row['format']
+        try:
+            if is_probeable(fmt): return row, probe_url_size(fmt['url'], fmt.get('http_headers'), timeout), 'probe'
+            manifest = fetch_manifest_segments(fmt, timeout)
+            if not manifest: return row, None, None
+            row['segments'], row['init_size'] = manifest['segments'], manifest['init_size']
+            return row, size_from_segments(manifest['segments'], manifest['init_size'], row['duration']), 'manifest'
+        except Exception as e:
+            debug_print("    Probe failed for format %s: %s", fmt.get('format_id'), e)
+            return row, None, None
+    for row, size, method in _get_probe_pool().map(probe, pending):
+        if not size: continue
+        debug_print("    Probed format %s: %s bytes via %s (was %s via %s)", row['format'].get('format_id'), size, method, row['size'], row['method'])
+        row['size'], row['method'] = size, method
+        url = row['format']['url']
+        with _probe_cache_lock:
+            cache[_probe_cache_key(url)] = {'size': size, 'method': method, 'expires_at': _expire_from_url(url) or (now + INFO_JSON_DEFAULT_TTL)}
+    _save_probe_cache()
+
+# --- Manifest-Aware Sizes (DASH / HLS fragments) ---
+_manifest_cache = {} # {manifest_url: parsed manifest or None}; each manifest is fetched and parsed once per run
+_manifest_lock = threading.Lock()
+MANIFEST_PROTOCOLS = ('m3u8', 'm3u8_native', 'http_dash_segments', 'dash', 'http_dash_segments_generator')
+
+def _parse_byte_range(value):
+    """Returns the length of an 'a-b' (inclusive) byte range, or None."""
+    if not isinstance(value, str): return None
+    start, sep, end = value.strip().partition('-')
+    if not sep or not start.isdigit() or not end.isdigit() or int(end) < int(start): return None
+    return int(end) - int(start) + 1
+
+def size_from_segments(segments, init_size=0, total_duration=None):
+    """
+    Sums segment sizes. If only some segments carry a size, the known bytes are scaled up by duration.
+    Returns None when no segment has byte information.
+    """
+    known_bytes = sum(seg['size'] for seg in segments if seg.get('size'))
+    if not known_bytes: return None
+    if all(seg.get('size') for seg in segments): return int(known_bytes + (init_size or 0))
+    known_duration = sum(seg.get('duration') or 0 for seg in segments if seg.get('size'))
+    if total_duration is None: total_duration = sum(seg.get('duration') or 0 for seg in segments)
+    if not known_duration or not total_duration: return None
+    return int(known_bytes * total_duration / known_duration + (init_size or 0))
+
+def segments_from_fragments(format_info):
+    """Converts yt-dlp's 'fragments' list into [{'duration', 'size'}] using per-fragment 'filesize' or 'range'."""
+    segments = []
+    for fragment in format_info.get('fragments') or []:
+        if not isinstance(fragment, dict): continue
+        size = fragment.get('filesize')
+        if not (isinstance(size, (int, float)) and size > 0): size = _parse_byte_range(fragment.get('range'))
+        segments.append({'duration': fragment.get('duration'), 'size': size})
+    return segments
+
+def parse_m3u8_segments(text):
+    """Parses an HLS media playlist into {'segments': [{'duration', 'size'}], 'init_size'}; None for master playlists."""
+    segments, init_size, duration, byte_length = [], 0, None, None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF'): return None
+        if line.startswith('#EXTINF:'):
+            try: duration = float(line[8:].split(',', 1)[0])
+            except ValueError: duration = None
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            length = line[17:].split('@', 1)[0]
+            byte_length = int(length) if length.isdigit() else None
+        elif line.startswith('#EXT-X-MAP:'):
+            match = re.search(r'BYTERANGE="(\d+)', line)
+            if match: init_size = int(match.group(1))
+        elif line and not line.startswith('#'):
+            segments.append({'duration': duration, 'size': byte_length})
+            duration, byte_length = None, None
+    return {'segments': segments, 'init_size': init_size} if segments else None
+
+def parse_mpd_representations(text):
+    """Parses the SegmentList byte ranges of every DASH Representation into {rep_id: {'segments', 'init_size'}}, or None."""
+    try: root = ElementTree.fromstring(text)
+    except ElementTree.ParseError: return None
+    for element in root.iter(): element.tag = element.tag.rsplit('}', 1)[-1] # Drop XML namespaces
+    representations = {}
+    for representation in root.iter('Representation'):
+        rep_id = representation.get('id')
+        segment_list = representation.find('SegmentList')
+        if not rep_id or segment_list is None: continue
+        timescale = float(segment_list.get('timescale') or 1)
+        seg_duration = float(segment_list.get('duration')) / timescale if segment_list.get('duration') else None
+        initialization = segment_list.find('Initialization')
+        init_size = _parse_byte_range(initialization.get('range')) if initialization is not None else 0
+        segments = [{'duration': seg_duration, 'size': _parse_byte_range(seg.get('mediaRange'))} for seg in segment_list.iter('SegmentURL')]
+        if segments: representations[rep_id] = {'segments': segments, 'init_size': init_size or 0}
+    return representations
+
+def _find_representation(representations, representation_id):
+    """yt-dlp format IDs are the Representation id, optionally prefixed ('dash-<id>')."""
+    if not representations: return None
+    if str(representation_id) in representations: return representations[str(representation_id)]
+    return next((info for rep_id, info in representations.items() if str(representation_id).endswith('-' + rep_id)), None)
+
+def parse_mpd_segments(text, representation_id):
+    """Parses the SegmentList byte ranges of one DASH Representation into {'segments', 'init_size'}, or None."""
+    return _find_representation(parse_mpd_representations(text), representation_id)
+
+def fetch_manifest_segments(format_info, timeout=PROBE_TIMEOUT):
+    """Fetches and parses the HLS/DASH manifest behind a format (once per manifest URL); returns {'segments', 'init_size'} or None."""
+    protocol = format_info.get('protocol') or ''
+    is_hls = protocol.startswith('m3u8')
+    manifest_url = format_info.get('url') if is_hls else (format_info.get('manifest_url') or format_info.get('url'))
+    if not isinstance(manifest_url, str) or not manifest_url.startswith(('http://', 'https://')): return None
+    with _manifest_lock:
+        cached = manifest_url in _manifest_cache
+        parsed = _manifest_cache.get(manifest_url)
+    if not cached:
+        target = manifest_url
+        for _ in range(4): # Follow up to 3 redirects
+            response, body = _probe_request('GET', target, dict(format_info.get('http_headers') or {}), timeout)
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                target = urljoin(target, response.getheader('Location')); continue
+            break
+        if response.status != 200: return None
+        text = body.decode('utf-8', errors='replace')
+        # An MPD is parsed once for all of its Representations; the other formats of the same manifest reuse it
+        parsed = parse_m3u8_segments(text) if is_hls else parse_mpd_representations(text)
+        with _manifest_lock: _manifest_cache[manifest_url] = parsed
+    if is_hls: return parsed
+    return _find_representation(parsed, format_info.get('format_id'))
+
+# --- Time-Range (Section) Estimation ---
+def parse_timestamp(value):
+    """Parses 'HH:MM:SS(.ms)', 'MM:SS', plain seconds or 'inf' into seconds. Raises ValueError."""
+    value = str(value).strip()
+    if value.lower() in ('inf', 'infinite', ''): return float('inf')
+    seconds = 0.0
+    for part in value.split(':'): seconds = seconds * 60 + float(part)
+    if seconds < 0: raise ValueError(f"Negative timestamp '{value}'")
+    return seconds
+
+def parse_download_sections(specs, start=None, end=None):
+    """
+    Builds [(start, end)] from yt-dlp style '--download-sections "*START-END"' specs and/or --start/--end.
+    Chapter-title sections (no leading '*') can't be resolved without chapters and are rejected.
+    """
+    sections = []
+    for spec in specs or []:
+        for item in spec.split(','):
+            item = item.strip()
+            if not item: continue
+            if not item.startswith('*'): raise ValueError(f"Only time-range sections ('*START-END') are supported, got '{item}'")
+            match = re.match(r"^\*\s*(-?[^-]+?)\s*-\s*(.+)$", item)
+            if not match: raise ValueError(f"Invalid section '{item}'")
+            sections.append((parse_timestamp(match.group(1)), parse_timestamp(match.group(2))))
+    if start is not None or end is not None:
+        sections.append((parse_timestamp(start) if start is not None else 0.0, parse_timestamp(end) if end is not None else float('inf')))
+    for section_start, section_end in sections:
+        if section_end <= section_start: raise ValueError(f"Section end must be after start ({section_start}-{section_end})")
+    return sections
+
+def _clip_sections(sections, duration):
+    """Clips sections to [0, duration] and merges overlaps so no second is counted twice."""
+    clipped = sorted((max(0.0, start), min(end, duration)) for start, end in sections if start < duration)
+    merged = []
+    for start, end in clipped:
+        if end <= start: continue
+        if merged and start <= merged[-1][1]: merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else: merged.append((start, end))
+    return merged
+
+def section_size(row, sections):
+    """
+    Estimates the bytes a section download of one format fetches.
+    Fragmented formats count every segment that overlaps a section (segments are fetched whole) plus the
+    initialization segment once per section;
+    otherwise the size is scaled by span / duration, plus one keyframe interval per section for video,
+    since cuts start at the preceding keyframe. Returns the full size if the duration is unknown.
+    """
+    duration, full_size = row.get('duration'), row['size']
+    if not full_size or not isinstance(duration, (int, float)) or duration <= 0: return full_size
+    spans = _clip_sections(sections, duration)
+    if not spans: return 0
+    segments = row.get('segments') or []
+    if segments and all(seg.get('duration') for seg in segments):
+        selected_bytes, selected_duration, position = 0, 0.0, 0.0
+        for seg in segments:
+            seg_start, seg_end = position, position + seg['duration']
+            position = seg_end
+            if any(seg_start < end and seg_end > start for start, end in spans):
+                selected_duration += seg['duration']
+                selected_bytes += seg.get('size') or 0
+        init_bytes = (row.get('init_size') or 0) * len(spans)
+        if all(seg.get('size') for seg in segments): return int(selected_bytes + init_bytes)
+        media_size = full_size - (row.get('init_size') or 0) # full_size already includes one init segment
+        return int(media_size * selected_duration / position + init_bytes) if position else full_size
+    span = sum(end - start for start, end in spans)
+    if row['has_video']: span += SECTION_KEYFRAME_OVERHEAD_SECONDS * len(spans)
+    return int(full_size * min(span, duration) / duration)
+
+# --- Format Selection Simulation ---
+def get_available_formats(media_info):
+    """Returns the 'formats' list of an info dict (or the dict itself for single-format results). Raises if none."""
+    available_formats = media_info.get('formats')
+    if not available_formats or not isinstance(available_formats, list):
+        if media_info.get('format_id'): available_formats = [media_info]
+        else: raise ValueError("No 'formats' list found.")
+    return available_formats
+
+def estimate_selection(available_formats, format_selector, duration=None, probe=False, sections=None, table=None):
+    """
+    Simulates yt-dlp's selection for a full selector ('/' fallbacks, '+' merges, chained filters).
+    With probe=True, selected formats without filesize/filesize_approx are sized exactly over HTTP (see probe_row_sizes).
+    With sections=[(start, end)], each part's size covers only those time ranges (see section_size).
+    table: a get_format_table result for available_formats to select from (e.g. one whose rows were already probed).
+    Returns {'size', 'format_ids', 'parts': [{'format_id', 'size', 'method'}], 'group'}; 'group' is None if nothing matched.
+    """
+    result = {'size': 0, 'format_ids': [], 'parts': [], 'group': None}
+    try:
+        if table is None:
+            with timed('feature_table'): table = get_format_table(available_formats, duration)
+        with timed('selection'): chosen = evaluate_selector(table, format_selector)
+    except ValueError as e:
+        error_print("Invalid format selector '%s': %s", format_selector, e)
+        return result
+    if not chosen:
+        warning_print("Could not satisfy any selection group completely.")
+        return result
+    if probe:
+        with timed('probe'): probe_row_sizes(chosen)
+    parts = [{'format_id': row['format'].get('format_id'), 'size': row['size'], 'method': row['method']} for row in chosen]
+    if sections:
+        for part, row in zip(parts, chosen): part.update(full_size=row['size'], size=section_size(row, sections))
+    for part in parts:
+        debug_print("    Match: ID=%s, Size=%s, Method=%s", part['format_id'], part['size'], part['method'])
+        if part['size'] == 0: warning_print("    Match (ID=%s) has size 0 or could not be estimated.", part['format_id'])
+    result.update(size=sum(part['size'] for part in parts), format_ids=[part['format_id'] for part in parts], parts=parts, group='+'.join(str(part['format_id']) for part in parts))
+    return result
+
+def estimate_many(available_formats, selectors, duration=None, probe=False, sections=None):
+    """
+    Estimates several selectors against one formats list (e.g. every quality preset of a menu).
+    The feature table (size, type flags, rank) is built once and shared; returns {selector: estimate_selection result}.
+    With probe=True, the formats chosen by any selector are probed together in one pool.
+    """
+    table = get_format_table(available_formats, duration)
+    if probe:
+        chosen_rows = []
+        for selector in selectors:
+            try: chosen_rows.extend(evaluate_selector(table, selector) or [])
+            except ValueError: pass # Reported by estimate_selection below
+        probe_row_sizes(chosen_rows)
+    estimates = {}
+    for selector in selectors:
+        if selector not in estimates: estimates[selector] = estimate_selection(available_formats, selector, duration, sections=sections, table=table)
+    return estimates
+
+# --- Budget-Constrained Selection ---
+def select_within_budget(available_formats, format_selector, max_bytes, duration=None, probe=False, sections=None):
+    """
+    Returns the estimate_selection-style result of the highest-ranked combination the selector allows within max_bytes.
+    The selector is evaluated on the feature table; while the pick is too large, its largest part is excluded and the
+    selector re-evaluated, so quality steps down one format at a time in yt-dlp's own rank order.
+    Formats whose size can't be estimated are never picked. 'selector' is the explicit format ID (or 'ID+ID') to download.
+    """
+    result = {'size': 0, 'format_ids': [], 'parts': [], 'group': None, 'selector': None, 'max_bytes': max_bytes, 'attempts': 0}
+    try:
+        table = get_format_table(available_formats, duration)
+        plan = compile_selector(format_selector)
+    except ValueError as e:
+        error_print("Invalid format selector '%s': %s", format_selector, e)
+        return result
+    rows = [row for row in table['rows'] if row['method'] != 'none']
+    while rows:
+        result['attempts'] += 1
+        chosen = _evaluate_plan(plan, rows, table)
+        if not chosen: break
+        if probe: probe_row_sizes(chosen)
+        sizes = [section_size(row, sections) if sections else row['size'] for row in chosen]
+        if all(sizes) and sum(sizes) <= max_bytes:
+            parts = [{'format_id': row['format'].get('format_id'), 'size': size, 'method': row['method']} for row, size in zip(chosen, sizes)]
+            group = '+'.join(str(part['format_id']) for part in parts)
+            result.update(size=sum(sizes), format_ids=[part['format_id'] for part in parts], parts=parts, group=group, selector=group)
+            return result
+        largest = max(zip(sizes, range(len(chosen))))[1] if all(sizes) else sizes.index(0)
+        debug_print("  Budget: %s (%s bytes) exceeds %s; dropping format %s", '+'.join(str(row['format'].get('format_id')) for row in chosen), sum(sizes), max_bytes, chosen[largest]['format'].get('format_id'))
+        rows = [row for row in rows if row is not chosen[largest]]
+    warning_print("Nothing selectable by '%s' fits within %s bytes.", format_selector, max_bytes)
+    return result
+
+def _sample_response(response, sample_bytes, deadline):
+    """Reads at most sample_bytes of a response body in chunks, stopping at deadline; returns the byte count."""
+    received = 0
+    while received < sample_bytes and time.perf_counter() < deadline:
+        chunk = response.read(min(THROUGHPUT_READ_CHUNK, sample_bytes - received))
+        if not chunk: break
+        received += len(chunk)
+    return received
+
+def measure_throughput(available_formats, sample_bytes=THROUGHPUT_SAMPLE_BYTES, timeout=PROBE_TIMEOUT):
+    """
+    Measures download throughput (bytes/s) by fetching the first sample_bytes of the best-ranked plain HTTP format; None on failure.
+    The body is streamed with a byte and time cap, so a server that ignores the Range never sends us the whole file.
+    """
+    for fmt in reversed([fmt for fmt in available_formats if isinstance(fmt, dict)]):
+        if not is_probeable(fmt): continue
+        parsed = urlparse(fmt['url'])
+        try:
+            start = time.perf_counter()
+            response, _ = _probe_request('GET', fmt['url'], dict(fmt.get('http_headers') or {}, Range=f"bytes=0-{sample_bytes - 1}"), timeout, read_body=False)
+            received = _sample_response(response, sample_bytes, start + THROUGHPUT_SAMPLE_SECONDS) if response.status in (200, 206) else 0
+            elapsed = time.perf_counter() - start
+            if not response.isclosed(): _drop_probe_connection(parsed.scheme, parsed.netloc) # Body left unread; the socket can't be reused
+        except (http.client.HTTPException, OSError) as e:
+            _drop_probe_connection(parsed.scheme, parsed.netloc)
+            debug_print("  Throughput sample failed for format %s: %s", fmt.get('format_id'), e); continue
+        if not received: continue
+        debug_print("  Throughput sample: %s bytes in %.3fs", received, elapsed)
+        return received / max(elapsed, 1e-6)
+    return None
+
+# --- Pipeline Peak Disk Prediction ---
+def predict_pipeline_disk(available_formats, estimate, duration, pipeline, normalize=True, high_dynamic=True, sections=None):
+    """
+    Predicts the files alive at each step of media_processor.sh's mp3/mp4/mkv pipeline for an estimate_selection result.
+    mp3/mp4 download one (merged) main file; mkv keeps the video and audio streams separate and normalizes the audio one.
+    high_dynamic is the dynaudnorm branch (decided only after loudness analysis, so True is the safe worst case).
+    Returns {'download', 'peak', 'peak_phase', 'final', 'phases': [{'phase', 'bytes'}]}.
+    """
+    formats_by_id = {fmt.get('format_id'): fmt for fmt in available_formats if isinstance(fmt, dict)}
+    parts = [(part['size'], formats_by_id.get(part['format_id'], {})) for part in estimate['parts']]
+    download = sum(size for size, _ in parts)
+    video = sum(size for size, fmt in parts if fmt.get('vcodec') not in (None, 'none'))
+    seconds = sum(end - start for start, end in _clip_sections(sections, duration)) if sections and duration else (duration or 0)
+    wav = int(seconds * PCM_BYTES_PER_SECOND)
+    encoded = int(seconds * PIPELINE_AUDIO_BITRATES[pipeline] / 8 * PIPELINE_CONTAINER_OVERHEAD)
+    phases = [('download', download * 2 if pipeline != 'mkv' and len(parts) > 1 else download)] # yt-dlp merge keeps parts and output together
+    if not normalize:
+        final = encoded if pipeline == 'mp3' else download
+        if pipeline == 'mp3': phases.append(('convert', download + encoded))
     else:
-        debug_print("  Step 2 Result: No explicit filters to apply.")
-        filtered_formats = type_matched_formats
-
-    if not filtered_formats: return None # Exit B2
-
-    # --- Step 3: Sorting ---
-    debug_print(f"  Step 3: Sorting {len(filtered_formats)} final candidates...")
-    def sort_key(fmt):
-        # <<< get_format_size now includes bitrate fallback >>>
-        size = get_format_size(fmt)
-        has_valid_size = 1 if size > 0 else 0
-        height = fmt.get('height') if isinstance(fmt.get('height'), int) else 0
-        vbr = fmt.get('vbr') if isinstance(fmt.get('vbr'), (int, float)) else 0
-        tbr = fmt.get('tbr') if isinstance(fmt.get('tbr'), (int, float)) else 0
-        video_rate = vbr if vbr > 0 else tbr
-        abr = fmt.get('abr') if isinstance(fmt.get('abr'), (int, float)) else 0
-        ext = fmt.get('ext', '')
-        # Slightly prefer mp4/m4a, then webm/opus, then others
-        ext_pref = 2 if ext in ['mp4', 'm4a'] else (1 if ext in ['webm', 'opus'] else 0)
-        # Sort Tuple: Prioritize size validity, then resolution, rates, ext, size
-        return (has_valid_size, height, video_rate, abr, ext_pref, size)
-
-    sorted_formats = []
+        phases.append(('wav_extract', download + wav))
+        if high_dynamic: phases += [('dynaudnorm', download + 2 * wav), ('loudnorm', download + 3 * wav)]
+        else: phases.append(('loudnorm', download + 2 * wav))
+        phases.append(('encode', download + 2 * wav + encoded))
+        final = encoded if pipeline == 'mp3' else int((video + encoded) * PIPELINE_CONTAINER_OVERHEAD)
+        phases.append(('embed' if pipeline == 'mp3' else 'mux', download + encoded + final))
+    peak_phase, peak = max(phases, key=lambda phase: phase[1])
+    return {'download': download, 'peak': peak, 'peak_phase': peak_phase, 'final': final,
+            'phases': [{'phase': name, 'bytes': size} for name, size in phases]}
+
+# --- Estimate Ledger & Learned Corrections ---
+# Append-only SQLite ledger: every estimated part is one row in 'estimates'; the pipeline later appends the
+# real downloaded size to 'actuals'. Correction factors per (extractor, method, codec) are learned from the
+# ratio actual / estimated of completed estimates, each part weighted by its share of the estimate.
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS estimates (
+    estimate_id TEXT NOT NULL, created_at REAL NOT NULL, media_key TEXT NOT NULL, selector TEXT NOT NULL,
+    extractor TEXT, format_id TEXT, codec TEXT, method TEXT, part_size INTEGER NOT NULL, total_size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS estimates_by_media ON estimates (media_key, selector, created_at);
+CREATE TABLE IF NOT EXISTS actuals (
+    media_key TEXT NOT NULL, selector TEXT NOT NULL, recorded_at REAL NOT NULL, actual_size INTEGER NOT NULL
+);
+"""
+
+def open_ledger(path=None):
+    path = path or LEDGER_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.executescript(LEDGER_SCHEMA)
+    return conn
+
+def part_codec(format_info):
+    """Codec family of a part ('avc1', 'vp9', 'mp4a', 'opus', ...); the video codec wins for muxed formats."""
+    vcodec, acodec = format_info.get('vcodec'), format_info.get('acodec')
+    codec = vcodec if vcodec and vcodec != 'none' else acodec
+    return str(codec or 'unknown').split('.', 1)[0].lower()
+
+def media_key(media_info):
+    return cache_key_for_info(media_info) or str(media_info.get('id') or 'unknown')
+
+def estimate_categories(media_info, estimate):
+    """Returns [(extractor, method, codec, part_size)] for the parts of an estimate_selection result."""
+    formats_by_id = {fmt.get('format_id'): fmt for fmt in get_available_formats(media_info)}
+    extractor = str(media_info.get('extractor_key') or media_info.get('extractor') or 'unknown').lower()
+    return [(extractor, part['method'], part_codec(formats_by_id.get(part['format_id'], {})), part['size']) for part in estimate['parts']]
+
+def record_estimate(media_info, selector, estimate, path=None):
+    """Appends one ledger row per part of an estimate; returns the estimate ID."""
+    if not estimate['parts']: return None
+    created_at = time.time()
+    estimate_id = f"{int(created_at * 1000)}-{os.getpid()}-{threading.get_ident() % 10000}"
+    rows = [(estimate_id, created_at, media_key(media_info), selector, extractor, part['format_id'], codec, method, size, estimate['size'])
+            for part, (extractor, method, codec, size) in zip(estimate['parts'], estimate_categories(media_info, estimate))]
     try:
-        sorted_formats = sorted(filtered_formats, key=sort_key, reverse=True)
-        debug_print(f"  Sorting successful. Top 5 results:")
-        for i, fmt in enumerate(sorted_formats[:5]):
-             debug_print(f"    {i+1}: ID={fmt.get('format_id')}, HasSize={1 if get_format_size(fmt)>0 else 0}, H={fmt.get('height')}, VR={fmt.get('vbr') or fmt.get('tbr')}, AR={fmt.get('abr')}, Ext={fmt.get('ext')}, Size={get_format_size(fmt)}")
+        with contextlib.closing(open_ledger(path)) as conn, conn:
+            conn.executemany("INSERT INTO estimates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    except sqlite3.Error as e:
+        warning_print("Could not write estimate ledger: %s", e); return None
+    return estimate_id
+
+def record_actual(key, selector, actual_size, path=None):
+    """Appends the real downloaded size for the latest estimate of (key, selector)."""
+    with contextlib.closing(open_ledger(path)) as conn, conn:
+        conn.execute("INSERT INTO actuals VALUES (?, ?, ?, ?)", (key, selector, time.time(), int(actual_size)))
+
+def _completed_estimates(conn):
+    """Yields (ratio, [(category, share)]) for each estimate followed by an actual (latest estimate before the actual)."""
+    query = """
+        SELECT e.estimate_id, e.extractor, e.method, e.codec, e.part_size, e.total_size, a.actual_size
+        FROM actuals a JOIN estimates e ON e.media_key = a.media_key AND e.selector = a.selector
+        WHERE e.estimate_id = (SELECT estimate_id FROM estimates x
+                               WHERE x.media_key = a.media_key AND x.selector = a.selector AND x.created_at <= a.recorded_at
+                               ORDER BY x.created_at DESC LIMIT 1)
+        ORDER BY e.estimate_id"""
+    grouped = {}
+    for estimate_id, extractor, method, codec, part_size, total_size, actual_size in conn.execute(query):
+        entry = grouped.setdefault(estimate_id, {'ratio': (actual_size / total_size) if total_size else None, 'parts': []})
+        if total_size: entry['parts'].append(((extractor, method, codec), part_size / total_size))
+    for entry in grouped.values():
+        if entry['ratio']: yield entry['ratio'], entry['parts']
+
+def learn_corrections(path=None):
+    """Returns {(extractor, method, codec): {'factor', 'log_sd', 'samples'}} from the ledger (weighted log-ratio statistics)."""
+    stats = {}
+    try:
+        with contextlib.closing(open_ledger(path)) as conn:
+            for ratio, parts in _completed_estimates(conn):
+                log_ratio = math.log(ratio)
+                for category, share in parts:
+                    acc = stats.setdefault(category, [0.0, 0.0, 0.0, 0]) # sum w, sum w*x, sum w*x^2, n
+                    acc[0] += share; acc[1] += share * log_ratio; acc[2] += share * log_ratio * log_ratio; acc[3] += 1
+    except sqlite3.Error as e:
+        warning_print("Could not read estimate ledger: %s", e); return {}
+    corrections = {}
+    for category, (weight, weighted_sum, weighted_sq, samples) in stats.items():
+        if not weight: continue
+        mean = weighted_sum / weight
+        variance = max(0.0, weighted_sq / weight - mean * mean)
+        corrections[category] = {'factor': math.exp(mean), 'log_sd': math.sqrt(variance), 'samples': samples}
+    return corrections
+
+def corrected_estimate(media_info, estimate, corrections):
+    """
+    Applies learned factors to each part. Categories with fewer than LEDGER_MIN_SAMPLES completed estimates keep
+    factor 1.0 and the method's default uncertainty. Returns {'size', 'low', 'high'} (band is about 95%).
+    """
+    size = low = high = 0.0
+    for extractor, method, codec, part_size in estimate_categories(media_info, estimate):
+        learned = corrections.get((extractor, method, codec))
+        if learned and learned['samples'] >= LEDGER_MIN_SAMPLES:
+            factor, spread = learned['factor'], max(learned['log_sd'], 0.005)
+        else:
+            factor, spread = 1.0, METHOD_DEFAULT_UNCERTAINTY.get(method, 0.5)
+        size += part_size * factor
+        low += part_size * factor * math.exp(-1.96 * spread)
+        high += part_size * factor * math.exp(1.96 * spread)
+    return {'size': int(size), 'low': int(low), 'high': int(high)}
+
+def ledger_report(path=None):
+    """Returns per-category estimation error rows (samples, mean/median absolute error %, learned factor)."""
+    errors = {}
+    try:
+        with contextlib.closing(open_ledger(path)) as conn:
+            for ratio, parts in _completed_estimates(conn):
+                for category, share in parts: errors.setdefault(category, []).append((ratio - 1.0) * 100)
+    except sqlite3.Error as e:
+        warning_print("Could not read estimate ledger: %s", e); return []
+    corrections = learn_corrections(path)
+    report = []
+    for category in sorted(errors):
+        values = sorted(errors[category])
+        absolute = sorted(abs(v) for v in values)
+        report.append({'extractor': category[0], 'method': category[1], 'codec': category[2], 'samples': len(values),
+                       'mean_error_pct': round(sum(values) / len(values), 2), 'median_abs_error_pct': round(absolute[len(absolute) // 2], 2),
+                       'factor': round(corrections.get(category, {}).get('factor', 1.0), 4)})
+    return report
+
+# --- Batch / Playlist Estimation ---
+def _entry_url(entry):
+    """Builds a downloadable URL from a flat-playlist entry."""
+    url = entry.get('url') or entry.get('webpage_url')
+    if url and url.startswith(('http://', 'https://')): return url
+    video_id = entry.get('id') or url
+    if not video_id: return None
+    if str(entry.get('ie_key') or 'Youtube').lower().startswith('youtube'): return f"https://www.youtube.com/watch?v={video_id}"
+    return url
+
+def expand_playlist(url, backend='auto'):
+    """Returns the item URLs of a playlist/channel URL (flat extraction, no per-item metadata); [url] for a single video."""
+    entries = []
+    yt_dlp = load_yt_dlp_module() if backend != 'subprocess' else None
+    if yt_dlp is not None:
+        ydl_opts = {'quiet': True, 'no_warnings': True, 'skip_download': True, 'extract_flat': 'in_playlist'}
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+        if not info or info.get('_type') not in ('playlist', 'multi_video'): return [url]
+        entries = [e for e in (info.get('entries') or []) if e]
+    else:
+        yt_dlp_cmd = shutil.which("yt-dlp")
+        if not yt_dlp_cmd: raise FileNotFoundError("yt-dlp not found.")
+        process = subprocess.run([yt_dlp_cmd, "--no-warnings", "--flat-playlist", "--dump-json", url], capture_output=True, text=True, encoding='utf-8', check=False, timeout=300)
+        if process.returncode != 0: raise ValueError(f"yt-dlp --flat-playlist failed.\nstderr:\n{process.stderr}")
+        for line in process.stdout.splitlines():
+            if line.strip(): entries.append(json.loads(line))
+        if len(entries) == 1 and entries[0].get('_type', 'video') == 'video' and entries[0].get('formats'): return [url]
+    return [u for u in (_entry_url(e) for e in entries) if u]
+
+def estimate_url(url, format_selector, use_cache=True, backend='auto', probe=False, sections=None, ledger=False, corrections=None):
+    """Estimates one URL; returns an NDJSON-ready record (never raises)."""
+    record = {'type': 'item', 'url': url, 'id': None}
+    try:
+        media_info = get_media_info(url, use_cache=use_cache, backend=backend)
+        record['id'] = media_info.get('id')
+        estimate = estimate_selection(get_available_formats(media_info), format_selector, media_info.get('duration'), probe=probe, sections=sections)
+        record.update(status='ok' if estimate['group'] is not None else 'no_match', size=estimate['size'], format_ids=estimate['format_ids'], parts=estimate['parts'])
+        if ledger: record_estimate(media_info, format_selector, estimate)
+        if corrections is not None and estimate['parts']: record['corrected'] = corrected_estimate(media_info, estimate, corrections)
     except Exception as e:
-        error_print(f"  >>> EXCEPTION DURING SORTING: {e} <<<")
-        traceback.print_exc(file=sys.stderr)
-        if filtered_formats: return filtered_formats[0] # Fallback C
-        else: return None # Fallback D
-
-    # --- Step 4: Selection ---
-    if not sorted_formats: return None # Exit E
-    selected_format = sorted_formats[0]
-    if selected_format and isinstance(selected_format, dict):
-        debug_print(f"  Selected Best: ID={selected_format.get('format_id', 'N/A')}, Size={get_format_size(selected_format)}")
-        return selected_format # Success Exit
-    else: return None # Exit F
-# <<< select_best_filtered_format 函數定義結束 >>>
+        record.update(status='error', size=0, error=str(e))
+    return record
+
+def run_batch(urls, format_selector, jobs=BATCH_DEFAULT_JOBS, use_cache=True, backend='auto', out=sys.stdout, probe=False, sections=None, ledger=False, corrections=None):
+    """Estimates many URLs with a bounded worker pool, streaming one NDJSON line per item (in completion order) and a final total line."""
+    totals = {'type': 'total', 'items': len(urls), 'ok': 0, 'failed': 0, 'size': 0}
+    if not urls:
+        print(json.dumps(totals), file=out, flush=True); return totals
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(urls)))) as pool:
+        futures = {pool.submit(estimate_url, url, format_selector, use_cache, backend, probe, sections, ledger, corrections): index for index, url in enumerate(urls)}
+        for future in as_completed(futures):
+            record = future.result()
+            record['index'] = futures[future]
+            if record['status'] == 'ok': totals['ok'] += 1; totals['size'] += record['size']
+            else: totals['failed'] += 1
+            print(json.dumps(record, ensure_ascii=False), file=out, flush=True)
+    print(json.dumps(totals), file=out, flush=True)
+    return totals
+
+# --- Fixture Regression Suite ---
+# A fixture is a recorded info JSON plus, per selector, the format IDs yt-dlp really picked and (when the
+# ledger has it) the final downloaded size. Running the suite needs no network and fails on wrong picks,
+# on selection slowdowns, on estimation error growth against baseline.json and when there is no case at all.
+# tests/test_estimate_fixtures.py runs the same cases under pytest, plus main() end to end.
+def yt_dlp_selected_format_ids(media_info, selector):
+    """Returns the format IDs yt-dlp itself selects for a selector on an info dict (module, else --load-info-json)."""
+    yt_dlp = load_yt_dlp_module()
+    if yt_dlp is not None:
+        ydl_opts = {'quiet': True, 'no_warnings': True, 'skip_download': True, 'simulate': True, 'format': selector}
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            result = ydl.process_ie_result(json.loads(json.dumps(media_info)), download=False)
+        format_id = (result or {}).get('format_id')
+    else:
+        yt_dlp_cmd = shutil.which("yt-dlp")
+        if not yt_dlp_cmd: raise FileNotFoundError("yt-dlp not found.")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            info_path = os.path.join(tmp_dir, "info.json")
+            write_info_json(info_path, media_info)
+            process = subprocess.run([yt_dlp_cmd, "--no-warnings", "--load-info-json", info_path, "-f", selector, "--simulate", "--print", "format_id"],
+                                     capture_output=True, text=True, encoding='utf-8', check=False, timeout=60)
+        if process.returncode != 0: raise ValueError(f"yt-dlp format selection failed.\nstderr:\n{process.stderr}")
+        format_id = process.stdout.strip().splitlines()[-1] if process.stdout.strip() else None
+    return str(format_id).split('+') if format_id else []
+
+def latest_actual_size(key, selector, path=None):
+    """Returns the most recent recorded download size for (key, selector) from the ledger, or None."""
+    try:
+        with contextlib.closing(open_ledger(path)) as conn:
+            row = conn.execute("SELECT actual_size FROM actuals WHERE media_key = ? AND selector = ? ORDER BY recorded_at DESC LIMIT 1", (key, selector)).fetchone()
+    except sqlite3.Error as e:
+        warning_print("Could not read estimate ledger: %s", e); return None
+    return row[0] if row else None
+
+def record_fixture(media_info, selectors, name, fixtures_dir=None):
+    """Writes <fixtures_dir>/<name>.json from an info dict, asking yt-dlp for the real picks. Returns the path."""
+    cases = []
+    for selector in selectors:
+        cases.append({'selector': selector, 'expected_format_ids': yt_dlp_selected_format_ids(media_info, selector),
+                      'actual_size': latest_actual_size(media_key(media_info), selector)})
+    fixture = {'name': name, 'extractor': str(media_info.get('extractor_key') or media_info.get('extractor') or 'unknown').lower(),
+               'recorded_at': int(time.time()), 'cases': cases, 'info': prune_info(media_info)}
+    path = os.path.join(fixtures_dir or FIXTURES_DIR, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}.json")
+    if not write_info_json(path, fixture): raise OSError(f"Could not write fixture '{path}'.")
+    return path
+
+def reset_selection_caches():
+    """Forgets compiled selectors, the feature table and the selection memo so the next selection runs cold."""
+    global _last_format_table
+    compile_selector.cache_clear(); _last_format_table = None
+    with _selection_memo_lock: _selection_memo.clear()
+
+def _min_ms(function, runs, reset=True):
+    best = None
+    for _ in range(max(1, runs)):
+        if reset: reset_selection_caches()
+        start = time.perf_counter(); function()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run_fixture_case(fixture, case, runs=FIXTURE_DEFAULT_RUNS):
+    """Checks one selector of a fixture; returns a result dict (timings in ms, error in % of the actual size)."""
+    media_info = fixture['info']
+    formats = get_available_formats(media_info)
+    selector = case['selector']
+    estimate = estimate_selection(formats, selector, media_info.get('duration'))
+    result = {'type': 'case', 'fixture': fixture['name'], 'selector': selector, 'format_ids': estimate['format_ids'],
+              'expected_format_ids': case.get('expected_format_ids'), 'size': estimate['size'], 'actual_size': case.get('actual_size')}
+    result['correct'] = result['expected_format_ids'] is None or estimate['format_ids'] == result['expected_format_ids']
+    if result['actual_size']: result['error_pct'] = round((estimate['size'] - result['actual_size']) / result['actual_size'] * 100, 3)
+    result['select_cold_ms'] = round(_min_ms(lambda: select_best_filtered_format(formats, selector), runs), 4)
+    result['select_warm_ms'] = round(_min_ms(lambda: select_best_filtered_format(formats, selector), runs, reset=False), 4)
+    return result
+
+def _regressions(result, baseline):
+    """Returns the reasons a case result regressed against its baseline entry (None skips the baseline checks, {} means no entry)."""
+    reasons = [] if result['correct'] else [f"picked {'+'.join(result['format_ids']) or 'nothing'}, yt-dlp picks {'+'.join(result['expected_format_ids']) or 'nothing'}"]
+    if baseline is None: return reasons
+    if not baseline: return reasons + ["no baseline entry (run with --update-baseline)"]
+    for key in ('select_cold_ms',):
+        if key in baseline and result[key] > baseline[key] * (1 + FIXTURE_SPEED_TOLERANCE) + FIXTURE_SPEED_SLACK_MS:
+            reasons.append(f"{key} {result[key]} > baseline {baseline[key]}")
+    if 'error_pct' in result and abs(result['error_pct']) > abs(baseline.get('error_pct', 0)) + FIXTURE_ERROR_SLACK_PCT:
+        reasons.append(f"error {result['error_pct']}% > baseline {baseline.get('error_pct', 0)}%")
+    return reasons
+
+def run_fixture_suite(fixtures_dir=None, runs=FIXTURE_DEFAULT_RUNS, update_baseline=False, out=sys.stdout):
+    """Runs every fixture case, streaming one JSON line per case and a summary line. Returns the summary."""
+    fixtures_dir = fixtures_dir or FIXTURES_DIR
+    baseline_path = os.path.join(fixtures_dir, "baseline.json")
+    try:
+        with open(baseline_path, 'r', encoding='utf-8') as f: baseline = json.load(f)
+    except FileNotFoundError: baseline = {}
+    summary = {'type': 'summary', 'cases': 0, 'failed': 0, 'abs_error_pct_mean': None, 'baseline_updated': update_baseline}
+    try: names = sorted(name for name in os.listdir(fixtures_dir) if name.endswith('.json') and name != 'baseline.json')
+    except FileNotFoundError: names = []
+    errors, new_baseline = [], {}
+    for name in names:
+        try:
+            with open(os.path.join(fixtures_dir, name), 'r', encoding='utf-8') as f: fixture = json.load(f)
+        except (OSError, ValueError) as e:
+            warning_print("Skipping unreadable fixture '%s': %s", name, e); continue
+        if not isinstance(fixture, dict) or 'info' not in fixture: continue # Not a fixture (e.g. a recorded manifest)
+        fixture.setdefault('name', name[:-5])
+        for case in fixture.get('cases') or []:
+            result = run_fixture_case(fixture, case, runs)
+            case_key = f"{fixture['name']}|{case['selector']}"
+            result['regressions'] = _regressions(result, None if update_baseline else baseline.get(case_key, {}))
+            new_baseline[case_key] = {key: result[key] for key in ('select_cold_ms', 'error_pct') if key in result}
+            summary['cases'] += 1
+            if result['regressions']: summary['failed'] += 1
+            if 'error_pct' in result: errors.append(abs(result['error_pct']))
+            print(json.dumps(result, ensure_ascii=False), file=out, flush=True)
+    if not summary['cases']: error_print("No fixture cases found in '%s'.", fixtures_dir)
+    if errors: summary['abs_error_pct_mean'] = round(sum(errors) / len(errors), 3)
+    if update_baseline and new_baseline:
+        if not write_info_json(baseline_path, new_baseline): summary['baseline_updated'] = False
+    print(json.dumps(summary), file=out, flush=True)
+    return summary
 
 # --- Main Execution Function ---
 def main():
     """Main function to parse args, get formats, simulate selection, and print size."""
-    debug_print(f"--- estimate_size.py {SCRIPT_VERSION} Starting ---")
+    global TIMINGS_ENABLED, PRUNE_INFO, PIPED_INSTANCE
+    main_start = time.perf_counter()
     # --- Argument Parsing ---
     # (保持不變)
     parser = argparse.ArgumentParser(description="Estimate media size...",epilog="Example: ...")
     parser.add_argument("url", nargs='?', default=None)
     parser.add_argument("format_selector", nargs='?', default=None)
+    parser.add_argument("--info-json", metavar="PATH", default=None, help="Read formats from this yt-dlp info JSON if still valid; otherwise extract and write it here (usable with yt-dlp --load-info-json).")
+    parser.add_argument("--dump-info-json", action="store_true", help="Only get the info JSON for URL (valid --info-json file / cache / one extraction) and write it to --info-json, or print it when --info-json is omitted; no format selection.")
+    parser.add_argument("--backend", choices=EXTRACTION_BACKENDS, default="auto", help="Metadata extraction backend (default: in-process yt_dlp module if importable, else the yt-dlp executable; 'piped' uses a Piped /streams request for YouTube URLs with yt-dlp as fallback).")
+    parser.add_argument("--piped-instance", metavar="URL", default=None, help=f"Piped API instance for --backend piped (default: $PIPED_INSTANCE or {PIPED_INSTANCE}).")
+    parser.add_argument("--benchmark-backends", type=int, metavar="RUNS", default=0, help="Time the extraction backends RUNS times on URL, print the results as JSON and exit.")
+    parser.add_argument("--selectors", nargs='+', metavar="SELECTOR", default=None, help="Estimate several selectors from one metadata fetch; prints one JSON line per selector (in order).")
+    parser.add_argument("--batch", action="store_true", help="Estimate every item of a playlist URL, or of the URLs read from stdin (one per line), and print NDJSON records plus a total line.")
+    parser.add_argument("-j", "--jobs", type=int, default=BATCH_DEFAULT_JOBS, help=f"Concurrent extractions in --batch mode (default: {BATCH_DEFAULT_JOBS}).")
+    parser.add_argument("--probe", action="store_true", help="Probe exact sizes (HEAD / Range: bytes=0-0, or DASH/HLS manifest byte ranges) for selected formats that lack filesize and filesize_approx.")
+    parser.add_argument("--start", default=None, help="Estimate only from this time (HH:MM:SS or seconds).")
+    parser.add_argument("--end", default=None, help="Estimate only up to this time (HH:MM:SS, seconds or 'inf').")
+    parser.add_argument("--download-sections", action="append", metavar="*START-END", default=None, help="yt-dlp style time-range sections to estimate (repeatable).")
+    parser.add_argument("--ledger", action="store_true", help=f"Record this estimate in the estimate ledger ({LEDGER_PATH}).")
+    parser.add_argument("--corrected", action="store_true", help="Print the estimate corrected by factors learned from the ledger (band in the debug log / JSON output).")
+    parser.add_argument("--record-actual", nargs='+', metavar="FILE", default=None, help="Record the real size of the downloaded FILE(s) for URL + selector in the ledger and exit.")
+    parser.add_argument("--ledger-report", action="store_true", help="Print estimation error by (extractor, method, codec) from the ledger as JSON lines and exit.")
+    parser.add_argument("--max-bytes", metavar="SIZE", default=None, help="Print (as JSON) the highest-ranked formats the selector allows within SIZE bytes (suffixes like 300M or 1.5GiB).")
+    parser.add_argument("--time-budget", type=float, metavar="SECONDS", default=None, help="Like --max-bytes, with the budget derived from SECONDS of download at the link throughput.")
+    parser.add_argument("--throughput", metavar="RATE", default=None, help="Link throughput in bytes/s for --time-budget (e.g. 2M); measured with a short Range request when omitted.")
+    parser.add_argument("--pipeline", choices=PIPELINES, default=None, help="Print a JSON line with the predicted peak temporary disk use and final output size of media_processor.sh's mp3/mp4/mkv pipeline instead of the download size.")
+    parser.add_argument("--no-normalize", action="store_true", help="With --pipeline, predict the path without loudness normalization.")
+    parser.add_argument("--dynamic-range", choices=('auto', 'high', 'normal'), default='auto', help="With --pipeline, the normalization branch; 'auto' assumes the larger high-dynamic-range branch (default).")
+    parser.add_argument("--record-fixture", metavar="NAME", default=None, help="Save URL/--info-json plus the selector(s), yt-dlp's real picks and ledger sizes as fixture NAME, then exit.")
+    parser.add_argument("--run-fixtures", action="store_true", help="Run the offline fixture regression suite (one JSON line per case plus a summary); exits 2 on regressions or when no case is found.")
+    parser.add_argument("--fixtures-dir", metavar="DIR", default=None, help=f"Fixture directory (default: {FIXTURES_DIR}).")
+    parser.add_argument("--fixture-runs", type=int, default=FIXTURE_DEFAULT_RUNS, help=f"Timed repetitions per fixture case (default: {FIXTURE_DEFAULT_RUNS}).")
+    parser.add_argument("--update-baseline", action="store_true", help="With --run-fixtures, store this run's timings and errors as the new baseline.")
+    parser.add_argument("--keep-all-fields", action="store_true", help=f"Keep {', '.join(sorted(PRUNED_INFO_KEYS))} in parsed/written info JSON (pruned by default).")
+    parser.add_argument("--no-cache", action="store_true", help=f"Bypass the shared info-JSON cache in {INFO_JSON_CACHE_DIR}.")
+    parser.add_argument("--log-level", choices=list(LOG_LEVELS), default=None, help="stderr log level (default: $ESTIMATE_SIZE_LOG_LEVEL or 'warning').")
+    parser.add_argument("--timings", action="store_true", help="Print a 'TIMINGS {json}' line to stderr with per-phase durations (extraction, JSON parsing, selection groups, total).")
     parser.add_argument("-v", "--version", action="version", version=f"%(prog)s {SCRIPT_VERSION}")
-    try: args = parser.parse_args(); debug_print(f"Args: URL='{args.url}', Format='{args.format_selector}'")
+    try:
+        args = parser.parse_args()
+        if args.log_level: set_log_level(args.log_level)
+        if args.keep_all_fields: PRUNE_INFO = False
+        if args.piped_instance: PIPED_INSTANCE = args.piped_instance
+        if args.timings: TIMINGS_ENABLED = True; atexit.register(emit_timings, main_start)
+        debug_print("--- estimate_size.py %s Starting ---", SCRIPT_VERSION); debug_print("Args: URL='%s', Format='%s', InfoJSON='%s'", args.url, args.format_selector, args.info_json)
     except SystemExit as e: sys.exit(e.code)
-    except Exception as e: error_print(f"Arg parse error: {e}"); print("0"); sys.exit(1)
-    if not args.url or not args.format_selector: error_print("URL and Format selector required."); print("0"); sys.exit(1)
+    except Exception as e: error_print("Arg parse error: %s", e); print("0"); sys.exit(1)
+    if args.info_json and args.url and not args.format_selector and '://' not in args.url: args.url, args.format_selector = None, args.url # Selector only, formats from --info-json
+    try: sections = parse_download_sections(args.download_sections, args.start, args.end)
+    except ValueError as e: error_print("Invalid section: %s", e); print("0"); sys.exit(1)
+    if args.ledger_report:
+        for row in ledger_report(): print(json.dumps(row, ensure_ascii=False))
+        sys.exit(0)
+    if args.record_actual:
+        if not args.format_selector: error_print("Selector required for --record-actual."); sys.exit(1)
+        media_info = (read_info_json(args.info_json) if args.info_json else None) or (load_cached_info(args.url) if args.url else None)
+        key = media_key(media_info) if media_info else cache_key_for_url(args.url)
+        if not key: error_print("Cannot determine the video ID; pass --info-json or a cached URL."); sys.exit(1)
+        try: actual_size = sum(os.path.getsize(path) for path in args.record_actual)
+        except OSError as e: error_print("Cannot read actual file size: %s", e); sys.exit(1)
+        try: record_actual(key, args.format_selector, actual_size)
+        except sqlite3.Error as e: error_print("Could not write estimate ledger: %s", e); sys.exit(1)
+        debug_print("Recorded actual size %s for %s / '%s'.", actual_size, key, args.format_selector)
+        sys.exit(0)
+    if args.run_fixtures:
+        summary = run_fixture_suite(args.fixtures_dir, runs=args.fixture_runs, update_baseline=args.update_baseline)
+        sys.exit(0 if summary['cases'] and summary['failed'] == 0 else 2)
+    if args.record_fixture:
+        selectors = ([args.format_selector] if args.format_selector else []) + (args.selectors or [])
+        if not selectors or not (args.url or args.info_json): error_print("URL (or --info-json) and selector(s) required for --record-fixture."); sys.exit(1)
+        try:
+            media_info = get_media_info(args.url, info_json_path=args.info_json, use_cache=not args.no_cache, backend=args.backend)
+            print(record_fixture(media_info, selectors, args.record_fixture, args.fixtures_dir))
+        except Exception as e: error_print("Could not record fixture: %s", e); sys.exit(1)
+        sys.exit(0)
+    if args.dump_info_json:
+        if not args.url: error_print("URL required for --dump-info-json."); sys.exit(1)
+        try: media_info = get_media_info(args.url, info_json_path=args.info_json, use_cache=not args.no_cache, backend=args.backend)
+        except Exception as e: error_print("Could not get info JSON: %s", e); sys.exit(1)
+        if not args.info_json: print(json.dumps(media_info, ensure_ascii=False))
+        elif not os.path.isfile(args.info_json): error_print("Could not write info JSON '%s'.", args.info_json); sys.exit(1)
+        sys.exit(0)
+    if args.benchmark_backends > 0:
+        if not args.url: error_print("URL required for --benchmark-backends."); sys.exit(1)
+        print(json.dumps(benchmark_backends(args.url, args.benchmark_backends), ensure_ascii=False)); sys.exit(0)
+    if args.batch:
+        if args.url and not args.format_selector: args.url, args.format_selector = None, args.url # Selector only, URLs from stdin
+        if not args.format_selector: error_print("Format selector required for --batch."); sys.exit(1)
+        try:
+            if args.url: urls = expand_playlist(args.url, backend=args.backend)
+            else: urls = [line.strip() for line in sys.stdin if line.strip() and not line.lstrip().startswith('#')]
+        except Exception as e: error_print("Could not list batch items: %s", e); print(json.dumps({'type': 'total', 'items': 0, 'ok': 0, 'failed': 0, 'size': 0})); sys.exit(1)
+        debug_print("Batch mode: %s items, %s workers.", len(urls), args.jobs)
+        totals = run_batch(urls, args.format_selector, jobs=args.jobs, use_cache=not args.no_cache, backend=args.backend, probe=args.probe, sections=sections,
+                           ledger=args.ledger, corrections=learn_corrections() if args.corrected else None)
+        sys.exit(0 if totals['failed'] == 0 else 2)
+    if (args.max_bytes or args.time_budget) and not args.format_selector:
+        if args.url and '://' not in args.url: args.url, args.format_selector = None, args.url
+        else: args.format_selector = BUDGET_DEFAULT_SELECTOR
+    if args.selectors:
+        if args.format_selector: args.selectors.insert(0, args.format_selector)
+        args.format_selector = args.selectors[0]
+    if not (args.url or args.info_json) or not args.format_selector: error_print("URL (or --info-json) and Format selector required."); print("0"); sys.exit(1)
 
     # --- Get ALL available formats ---
-    # (保持不變，增加簡單重試？暫不加)
-    debug_print("\nStep 1: Getting formats via yt-dlp --dump-json...")
-    yt_dlp_cmd = shutil.which("yt-dlp")
-    if not yt_dlp_cmd or not os.path.exists(yt_dlp_cmd): error_print("yt-dlp not found."); print("0"); sys.exit(1)
-    command = [yt_dlp_cmd, "--no-warnings", "--dump-json", args.url]
+    debug_print("\nStep 1: Getting formats (info JSON / cache / yt-dlp backend '%s')...", args.backend)
     available_formats = []
     try:
-        debug_print(f"Running: {' '.join(command)}")
-        process = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', check=False, timeout=60)
-        debug_print(f"yt-dlp exited with code {process.returncode}")
-        if process.returncode != 0 or not process.stdout.strip(): raise ValueError(f"yt-dlp failed or empty output.\nstderr:\n{process.stderr}")
-        media_info = json.loads(process.stdout)
-        if isinstance(media_info, list): media_info = media_info[0] # Take first if list
-        if not isinstance(media_info, dict): raise TypeError("Parsed JSON not a dict.")
-        available_formats = media_info.get('formats')
-        if not available_formats or not isinstance(available_formats, list):
-             if media_info.get('format_id'): available_formats = [media_info]
-             else: raise ValueError("No 'formats' list found.")
-        debug_print(f"Retrieved {len(available_formats)} formats.")
-    except Exception as e: error_print(f"Error getting/parsing formats: {e}"); traceback.print_exc(file=sys.stderr); print("0"); sys.exit(1)
+        media_info = get_media_info(args.url, info_json_path=args.info_json, use_cache=not args.no_cache, backend=args.backend)
+        available_formats = get_available_formats(media_info)
+        debug_print("Retrieved %s formats.", len(available_formats))
+    except Exception as e:
+        error_print("Error getting/parsing formats: %s", e)
+        if DEBUG_ENABLED: traceback.print_exc(file=sys.stderr)
+        print("0"); sys.exit(1)
     if not available_formats: warning_print("Format list empty."); print("0"); sys.exit(0)
 
+    # --- Budget Mode: best selection that fits a size or time budget ---
+    if args.max_bytes or args.time_budget:
+        max_bytes = _parse_numeric_value(args.max_bytes) if args.max_bytes else None
+        if args.max_bytes and not max_bytes: error_print("Invalid --max-bytes '%s'.", args.max_bytes); sys.exit(1)
+        if args.time_budget:
+            throughput = _parse_numeric_value(args.throughput) if args.throughput else measure_throughput(available_formats)
+            if not throughput: error_print("Could not determine link throughput; pass --throughput."); sys.exit(1)
+            debug_print("Time budget %ss at %s bytes/s", args.time_budget, int(throughput))
+            max_bytes = min(max_bytes or float('inf'), args.time_budget * throughput)
+        estimate = select_within_budget(available_formats, args.format_selector, int(max_bytes), media_info.get('duration'), probe=args.probe, sections=sections)
+        if args.ledger and estimate['parts']: record_estimate(media_info, estimate['selector'], estimate)
+        print(json.dumps(estimate, ensure_ascii=False))
+        sys.exit(0 if estimate['selector'] else 2)
+
+    # --- Several Selectors: one pass over one metadata fetch ---
+    if args.selectors:
+        debug_print("\nStep 2: Estimating %s selectors in one pass...", len(args.selectors))
+        estimates = estimate_many(available_formats, args.selectors, media_info.get('duration'), probe=args.probe, sections=sections)
+        corrections = learn_corrections() if args.corrected else None
+        for selector in args.selectors:
+            estimate = estimates[selector]
+            line = {'selector': selector, 'size': estimate['size'], 'format_ids': estimate['format_ids'], 'parts': estimate['parts']}
+            if args.ledger: record_estimate(media_info, selector, estimate)
+            if corrections is not None: line['corrected'] = corrected_estimate(media_info, estimate, corrections)
+            print(json.dumps(line, ensure_ascii=False))
+        sys.exit(0)
+
     # --- Simulate Format Selection Loop ---
-    debug_print(f"\nStep 2: Simulating selection for: '{args.format_selector}'")
-    final_estimated_size = 0
-    selection_groups = args.format_selector.split('/')
-    group_found = False
-    for i, group in enumerate(selection_groups):
-        debug_print(f"\n--- Processing Group {i+1}: '{group}' ---")
-        group_estimated_size = 0
-        all_parts_found = True
-        individual_selectors = group.split('+')
-        selected_ids_in_group = set()
-        for j, selector in enumerate(individual_selectors):
-            debug_print(f"  --- Processing Part {j+1}: '{selector}' ---")
-            best_match = select_best_filtered_format(available_formats, selector) # Call refactored function
-            if best_match:
-                format_id = best_match.get('format_id')
-                if format_id not in selected_ids_in_group:
-                    part_size = get_format_size(best_match) # <<< Uses enhanced get_format_size
-                    debug_print(f"    Part {j+1} Match: ID={format_id}, Size={part_size}")
-                    group_estimated_size += part_size
-                    selected_ids_in_group.add(format_id)
-                    if part_size == 0: warning_print(f"    Part {j+1} Match (ID={format_id}) has size 0 or could not be estimated.")
-                else: debug_print(f"    Part {j+1}: Format ID {format_id} already added.")
-            else:
-                debug_print(f"    >>>>> Part {j+1} ('{selector}') FAILED to find match. <<<<<")
-                all_parts_found = False; break
-        if all_parts_found:
-            debug_print(f"--- SUCCESS: Group {i+1} ('{group}') successful. Estimated Size: {group_estimated_size} ---")
-            final_estimated_size = group_estimated_size; group_found = True; break
-        else: debug_print(f"--- FAILED: Group {i+1} ('{group}'). Trying next fallback. ---")
-    if not group_found: warning_print("Could not satisfy any selection group completely.")
+    debug_print("\nStep 2: Simulating selection for: '%s'", args.format_selector)
+    estimate = estimate_selection(available_formats, args.format_selector, media_info.get('duration'), probe=args.probe, sections=sections)
+    final_estimated_size = estimate['size']
+    if args.ledger: record_estimate(media_info, args.format_selector, estimate)
+    if args.pipeline:
+        prediction = predict_pipeline_disk(available_formats, estimate, media_info.get('duration'), args.pipeline, normalize=not args.no_normalize,
+                                           high_dynamic=args.dynamic_range != 'normal', sections=sections)
+        debug_print("Pipeline '%s': peak %s bytes during %s, final %s bytes", args.pipeline, prediction['peak'], prediction['peak_phase'], prediction['final'])
+        print(json.dumps(prediction)); sys.exit(0)
+    if args.corrected and estimate['parts']:
+        corrected = corrected_estimate(media_info, estimate, learn_corrections())
+        debug_print("Corrected estimate: %s (95%% band %s-%s), raw %s", corrected['size'], corrected['low'], corrected['high'], final_estimated_size)
+        final_estimated_size = corrected['size']
 
     # --- Output Final Result ---
-    debug_print(f"\n--- Final Estimated Size Calculation ---")
-    debug_print(f"Total Estimated Size (bytes): {final_estimated_size}")
+    debug_print("\n--- Final Estimated Size Calculation ---")
+    debug_print("Total Estimated Size (bytes): %s", final_estimated_size)
     print(final_estimated_size) # Output only the final number
     sys.exit(0)
 
 # --- Script Entry Point ---
 if __name__ == "__main__":
     try: main()
-    except Exception as e: error_print(f"Unexpected error in main: {e}"); traceback.print_exc(file=sys.stderr); print("0"); sys.exit(1)
+    except Exception as e:
+        error_print("Unexpected error in main: %s", e)
+        if DEBUG_ENABLED: traceback.print_exc(file=sys.stderr)
+        print("0"); sys.exit(1)
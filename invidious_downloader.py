@@ -6,13 +6,62 @@ import argparse
 import re
 import json      # ★★★ 核心修正：補回 import json ★★★
 import asyncio
+import os
+import time
+import threading
+import atexit
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 # ★★★ 核心修正：補回所有需要的 urllib.parse 函數 ★★★
-from urllib.parse import urlparse, parse_qs 
+from urllib.parse import urlparse, parse_qs, quote
 
 # --- 設定 ---
 # (v4.1.1 - 補全所有遺漏的 import 語句)
 PIPED_INSTANCE = "https://pipedapi.kavin.rocks"
-SCRIPT_VERSION = "4.1.1"
+# 可用 PIPED_INSTANCES 環境變數 (逗號分隔) 或 --instances 覆寫；依健康度排序後以對沖 (hedged) 方式並行查詢
+PIPED_INSTANCES = [i.strip().rstrip('/') for i in os.environ.get("PIPED_INSTANCES", "").split(',') if i.strip()] or [
+    PIPED_INSTANCE, "https://pipedapi.adminforge.de", "https://api.piped.private.coffee"]
+PIPED_REQUEST_TIMEOUT = 15        # 單一請求逾時 (秒)
+PIPED_HEDGE_DELAY = 1.5           # 下一個 (實例, 策略) 組合在前一個未回應時延遲多久啟動 (秒)
+PIPED_TOTAL_TIMEOUT = 40          # 整體放棄時間 (秒)
+APP_DATA_DIR = os.environ.get("MEDIA_PROCESSOR_DATA_DIR", os.path.join(os.path.expanduser("~"), ".media_processor"))
+INSTANCE_HEALTH_PATH = os.path.join(APP_DATA_DIR, "piped_instance_health.json")
+HEALTH_EWMA_ALPHA = 0.3           # 新樣本權重
+HEALTH_DEFAULT_LATENCY = 3.0      # 沒有紀錄的實例的假設延遲 (秒)
+# --- /streams 快取 (與 estimate_size.py 的 Piped 後端共用) ---
+STREAMS_CACHE_DIR = os.path.join(APP_DATA_DIR, "piped_streams_cache")
+STREAMS_CACHE_DEFAULT_TTL = 3600  # 串流 URL 沒有 expire= 時的有效期 (秒)
+STREAMS_CACHE_EXPIRY_MARGIN = 300 # 提早這麼多秒視為過期，避免以即將失效的 URL 開始下載
+STREAMS_CACHE_MAX_AGE = 86400     # 超過此時間的快取檔一律清除 (秒)
+# --- 分段並行下載設定 ---
+DOWNLOAD_CONNECTIONS = 4          # 預設並行連線數 (手機上兼顧速度與耗電)
+SEGMENT_MIN_SIZE = 1024 * 1024    # 分段 / 竊取工作時的最小分段大小 (bytes)
+SEGMENT_RETRIES = 5               # 每個分段連續失敗的重試上限
+DOWNLOAD_CHUNK_SIZE = 64 * 1024   # 每次寫入的區塊大小 (bytes)
+DOWNLOAD_USER_AGENT = 'Mozilla/5.0'
+RESUME_CHECKPOINT_INTERVAL = 2.0  # 續傳紀錄 (.part.json) 的更新間隔 (秒)
+# --- 單一連線下載 I/O 設定 ---
+STREAM_CHUNK_MIN = 64 * 1024      # 自適應讀取區塊的下限 (bytes)
+STREAM_CHUNK_MAX = 4 * 1024 * 1024 # 自適應讀取區塊的上限，也是重複使用的緩衝區大小 (bytes)
+STREAM_CHUNK_FAST = 0.02          # 讀滿一個區塊快於此秒數時區塊加倍
+STREAM_CHUNK_SLOW = 0.25          # 單次讀取慢於此秒數時區塊減半 (讓進度回報保持即時)
+PROGRESS_REFRESH_INTERVAL = 0.2   # 終端機進度列的最短重繪間隔 (秒)
+PROGRESS_MACHINE_INTERVAL = 2.0   # 非 TTY 時輸出 JSON 進度行的間隔 (秒)
+# --- 播放清單 / 頻道管線設定 ---
+PLAYLIST_LOOKAHEAD = 3            # 下載進行中時，最多預先解析幾個後續項目的串流
+PLAYLIST_PARALLEL_DOWNLOADS = 1   # 同時下載的項目數 (每個項目本身已使用多條連線)
+PLAYLIST_MAX_PAGES = 200          # 分頁上限，避免異常的 nextpage 造成無窮迴圈
+BANDWIDTH_PRIORITY = 'interactive' # 在共用頻寬預算中的優先權 (--priority 覆寫)
+# --- 串流選擇策略 ---
+# 目標輸出格式 -> 可直接 stream copy 的來源編碼 (codec 字串前綴)；其他編碼都需要完整解碼再編碼
+TARGET_COPY_CODECS = {'m4a': ('mp4a',), 'mp4': ('mp4a',), 'aac': ('mp4a',), 'webm': ('opus', 'vorbis'),
+                      'opus': ('opus',), 'ogg': ('opus', 'vorbis'), 'mp3': ('mp3',)}
+# --- 邊下載邊分析響度 ---
+LOUDNORM_FILTER = "loudnorm=I=-12:TP=-1.5:LRA=11:print_format=json" # 必須與 audio_enricher.sh normalize_audio 的目標一致
+LOUDNESS_SEGMENT_SIZE = 4 * 1024 * 1024 # 分析模式下依檔案順序分配的分段大小，讓連續前綴穩定增長 (bytes)
+LOUDNESS_FEED_SIZE = 256 * 1024   # 每次餵給 ffmpeg 的大小 (bytes)
+SCRIPT_VERSION = "4.11.0"
 
 def log_message(level, message):
     print(f"[{level}] {message}", file=sys.stderr)
@@ -30,20 +79,103 @@ except ImportError:
     log_message("WARN", "未找到 'curl_cffi' 模組。後備方案將不可用。可執行 'pip install curl_cffi'。")
     CURL_CFFI_AVAILABLE = False
 
+try:
+    import bandwidth_governor # 同目錄的跨行程頻寬預算；沒有時不限速
+except ImportError:
+    bandwidth_governor = None
+
+# --- 共用 HTTP 用戶端 ---
+# 整個行程只建立一個 cloudscraper 工作階段 (requests.Session 子類別：keep-alive 連線池、Cookie 與 Cloudflare
+# 通關狀態) 與一個 curl_cffi AsyncSession (常駐於背景事件迴圈)。元數據查詢、探測與媒體下載全部共用，
+# 批次處理多個項目時也不會重複 TCP/TLS 握手與 Cloudflare 挑戰。
+_client_lock = threading.Lock()
+_http_session = None
+_async_loop = None
+_async_session = None
+_bandwidth_governor = None
+
+def get_http_session():
+    global _http_session
+    with _client_lock:
+        if _http_session is None:
+            _http_session = cloudscraper.create_scraper(browser={'browser': 'chrome', 'platform': 'windows', 'desktop': True})
+        return _http_session
+
+def run_blocking(func, *args):
+    """
+    在 daemon 執行緒執行阻塞式 (cloudscraper) 請求並回傳 asyncio Future。
+    requests 的逾時只限制單次 socket 操作，緩慢送資料的伺服器可拖住請求；對沖查詢放棄它之後，
+    daemon 執行緒也不會在行程結束時被 join (一般 ThreadPoolExecutor 即使 shutdown(wait=False) 仍會等待)。
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    def settle(result, error):
+        if future.done(): return # 已被取消 (對沖查詢的落敗者)
+        if error is not None: future.set_exception(error)
+        else: future.set_result(result)
+    def worker():
+        try: result, error = func(*args), None
+        except Exception as e: result, error = None, e
+        try: loop.call_soon_threadsafe(settle, result, error)
+        except RuntimeError: pass # 事件迴圈已關閉，結果無人等待
+    threading.Thread(target=worker, name="http", daemon=True).start()
+    return future
+
+def get_bandwidth_governor():
+    """本行程在共用頻寬預算中的 token bucket；未設定總預算時回傳 None。"""
+    global _bandwidth_governor
+    with _client_lock:
+        if _bandwidth_governor is None:
+            _bandwidth_governor = (bandwidth_governor and bandwidth_governor.BandwidthGovernor.join(BANDWIDTH_PRIORITY, "invidious_downloader")) or False
+        return _bandwidth_governor or None
+
+def run_async(coro):
+    """在常駐背景事件迴圈上執行協程並等待結果 (AsyncSession 與其連線因此可跨呼叫重用)。"""
+    global _async_loop
+    with _client_lock:
+        if _async_loop is None:
+            _async_loop = asyncio.new_event_loop()
+            threading.Thread(target=_async_loop.run_forever, name="async-http", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _async_loop).result()
+
+def _get_async_session():
+    """只能在背景事件迴圈內呼叫。"""
+    global _async_session
+    if _async_session is None: _async_session = AsyncSession()
+    return _async_session
+
+def close_http_clients():
+    global _http_session, _async_session, _bandwidth_governor
+    if _async_session is not None and _async_loop is not None and _async_loop.is_running():
+        try: asyncio.run_coroutine_threadsafe(_async_session.close(), _async_loop).result(timeout=5)
+        except Exception: pass
+    if _async_loop is not None: _async_loop.call_soon_threadsafe(_async_loop.stop)
+    if _http_session is not None: _http_session.close()
+    if _bandwidth_governor: _bandwidth_governor.close()
+    _http_session = _async_session = _bandwidth_governor = None
+
+atexit.register(close_http_clients)
+
 
 def parse_youtube_url(url):
-    # 現在 urlparse 可以被正確找到了
+    """回傳 (類型, ID)：('video', 影片 ID)、('playlist', 清單 ID) 或 ('channel', Piped 頻道路徑如 'channel/UC...'、'c/@handle')。"""
     parsed_url = urlparse(url)
-    if 'youtube.com' in parsed_url.hostname or 'youtu.be' in parsed_url.hostname:
-        if 'v' in parse_qs(parsed_url.query): return 'video', parse_qs(parsed_url.query)['v'][0]
-        if 'youtu.be' in parsed_url.hostname: return 'video', parsed_url.path.strip('/')
+    hostname = parsed_url.hostname or ''
+    if 'youtube.com' in hostname or 'youtu.be' in hostname:
+        query = parse_qs(parsed_url.query)
+        if 'v' in query: return 'video', query['v'][0]
+        if 'youtu.be' in hostname: return 'video', parsed_url.path.strip('/')
+        path_parts = [part for part in parsed_url.path.split('/') if part]
+        if path_parts and path_parts[0] in ('shorts', 'live') and len(path_parts) > 1: return 'video', path_parts[1]
+        if 'list' in query: return 'playlist', query['list'][0]
+        if path_parts and path_parts[0].startswith('@'): return 'channel', f"c/{path_parts[0]}"
+        if len(path_parts) > 1 and path_parts[0] in ('channel', 'c', 'user'): return 'channel', f"{path_parts[0]}/{path_parts[1]}"
     return None, None
 
 def get_data_with_cloudscraper(api_url):
     try:
         log_message("INFO", f"【策略 1: cloudscraper】正在嘗試從 {api_url} 獲取資訊...")
-        scraper = cloudscraper.create_scraper(browser={'browser': 'chrome', 'platform': 'windows', 'desktop': True})
-        response = scraper.get(api_url, timeout=25)
+        response = get_http_session().get(api_url, timeout=PIPED_REQUEST_TIMEOUT)
         response.raise_for_status()
         return response.json()
     except Exception as e:
@@ -55,32 +187,222 @@ async def _get_data_with_curl_cffi_async(api_url):
         return None
     try:
         log_message("INFO", f"【策略 2: curl_cffi】正在嘗試從 {api_url} 獲取資訊...")
-        async with AsyncSession() as session:
-            response = await session.get(api_url, impersonate="chrome110", timeout=25)
-            response.raise_for_status()
-            return response.json()
+        response = await _get_async_session().get(api_url, impersonate="chrome110", timeout=PIPED_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
         log_message("WARN", f"【策略 2: curl_cffi】失敗: {e}")
         return None
 
-def get_data_with_curl_cffi(api_url):
-    return asyncio.run(_get_data_with_curl_cffi_async(api_url))
 
+# --- 實例健康度 (延遲 / 失敗率 EWMA，持久化於磁碟) ---
+def load_instance_health():
+    try:
+        with open(INSTANCE_HEALTH_PATH, 'r', encoding='utf-8') as f: health = json.load(f)
+        return health if isinstance(health, dict) else {}
+    except (OSError, ValueError):
+        return {}
 
-def get_best_audio_stream_from_piped(video_id):
-    api_url = f"{PIPED_INSTANCE}/streams/{video_id}"
-    data = get_data_with_cloudscraper(api_url)
-    if data is None:
-        data = get_data_with_curl_cffi(api_url)
+def save_instance_health(health):
+    try:
+        os.makedirs(os.path.dirname(INSTANCE_HEALTH_PATH), exist_ok=True)
+        tmp_path = f"{INSTANCE_HEALTH_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(health, f, indent=1)
+        os.replace(tmp_path, INSTANCE_HEALTH_PATH)
+    except OSError as e:
+        log_message("WARN", f"無法寫入實例健康紀錄: {e}")
+
+def update_instance_health(health, instance, latency=None, failed=False):
+    """failed=None 只更新延遲 (被取消的對沖落敗者)：不算成功也不算失敗，不計入失敗率與樣本數。"""
+    entry = health.setdefault(instance, {'latency': HEALTH_DEFAULT_LATENCY, 'failure': 0.0, 'samples': 0})
+    if latency is not None:
+        entry['latency'] = latency if entry['samples'] == 0 else (1 - HEALTH_EWMA_ALPHA) * entry['latency'] + HEALTH_EWMA_ALPHA * latency
+    if failed is not None:
+        entry['failure'] = (1 - HEALTH_EWMA_ALPHA) * entry['failure'] + HEALTH_EWMA_ALPHA * (1.0 if failed else 0.0)
+        entry['samples'] += 1
+    entry['updated_at'] = int(time.time())
+
+def rank_instances(instances, health):
+    """最快且健康的實例排在前面 (失敗率越高，等效延遲越大)。"""
+    def score(instance):
+        entry = health.get(instance) or {}
+        return entry.get('latency', HEALTH_DEFAULT_LATENCY) * (1 + 10 * entry.get('failure', 0.0))
+    return sorted(instances, key=score)
+
+def _is_valid_streams_response(data):
+    return isinstance(data, dict) and not data.get('error') and bool(data.get('audioStreams') or data.get('videoStreams'))
+
+# --- 對沖 (hedged) 查詢：依序錯開啟動，第一個有效回應勝出 ---
+async def _hedged_fetch(api_path, instances, validate=_is_valid_streams_response):
+    health = load_instance_health()
+    strategies = [('cloudscraper', None)] + ([('curl_cffi', None)] if CURL_CFFI_AVAILABLE else [])
+    attempts = [(instance, name) for instance in rank_instances(instances, health) for name, _ in strategies]
+    loop = asyncio.get_running_loop()
+    timed_out = False
+
+    # 第 i 個組合在第 i-1 個啟動後 PIPED_HEDGE_DELAY 秒、或第 i-1 個失敗時 (取較早者) 啟動
+    ready = [asyncio.Event() for _ in attempts]
+    if ready: ready[0].set()
+
+    def release_next(index):
+        if index + 1 < len(ready): ready[index + 1].set()
+
+    async def attempt(index, instance, strategy):
+        await ready[index].wait()
+        hedge_timer = loop.call_later(PIPED_HEDGE_DELAY, release_next, index)
+        api_url = f"{instance}/{api_path}"
+        start = time.monotonic()
+        try:
+            if strategy == 'cloudscraper': data = await run_blocking(get_data_with_cloudscraper, api_url)
+            else: data = await _get_data_with_curl_cffi_async(api_url)
+        except asyncio.CancelledError:
+            # 整體逾時仍未回應算失敗；被勝出者取消的落敗者只記錄延遲 (至少這麼慢)
+            update_instance_health(health, instance, latency=time.monotonic() - start, failed=True if timed_out else None)
+            raise
+        elapsed = time.monotonic() - start
+        valid = validate(data)
+        update_instance_health(health, instance, latency=elapsed if valid else None, failed=not valid)
+        if not valid:
+            hedge_timer.cancel(); release_next(index)
+            raise ValueError(f"{instance} ({strategy}) 無有效回應")
+        log_message("INFO", f"採用 {instance} ({strategy}) 的回應，耗時 {elapsed:.2f} 秒。")
+        return data
+
+    tasks = [asyncio.ensure_future(attempt(i, instance, strategy)) for i, (instance, strategy) in enumerate(attempts)]
+    result = None
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=PIPED_TOTAL_TIMEOUT):
+            try:
+                result = await next_done
+                break
+            except asyncio.TimeoutError:
+                log_message("WARN", f"所有實例在 {PIPED_TOTAL_TIMEOUT} 秒內均未回應。")
+                timed_out = True
+                break
+            except Exception as e:
+                log_message("WARN", f"對沖查詢: {e}")
+    finally:
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        save_instance_health(health)
+    return result
+
+# --- /streams 快取 ---
+# 每個影片 ID 一個 JSON 檔 ({video_id, fetched_at, expires_at, data})，有效至簽名串流 URL 中最早的 expire= 為止。
+# 重試、續傳與只需要標題 / 縮圖 / 長度的呼叫者都直接讀取快取，不必再經過緩慢且受 Cloudflare 保護的實例。
+def streams_expiry(data):
+    """/streams 回應中所有串流 URL 最早的 expire= 時間戳；沒有簽名 URL 時回傳 None。"""
+    expiries = []
+    for stream in (data.get('audioStreams') or []) + (data.get('videoStreams') or []):
+        expire = parse_qs(urlparse(stream.get('url') or '').query).get('expire')
+        try: expiries.append(int(expire[0]))
+        except (TypeError, ValueError): pass
+    return min(expiries) if expiries else None
+
+def _streams_cache_path(video_id):
+    return os.path.join(STREAMS_CACHE_DIR, f"{re.sub(r'[^A-Za-z0-9_-]', '_', video_id)}.json")
+
+def load_cached_streams(video_id):
+    """回傳仍有效的快取 /streams 回應，或 None。"""
+    try:
+        with open(_streams_cache_path(video_id), 'r', encoding='utf-8') as f: entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or not _is_valid_streams_response(entry.get('data')): return None
+    if time.time() + STREAMS_CACHE_EXPIRY_MARGIN >= entry.get('expires_at', 0): return None
+    return entry['data']
+
+def save_cached_streams(video_id, data):
+    expires_at = streams_expiry(data) or int(time.time()) + STREAMS_CACHE_DEFAULT_TTL
+    path = _streams_cache_path(video_id)
+    try:
+        os.makedirs(STREAMS_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'video_id': video_id, 'fetched_at': int(time.time()), 'expires_at': expires_at, 'data': data}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        prune_streams_cache()
+    except OSError as e:
+        log_message("WARN", f"無法寫入串流快取: {e}")
+
+def invalidate_cached_streams(video_id):
+    try: os.remove(_streams_cache_path(video_id))
+    except OSError: pass
+
+def prune_streams_cache():
+    cutoff = time.time() - STREAMS_CACHE_MAX_AGE
+    for entry in os.scandir(STREAMS_CACHE_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff: os.remove(entry.path)
+        except OSError: pass
+
+async def _fetch_streams(video_id, instances, refresh=False):
+    if not refresh:
+        data = load_cached_streams(video_id)
+        if data is not None:
+            log_message("INFO", f"使用快取的串流資訊 ({video_id})。")
+            return data
+    else:
+        invalidate_cached_streams(video_id)
+    data = await _hedged_fetch(f"streams/{video_id}", instances or PIPED_INSTANCES)
+    if data is not None: save_cached_streams(video_id, data)
+    return data
+
+def fetch_piped_streams(video_id, instances=None, refresh=False):
+    """
+    取得 /streams/{video_id}：快取仍有效時直接回傳，否則以對沖方式向多個 Piped 實例 (及多種策略) 查詢並寫入快取。
+    refresh=True 時略過快取 (例如串流 URL 已回應 403 / 410)。回傳 JSON，或 None。
+    """
+    return run_async(_fetch_streams(video_id, instances, refresh))
+
+def get_stream_metadata(video_id, instances=None):
+    """標題、上傳者、長度與縮圖 (取自 /streams 快取)；失敗時回傳 None。"""
+    data = fetch_piped_streams(video_id, instances)
+    if data is None: return None
+    return {'id': video_id, 'title': data.get('title'), 'uploader': data.get('uploader'),
+            'duration': data.get('duration'), 'thumbnail': data.get('thumbnailUrl')}
+
+def get_best_audio_stream_from_piped(video_id, instances=None, refresh=False, **policy):
+    data = fetch_piped_streams(video_id, instances, refresh)
     if data is None:
         log_message("ERROR", "所有策略均告失敗，無法獲取影片資訊。")
         return None, None, None
+    return select_best_audio_stream(data, video_id, **policy)
+
+def _stream_size(stream, duration):
+    """串流大小 (bytes)：優先使用 contentLength，否則以位元率 × 長度估算；未知時回傳 None。"""
+    try: return int(stream['contentLength'])
+    except (KeyError, TypeError, ValueError): pass
+    return int(stream['bitrate'] * duration / 8) if stream.get('bitrate') and duration else None
+
+def select_best_audio_stream(data, video_id, target=None, max_bitrate=None, max_size=None):
+    """
+    依選擇策略從 /streams 回應中挑出音訊串流；回傳 (URL, 安全標題, 副檔名)。
+    target: 目標輸出格式 (TARGET_COPY_CODECS 的鍵)；可直接 stream copy 的編碼優先，其次才比位元率。
+    max_bitrate (bps) / max_size (bytes): 上限；沒有串流符合時退而選擇最小的串流。
+    未指定任何策略時即為位元率最高的串流。
+    """
     try:
-        audio_streams = data.get('audioStreams', [])
+        audio_streams = [stream for stream in data.get('audioStreams', []) if stream.get('url')]
         if not audio_streams:
             log_message("ERROR", "成功獲取數據，但在其中未找到 'audioStreams'。")
             return None, None, None
-        best_stream = sorted(audio_streams, key=lambda x: x.get('bitrate', 0), reverse=True)[0]
+        duration = data.get('duration')
+        copy_codecs = TARGET_COPY_CODECS.get(target, ()) if target else ()
+        def copyable(stream): return (stream.get('codec') or '').lower().startswith(copy_codecs) if copy_codecs else False
+        def within_caps(stream):
+            if max_bitrate and stream.get('bitrate', 0) > max_bitrate: return False
+            size = _stream_size(stream, duration)
+            return not (max_size and size is not None and size > max_size)
+        candidates = [stream for stream in audio_streams if within_caps(stream)]
+        if candidates:
+            best_stream = max(candidates, key=lambda x: (copyable(x), x.get('bitrate', 0)))
+        else:
+            best_stream = min(audio_streams, key=lambda x: (_stream_size(x, duration) or 0, x.get('bitrate', 0)))
+            log_message("WARN", "沒有符合位元率 / 大小上限的音訊串流，改用最小的串流。")
+        if target:
+            action = "可直接複製為" if copyable(best_stream) else "需轉碼為"
+            log_message("INFO", f"選擇音訊串流: {best_stream.get('codec') or '?'} {best_stream.get('bitrate', 0) / 1000:.0f} kbps ({action} {target})")
         stream_url = best_stream.get('url')
         video_title = data.get('title', video_id)
         safe_title = re.sub(r'[\\/*?:"<>|]', "_", video_title)
@@ -92,39 +414,569 @@ def get_best_audio_stream_from_piped(video_id):
         log_message("ERROR", f"解析 Piped 數據時發生錯誤: {e}")
         return None, None, None
 
-def download_file(url, output_path):
+# --- 邊下載邊分析響度 ---
+# 下載中的位元組同時經由 stdin 餵給 ffmpeg 執行 loudnorm 第一遍分析，下載完成後分析也幾乎同時完成；
+# 結果寫入 <輸出>.loudnorm.json，audio_enricher.sh 看到此檔即跳過自己的第一遍分析。
+# 分析失敗 (沒有 ffmpeg、管線中斷、解碼錯誤) 一律只影響分析本身，不會讓下載失敗。
+class LoudnessAnalyzer:
+    def __init__(self):
+        self.broken = False
+        self._stderr = []
+        self.process = subprocess.Popen(
+            ['ffmpeg', '-hide_banner', '-nostats', '-i', 'pipe:0', '-vn', '-af', LOUDNORM_FILTER, '-f', 'null', '-'],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self._reader = threading.Thread(target=lambda: self._stderr.append(self.process.stderr.read()), daemon=True)
+        self._reader.start()
+
+    @classmethod
+    def create(cls):
+        """ffmpeg 不可用時回傳 None。"""
+        if not shutil.which('ffmpeg'):
+            log_message("WARN", "找不到 ffmpeg，略過下載時的響度分析。")
+            return None
+        try: return cls()
+        except OSError as e:
+            log_message("WARN", f"無法啟動 ffmpeg 響度分析: {e}")
+            return None
+
+    def feed(self, data):
+        if self.broken: return
+        try: self.process.stdin.write(data)
+        except (BrokenPipeError, OSError, ValueError):
+            self.broken = True
+
+    def finish(self, timeout=300):
+        """結束輸入並等待分析；回傳 loudnorm 量測結果 (dict) 或 None。"""
+        try: self.process.stdin.close()
+        except (BrokenPipeError, OSError): pass
+        try: self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.abort(); return None
+        self._reader.join(timeout=5)
+        output = b''.join(self._stderr).decode('utf-8', 'replace')
+        match = re.search(r'\{[^{}]*"input_i"[^{}]*\}', output)
+        if self.process.returncode != 0 or not match:
+            log_message("WARN", "下載時的響度分析未產生結果，將由後續處理重新分析。")
+            return None
+        try: return json.loads(match.group(0))
+        except ValueError: return None
+
+    def abort(self):
+        self.broken = True
+        try: self.process.kill(); self.process.wait(timeout=5)
+        except Exception: pass
+
+def write_loudness_sidecar(output_path, stats):
+    sidecar_path = f"{output_path}.loudnorm.json"
+    with open(sidecar_path, 'w', encoding='utf-8') as f: json.dump(stats, f, indent=2)
+    return sidecar_path
+
+# --- 進度回報 ---
+class ProgressReporter:
+    """
+    節流的進度回報 (可由多個執行緒呼叫)。TTY 上以固定頻率重繪進度列；
+    非 TTY (管線、日誌檔) 時每 PROGRESS_MACHINE_INTERVAL 秒輸出一行 {"type": "progress", ...} JSON。
+    """
+    def __init__(self, total_size, stream=None, interactive=None):
+        self.stream = stream or sys.stderr
+        self.total_size = total_size
+        self.interactive = self.stream.isatty() if interactive is None else interactive
+        self.interval = PROGRESS_REFRESH_INTERVAL if self.interactive else PROGRESS_MACHINE_INTERVAL
+        self.started = time.monotonic()
+        self._last = float('-inf')
+        self._lock = threading.Lock()
+
+    def update(self, done, force=False):
+        now = time.monotonic()
+        if not force and now - self._last < self.interval: return
+        if not self._lock.acquire(blocking=force): return # 其他執行緒正在回報
+        try:
+            self._last = now
+            rate = done / max(now - self.started, 1e-6)
+            if self.interactive:
+                filled = int(50 * done / self.total_size) if self.total_size else 0
+                self.stream.write(f"\r[{'=' * filled}{' ' * (50 - filled)}] {done/1024/1024:.2f} MB  {rate/1024/1024:.1f} MB/s")
+            else:
+                self.stream.write(json.dumps({'type': 'progress', 'bytes': done, 'total': self.total_size or None, 'rate': int(rate)}) + '\n')
+            self.stream.flush()
+        finally:
+            self._lock.release()
+
+    def close(self, done):
+        self.update(done, force=True)
+        if self.interactive: self.stream.write('\n'); self.stream.flush()
+
+# --- 單一連線下載 ---
+def _response_readinto(response):
+    """
+    回傳 readinto(buffer) -> 讀到的位元組數。未壓縮的回應使用 urllib3 公開的 raw.readinto 讀進我們重複使用的緩衝區
+    (略過 iter_content 的區塊產生器)；raw 沒有 readinto 或內容有壓縮時退回 iter_content。
+    """
+    raw = getattr(response, 'raw', None)
+    if (response.headers.get('content-encoding') or 'identity').lower() == 'identity' and callable(getattr(raw, 'readinto', None)):
+        return raw.readinto
+    chunks, pending = response.iter_content(chunk_size=STREAM_CHUNK_MIN), [b'']
+    def readinto(view):
+        data = pending[0] or next(chunks, b'')
+        n = min(len(view), len(data))
+        view[:n] = data[:n]; pending[0] = data[n:]
+        return n
+    return readinto
+
+def _stream_to_file(response, output_path, total_size, analyzer=None, reporter=None, governor=None):
+    """
+    把回應本體寫入 output_path：讀入重複使用的緩衝區 (區塊大小在 STREAM_CHUNK_MIN..MAX 間依讀取耗時自適應)，
+    以 memoryview 直接寫出與餵給分析器，不產生額外複本。governor: 共用頻寬預算。回傳寫入的位元組數。
+    """
+    readinto = _response_readinto(response)
+    view = memoryview(bytearray(STREAM_CHUNK_MAX))
+    reporter = reporter or ProgressReporter(total_size)
+    chunk_size, done = STREAM_CHUNK_MIN, 0
+    with open(output_path, 'wb', buffering=0) as f:
+        while True:
+            started = time.monotonic()
+            n = readinto(view[:chunk_size])
+            if not n: break
+            elapsed = time.monotonic() - started
+            pending = view[:n]
+            while pending: pending = pending[f.write(pending):] # FileIO.write 可能只寫入一部分
+            if analyzer is not None: analyzer.feed(view[:n])
+            done += n
+            reporter.update(done)
+            if n == chunk_size and elapsed < STREAM_CHUNK_FAST: chunk_size = min(chunk_size * 2, STREAM_CHUNK_MAX)
+            elif elapsed > STREAM_CHUNK_SLOW: chunk_size = max(chunk_size // 2, STREAM_CHUNK_MIN)
+            if governor is not None:
+                governor.consume(n)
+                if governor.rate: chunk_size = min(chunk_size, max(STREAM_CHUNK_MIN, int(governor.rate / 4))) # 限速時保持平滑
+    reporter.close(done)
+    return done
+
+def download_file(url, output_path, analyzer=None):
     try:
-        import requests # ★★★ 核心修正：確保 requests 在此處被導入 ★★★
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        with requests.get(url, stream=True, timeout=90, headers=headers) as r:
+        headers = {'User-Agent': DOWNLOAD_USER_AGENT}
+        with get_http_session().get(url, stream=True, timeout=90, headers=headers) as r:
             r.raise_for_status()
-            total_size = int(r.headers.get('content-length', 0)); bytes_downloaded = 0
+            total_size = int(r.headers.get('content-length', 0))
             log_message("INFO", f"開始下載，總大小: {total_size / 1024 / 1024:.2f} MB")
-            with open(output_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk); bytes_downloaded += len(chunk)
-                    progress = int(50 * bytes_downloaded / total_size) if total_size > 0 else 0
-                    sys.stderr.write(f"\r[{'=' * progress}{' ' * (50 - progress)}] {bytes_downloaded/1024/1024:.2f} MB"); sys.stderr.flush()
-            sys.stderr.write('\n')
-            log_message("SUCCESS", f"檔案成功下載至: {output_path}")
-            return True
+            bytes_downloaded = _stream_to_file(r, output_path, total_size, analyzer, governor=get_bandwidth_governor())
+        if total_size and bytes_downloaded != total_size: raise IOError(f"下載不完整 ({bytes_downloaded}/{total_size} bytes)")
+        log_message("SUCCESS", f"檔案成功下載至: {output_path}")
+        return True
     except Exception as e:
         log_message("ERROR", f"下載過程中發生錯誤: {e}")
         return False
 
+def _serve_local_file(path):
+    """在 127.0.0.1 的隨機埠以背景執行緒提供 path 所在目錄；回傳 (檔案 URL, 伺服器)，用完需 shutdown() 與 server_close()。"""
+    from functools import partial
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args): pass
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=os.path.dirname(os.path.abspath(path))))
+    threading.Thread(target=server.serve_forever, name="benchmark-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/{quote(os.path.basename(path))}", server
+
+def benchmark_download_io(url, runs=3):
+    """
+    在同一個 URL 上比較舊的傳輸迴圈 (iter_content 8 KiB、每個區塊重繪進度) 與 _stream_to_file。
+    url 是本機檔案時改由 127.0.0.1 的 HTTP 伺服器提供，排除網路變因 (可重現的本機基準)。
+    進度輸出導向 os.devnull 並視為 TTY，只量測系統呼叫與 CPU 成本。回傳 {名稱: {'mb_per_s', 'cpu_s'}} (取最佳值)。
+    """
+    if os.path.isfile(url):
+        local_url, server = _serve_local_file(url)
+        try: return benchmark_download_io(local_url, runs)
+        finally: server.shutdown(); server.server_close()
+    import tempfile
+    def legacy(response, output_path, total_size, sink):
+        bytes_downloaded = 0
+        with open(output_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                f.write(chunk); bytes_downloaded += len(chunk)
+                progress = int(50 * bytes_downloaded / total_size) if total_size > 0 else 0
+                sink.write(f"\r[{'=' * progress}{' ' * (50 - progress)}] {bytes_downloaded/1024/1024:.2f} MB"); sink.flush()
+        return bytes_downloaded
+    def adaptive(response, output_path, total_size, sink):
+        return _stream_to_file(response, output_path, total_size, reporter=ProgressReporter(total_size, sink, interactive=True))
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir, open(os.devnull, 'w') as sink:
+        output_path = os.path.join(temp_dir, 'benchmark.bin')
+        for name, transfer in (('legacy', legacy), ('adaptive', adaptive)):
+            best = None
+            for _ in range(runs):
+                with get_http_session().get(url, stream=True, timeout=90, headers={'User-Agent': DOWNLOAD_USER_AGENT}) as r:
+                    r.raise_for_status()
+                    wall, cpu = time.perf_counter(), time.process_time()
+                    size = transfer(r, output_path, int(r.headers.get('content-length', 0)), sink)
+                    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                sample = {'mb_per_s': round(size / 1024 / 1024 / wall, 1), 'cpu_s': round(cpu, 3), 'bytes': size}
+                if best is None or sample['mb_per_s'] > best['mb_per_s']: best = sample
+            results[name] = best
+    return results
+
+# --- 分段並行 Range 下載 (可續傳) ---
+# 檔案先以 posix_fallocate 預先配置，再切成 N 個位元組範圍各自以一條連線下載，並以 pwrite 寫到各自的偏移。
+# 先完成的連線會「竊取」剩餘最多的分段的後半段，因此不會被單一慢連線拖住；分段失敗時從已寫入的位置續傳。
+# 下載中的資料寫入 <輸出>.part，已完成的位元組範圍、來源 URL、Content-Length 與 ETag 記錄在 <輸出>.part.json，
+# 中斷 (例如 Termux 被終止) 後重新執行只會補抓缺少的範圍；簽名 URL 過期時經由 resolve_url (Piped) 重新取得。
+def probe_download_size(url, headers):
+    """回傳 (總大小, 是否支援 Range, ETag, HTTP 狀態)；以 Range: bytes=0-0 探測。"""
+    with get_http_session().get(url, headers=dict(headers, Range='bytes=0-0'), stream=True, timeout=30) as r:
+        if r.status_code in (403, 410): return 0, False, None, r.status_code
+        r.raise_for_status()
+        content_range = r.headers.get('Content-Range', '')
+        etag = r.headers.get('ETag')
+        if r.status_code == 206 and '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+            return int(content_range.rsplit('/', 1)[1]), True, etag, r.status_code
+        return int(r.headers.get('Content-Length') or 0), False, etag, r.status_code
+
+def url_expired(url, margin=60):
+    """googlevideo 等簽名 URL 帶有 expire= 時間戳；已過期 (或即將過期) 回傳 True。"""
+    expire = parse_qs(urlparse(url).query).get('expire')
+    try: return bool(expire) and int(expire[0]) <= time.time() + margin
+    except ValueError: return False
+
+def _preallocate(fd, size):
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError): # 不支援 fallocate 的平台 / 檔案系統
+        os.ftruncate(fd, size)
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(r for r in ranges if r[1] > r[0]):
+        if merged and start <= merged[-1][1]: merged[-1][1] = max(merged[-1][1], end)
+        else: merged.append([start, end])
+    return merged
+
+def load_resume_state(state_path):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f: state = json.load(f)
+        return state if isinstance(state, dict) and isinstance(state.get('completed'), list) else None
+    except (OSError, ValueError):
+        return None
+
+def save_resume_state(state_path, resume_state):
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(resume_state, f)
+    os.replace(tmp_path, state_path)
+
+class _SegmentState:
+    """所有分段的共享狀態；每個分段為 [pos, end)，pos 由下載者推進，end 可能被竊取者縮短。"""
+    def __init__(self, total_size, connections, url, completed=None, segment_size=None):
+        self.lock = threading.Lock()
+        self.total_size = total_size
+        self.url = url
+        self.completed = _merge_ranges(completed or [])
+        missing, cursor = [], 0
+        for start, end in self.completed + [[total_size, total_size]]:
+            if start > cursor: missing.append((cursor, min(start, total_size)))
+            cursor = max(cursor, end)
+        self.downloaded = total_size - sum(end - start for start, end in missing)
+        step = segment_size or max(SEGMENT_MIN_SIZE, -(-sum(end - start for start, end in missing) // connections))
+        self.pending = [{'start': pos, 'pos': pos, 'end': min(pos + step, end)} for start, end in missing for pos in range(start, end, step)]
+        self.segments = list(self.pending) # 所有曾建立的分段；[start, pos) 即為已寫入的範圍
+        self.active = []
+
+    def next_segment(self):
+        """取得下一個分段：先取未分配的，沒有則竊取剩餘最多的進行中分段的後半段。"""
+        with self.lock:
+            if self.pending:
+                segment = self.pending.pop(0)
+            else:
+                victim = max(self.active, key=lambda seg: seg['end'] - seg['pos'], default=None)
+                if victim is None or victim['end'] - victim['pos'] < 2 * SEGMENT_MIN_SIZE: return None
+                middle = victim['pos'] + (victim['end'] - victim['pos']) // 2
+                segment = {'start': middle, 'pos': middle, 'end': victim['end']}
+                victim['end'] = middle
+                self.segments.append(segment)
+            self.active.append(segment)
+            return segment
+
+    def finish(self, segment):
+        with self.lock:
+            if segment in self.active: self.active.remove(segment)
+
+    def completed_ranges(self):
+        with self.lock:
+            return _merge_ranges(self.completed + [[seg['start'], seg['pos']] for seg in self.segments])
+
+    def contiguous_prefix(self):
+        """從檔案開頭起已連續寫入的位元組數。"""
+        ranges = self.completed_ranges()
+        return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+    def refresh_url(self, stale_url, resolve_url):
+        """簽名 URL 失效時 (403/410) 只由一個執行緒重新解析；回傳目前可用的 URL。"""
+        with self.lock:
+            if self.url == stale_url and resolve_url is not None:
+                log_message("WARN", "串流 URL 已失效，正在經由 Piped 重新取得...")
+                self.url = resolve_url() or stale_url
+            return self.url
+
+def _download_segment(session, headers, fd, segment, state, progress, resolve_url=None, governor=None):
+    """下載一個分段直到完成 (其 end 可能在過程中被縮短)；失敗時從目前位置重試。"""
+    failures = 0
+    while segment['pos'] < segment['end']:
+        url = state.url
+        try:
+            with session.get(url, headers=dict(headers, Range=f"bytes={segment['pos']}-{segment['end'] - 1}"), stream=True, timeout=30) as r:
+                if r.status_code in (403, 410):
+                    state.refresh_url(url, resolve_url)
+                    raise IOError(f"串流 URL 失效 (HTTP {r.status_code})")
+                if r.status_code != 206: raise IOError(f"伺服器未回應部分內容 (HTTP {r.status_code})")
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    with state.lock:
+                        remaining = segment['end'] - segment['pos']
+                        if remaining <= 0: break
+                        chunk = chunk[:remaining]
+                        offset = segment['pos']
+                    os.pwrite(fd, chunk, offset)
+                    with state.lock: # 寫入完成後才推進 pos，續傳紀錄絕不包含尚未寫入的位元組
+                        segment['pos'] += len(chunk)
+                        state.downloaded += len(chunk)
+                    progress()
+                    if governor is not None: governor.consume(len(chunk))
+                    failures = 0
+        except Exception as e:
+            failures += 1
+            if failures > SEGMENT_RETRIES: raise
+            log_message("WARN", f"分段 {segment['pos']}-{segment['end']} 失敗 ({e})，第 {failures} 次重試...")
+            time.sleep(min(2 ** failures, 30))
+
+def _feed_contiguous_prefix(fd, state, analyzer, stop):
+    """依序把 .part 中已連續完成的前綴餵給分析器，直到整個檔案餵完，或 stop 已設定且前綴不再增長。"""
+    fed = 0
+    while fed < state.total_size and not analyzer.broken:
+        available = state.contiguous_prefix()
+        if available <= fed:
+            if stop.is_set(): return
+            stop.wait(0.1); continue
+        data = os.pread(fd, min(LOUDNESS_FEED_SIZE, available - fed), fed)
+        if not data: return
+        analyzer.feed(data); fed += len(data)
+
+def download_file_segmented(url, output_path, connections=DOWNLOAD_CONNECTIONS, resolve_url=None, analyzer=None):
+    """
+    以多條連線分段下載到 output_path (經由 .part 與 .part.json 可續傳)；伺服器不支援 Range 或大小未知時退回 download_file。
+    resolve_url: 無參數函數，回傳新的串流 URL (簽名過期時使用)。
+    analyzer: LoudnessAnalyzer；提供時改用較小且依序分配的分段，並由背景執行緒把連續前綴依序餵給它。
+    """
+    part_path, state_path = f"{output_path}.part", f"{output_path}.part.json"
+    try:
+        headers = {'User-Agent': DOWNLOAD_USER_AGENT}
+        resume = load_resume_state(state_path) if os.path.exists(part_path) else None
+        if resume and resume.get('url') and not url_expired(resume['url']): url = resume['url'] # 續傳時沿用同一個來源
+        if url_expired(url) and resolve_url is not None: url = resolve_url() or url
+        total_size, ranges_supported, etag, status = probe_download_size(url, headers)
+        if status in (403, 410) and resolve_url is not None:
+            url = resolve_url() or url
+            total_size, ranges_supported, etag, status = probe_download_size(url, headers)
+        if not ranges_supported or total_size < 2 * SEGMENT_MIN_SIZE:
+            for path in (part_path, state_path): # 單一連線下載用不到先前的分段進度，不留下殘檔
+                try: os.remove(path)
+                except FileNotFoundError: pass
+            return download_file(url, output_path, analyzer)
+        if resume and (resume.get('total_size') != total_size or (resume.get('etag') and etag and resume['etag'] != etag)):
+            log_message("WARN", "遠端檔案已變更，捨棄先前的部分下載。")
+            resume = None
+        state = _SegmentState(total_size, max(1, connections), url, resume['completed'] if resume else None,
+                              LOUDNESS_SEGMENT_SIZE if analyzer is not None else None)
+        if resume: log_message("INFO", f"續傳先前的下載：已完成 {state.downloaded / 1024 / 1024:.2f} MB，剩餘 {(total_size - state.downloaded) / 1024 / 1024:.2f} MB")
+        log_message("INFO", f"開始分段下載，總大小: {total_size / 1024 / 1024:.2f} MB，連線數: {connections}")
+        # 不續傳時 (含捨棄續傳紀錄) 清空舊的 .part；fallocate 不會縮短檔案，較長的舊檔會留下多餘的尾端
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT | (0 if resume else os.O_TRUNC), 0o644)
+        reporter, last_save = ProgressReporter(total_size), [time.monotonic()]
+        def checkpoint():
+            (getattr(os, 'fdatasync', None) or os.fsync)(fd) # 先落盤資料，再記錄範圍
+            save_resume_state(state_path, {'url': state.url, 'total_size': total_size, 'etag': etag, 'completed': state.completed_ranges(), 'updated_at': int(time.time())})
+        def progress():
+            reporter.update(state.downloaded)
+            now = time.monotonic()
+            if now - last_save[0] >= RESUME_CHECKPOINT_INTERVAL:
+                last_save[0] = now
+                try: checkpoint()
+                except OSError as e: log_message("WARN", f"無法寫入續傳紀錄: {e}")
+        session, governor = get_http_session(), get_bandwidth_governor()
+        def worker():
+            while True:
+                segment = state.next_segment()
+                if segment is None: return
+                try: _download_segment(session, headers, fd, segment, state, progress, resolve_url, governor)
+                finally: state.finish(segment)
+        feeder, feeder_stop = None, threading.Event()
+        try:
+            if not resume: _preallocate(fd, total_size)
+            checkpoint()
+            if analyzer is not None:
+                feeder = threading.Thread(target=_feed_contiguous_prefix, args=(fd, state, analyzer, feeder_stop), name="loudness-feed", daemon=True)
+                feeder.start()
+            with ThreadPoolExecutor(max_workers=max(1, connections)) as pool:
+                futures = [pool.submit(worker) for _ in range(max(1, connections))]
+                for future in futures: future.result()
+        finally:
+            feeder_stop.set()
+            if feeder is not None: feeder.join() # 讀取 fd 的執行緒結束後才能關閉 fd
+            try: checkpoint()
+            except OSError: pass
+            os.close(fd)
+        reporter.close(state.downloaded)
+        if state.downloaded != total_size: raise IOError(f"下載不完整 ({state.downloaded}/{total_size} bytes)")
+        if os.path.getsize(part_path) != total_size: raise IOError(f"檔案大小不符 ({os.path.getsize(part_path)}/{total_size} bytes)")
+        os.replace(part_path, output_path)
+        os.remove(state_path)
+        log_message("SUCCESS", f"檔案成功下載至: {output_path}")
+        return True
+    except Exception as e:
+        log_message("ERROR", f"分段下載過程中發生錯誤: {e}")
+        if os.path.exists(state_path): log_message("INFO", "重新執行即可從中斷處續傳。")
+        return False
+
+def download_audio(url, output_path, connections=DOWNLOAD_CONNECTIONS, resolve_url=None, analyze_loudness=False):
+    """下載音訊；analyze_loudness 時同時進行響度分析。回傳 (是否成功, 響度結果檔路徑或 None)。"""
+    try: os.remove(f"{output_path}.loudnorm.json") # 不沿用舊的分析結果
+    except FileNotFoundError: pass
+    analyzer = LoudnessAnalyzer.create() if analyze_loudness else None
+    try:
+        ok = download_file_segmented(url, output_path, connections, resolve_url, analyzer)
+    except BaseException:
+        if analyzer is not None: analyzer.abort()
+        raise
+    if analyzer is None: return ok, None
+    if not ok:
+        analyzer.abort(); return False, None
+    stats = analyzer.finish()
+    if not stats: return True, None
+    try: return True, write_loudness_sidecar(output_path, stats)
+    except OSError as e:
+        log_message("WARN", f"無法寫入響度分析結果: {e}"); return True, None
+
+# --- 播放清單 / 頻道 ---
+def _is_valid_listing_response(data):
+    return isinstance(data, dict) and not data.get('error') and isinstance(data.get('relatedStreams'), list)
+
+def _video_id_from_related(item):
+    match = re.search(r"[?&]v=([A-Za-z0-9_-]{11})", item.get('url') or '')
+    return match.group(1) if match else None
+
+async def _list_items(url_type, list_id, instances):
+    """分頁取得播放清單 (/playlists/{id}) 或頻道 (/channel/{id}、/c/{name}、/user/{name}) 的所有影片。"""
+    first_path = f"playlists/{list_id}" if url_type == 'playlist' else list_id
+    data = await _hedged_fetch(first_path, instances, _is_valid_listing_response)
+    if data is None: raise IOError("無法取得播放清單 / 頻道資訊")
+    # 頻道的後續分頁以頻道 ID 為準 (/c/、/user/ 只能用於第一頁)
+    next_base = f"nextpage/playlists/{list_id}" if url_type == 'playlist' else f"nextpage/channel/{data.get('id') or list_id.split('/', 1)[-1]}"
+    items, seen = [], set()
+    for _ in range(PLAYLIST_MAX_PAGES):
+        for related in data.get('relatedStreams') or []:
+            video_id = _video_id_from_related(related)
+            if video_id and video_id not in seen:
+                seen.add(video_id); items.append({'id': video_id, 'title': related.get('title')})
+        if not data.get('nextpage'): break
+        data = await _hedged_fetch(f"{next_base}?nextpage={quote(data['nextpage'], safe='')}", instances, _is_valid_listing_response)
+        if data is None:
+            log_message("WARN", f"分頁中斷，僅取得前 {len(items)} 個項目。"); break
+    return items
+
+async def _playlist_pipeline(items, output_dir, instances, connections, lookahead, parallel_downloads, emit, analyze_loudness=False, policy=None):
+    """
+    有界的解析 / 下載管線：下載第 k 項時，第 k+1..k+lookahead 項的串流已在解析；
+    同時下載的項目數不超過 parallel_downloads。每個項目完成時呼叫 emit(record)。
+    """
+    loop = asyncio.get_running_loop()
+    window = asyncio.Semaphore(lookahead + parallel_downloads) # 已解析但未下載完的項目上限
+    download_slots = asyncio.Semaphore(parallel_downloads)
+    download_pool = ThreadPoolExecutor(max_workers=parallel_downloads, thread_name_prefix="download")
+
+    async def handle(index, item):
+        record = {'type': 'item', 'index': index, 'id': item['id'], 'title': item.get('title'), 'status': 'error', 'path': None, 'loudnorm': None}
+        async with window:
+            try:
+                data = await _fetch_streams(item['id'], instances)
+                if data is None: raise IOError("無法取得串流資訊")
+                stream_url, title, extension = select_best_audio_stream(data, item['id'], **(policy or {}))
+                if not stream_url: raise IOError("找不到音訊串流")
+                output_path = f"{output_dir}/{title} [{item['id']}].{extension}"
+                resolve_url = lambda: get_best_audio_stream_from_piped(item['id'], instances, refresh=True, **(policy or {}))[0]
+                async with download_slots:
+                    ok, loudnorm_path = await loop.run_in_executor(download_pool, download_audio, stream_url, output_path, connections, resolve_url, analyze_loudness)
+                if not ok: raise IOError("下載失敗")
+                record.update(status='ok', path=output_path, loudnorm=loudnorm_path, title=data.get('title') or record['title'])
+            except Exception as e:
+                record['error'] = str(e)
+        emit(record)
+        return record
+
+    try:
+        return await asyncio.gather(*(handle(index, item) for index, item in enumerate(items)))
+    finally:
+        download_pool.shutdown(wait=False)
+
+def download_collection(url_type, list_id, output_dir, instances=None, connections=DOWNLOAD_CONNECTIONS,
+                        lookahead=PLAYLIST_LOOKAHEAD, parallel_downloads=PLAYLIST_PARALLEL_DOWNLOADS, max_items=None, out=sys.stdout,
+                        analyze_loudness=False, policy=None):
+    """下載播放清單 / 頻道的音訊；每完成一項即輸出一行 NDJSON，最後輸出一行總結。回傳總結。"""
+    instances = instances or PIPED_INSTANCES
+    items = run_async(_list_items(url_type, list_id, instances))
+    if max_items: items = items[:max_items]
+    log_message("INFO", f"共 {len(items)} 個項目，預先解析 {lookahead} 項，同時下載 {parallel_downloads} 項。")
+    emit_lock = threading.Lock()
+    def emit(record):
+        with emit_lock: print(json.dumps(record, ensure_ascii=False), file=out, flush=True)
+    records = run_async(_playlist_pipeline(items, output_dir, instances, connections, max(0, lookahead), max(1, parallel_downloads), emit, analyze_loudness, policy))
+    ok = sum(1 for record in records if record['status'] == 'ok')
+    totals = {'type': 'total', 'items': len(records), 'ok': ok, 'failed': len(records) - ok}
+    emit(totals)
+    return totals
+
 def main():
+    global BANDWIDTH_PRIORITY
     parser = argparse.ArgumentParser(description=f"Piped 音訊下載器 v{SCRIPT_VERSION}")
-    parser.add_argument("url", help="YouTube 影片的 URL")
-    parser.add_argument("output_dir", help="儲存下載檔案的目錄")
+    parser.add_argument("url", help="YouTube 影片、播放清單 (list=) 或頻道的 URL")
+    parser.add_argument("output_dir", nargs="?", help="儲存下載檔案的目錄 (--info 時可省略)")
+    parser.add_argument("--instances", default=None, help="逗號分隔的 Piped API 實例清單 (預設: PIPED_INSTANCES 環境變數或內建清單)")
+    parser.add_argument("-c", "--connections", type=int, default=DOWNLOAD_CONNECTIONS, help=f"並行下載連線數 (預設: {DOWNLOAD_CONNECTIONS}；1 = 單一連線)")
+    parser.add_argument("--lookahead", type=int, default=PLAYLIST_LOOKAHEAD, help=f"播放清單 / 頻道：預先解析的項目數 (預設: {PLAYLIST_LOOKAHEAD})")
+    parser.add_argument("-j", "--parallel-downloads", type=int, default=PLAYLIST_PARALLEL_DOWNLOADS, help=f"播放清單 / 頻道：同時下載的項目數 (預設: {PLAYLIST_PARALLEL_DOWNLOADS})")
+    parser.add_argument("--max-items", type=int, default=None, help="播放清單 / 頻道：最多下載的項目數")
+    parser.add_argument("--priority", choices=["interactive", "normal", "background"], default=BANDWIDTH_PRIORITY, help=f"在共用頻寬預算中的優先權 (預設: {BANDWIDTH_PRIORITY})")
+    parser.add_argument("--target", choices=sorted(TARGET_COPY_CODECS), default=None, help="目標輸出格式；優先選擇可直接 stream copy 的音訊編碼 (例如 m4a -> AAC)")
+    parser.add_argument("--max-bitrate", type=float, default=None, help="音訊位元率上限 (kbps)")
+    parser.add_argument("--max-size", type=float, default=None, help="音訊大小上限 (MB)")
+    parser.add_argument("--benchmark-io", action="store_true", help="把 url 當作直接的媒體 URL (或本機檔案，經由 127.0.0.1 提供)，比較舊的與新的單一連線傳輸迴圈後輸出 JSON")
+    parser.add_argument("--benchmark-runs", type=int, default=3, help="--benchmark-io 每種迴圈的執行次數 (預設: 3)")
+    parser.add_argument("--info", action="store_true", help="只輸出影片資訊 (標題、上傳者、長度、縮圖) 的 JSON，不下載")
+    parser.add_argument("--analyze-loudness", action="store_true", help="下載時同時以 ffmpeg 進行 loudnorm 分析，結果寫入 <檔案>.loudnorm.json")
     args = parser.parse_args()
+    BANDWIDTH_PRIORITY = args.priority
+    if not args.output_dir and not (args.info or args.benchmark_io): parser.error("需要 output_dir")
+    if args.benchmark_io:
+        print(json.dumps(benchmark_download_io(args.url, max(1, args.benchmark_runs)), ensure_ascii=False))
+        sys.exit(0)
+    instances = [i.strip().rstrip('/') for i in args.instances.split(',') if i.strip()] if args.instances else None
+    policy = {'target': args.target, 'max_bitrate': args.max_bitrate * 1000 if args.max_bitrate else None,
+              'max_size': int(args.max_size * 1024 * 1024) if args.max_size else None}
     url_type, media_id = parse_youtube_url(args.url)
+    if url_type in ('playlist', 'channel'):
+        # 輸出 NDJSON：每個項目一行 ({"type": "item", "status", "path", ...})，最後一行為 {"type": "total", ...}
+        try: totals = download_collection(url_type, media_id, args.output_dir, instances, args.connections, args.lookahead, args.parallel_downloads, args.max_items, analyze_loudness=args.analyze_loudness, policy=policy)
+        except Exception as e:
+            log_message("CRITICAL", f"無法處理播放清單 / 頻道: {e}")
+            print(json.dumps({'type': 'total', 'items': 0, 'ok': 0, 'failed': 0}), flush=True)
+            sys.exit(1)
+        sys.exit(0 if totals['failed'] == 0 else 2)
     if not media_id or url_type != 'video':
         log_message("CRITICAL", "無法從 URL 中解析出有效的 YouTube 影片 ID。")
         sys.exit(1)
-    audio_url, title, extension = get_best_audio_stream_from_piped(media_id)
+    if args.info:
+        metadata = get_stream_metadata(media_id, instances)
+        if metadata is None: sys.exit(1)
+        print(json.dumps(metadata, ensure_ascii=False))
+        sys.exit(0)
+    audio_url, title, extension = get_best_audio_stream_from_piped(media_id, instances, **policy)
     if audio_url:
         output_path = f"{args.output_dir}/{title} [{media_id}].{extension}"
-        if download_file(audio_url, output_path):
+        resolve_url = lambda: get_best_audio_stream_from_piped(media_id, instances, refresh=True, **policy)[0]
+        if download_audio(audio_url, output_path, args.connections, resolve_url, args.analyze_loudness)[0]:
             print(output_path)
             sys.exit(0)
     log_message("CRITICAL", "最終下載失敗。")
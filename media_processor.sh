@@ -106,6 +106,9 @@ BASH_AUDIO_ENRICHER_SCRIPT_PATH="$HOME/media-processor-updates/audio_enricher.sh
 # --- 【重要】新增：Invidious 後備下載模組路徑 ---
 INVIDIOUS_DOWNLOADER_SCRIPT_PATH="$HOME/media-processor-updates/invidious_downloader.py"
 
+# --- 跨行程頻寬預算 (yt-dlp --limit-rate、rsync --bwlimit 與 Python 下載器共用) ---
+PYTHON_BANDWIDTH_GOVERNOR_SCRIPT_PATH="$HOME/media-processor-updates/bandwidth_governor.py"
+
 # Python 版本變數保留 (現在由設定檔管理，不再需要遠程檢查)
 PYTHON_CONVERTER_VERSION="1.0.0" # 可以設定一個基礎版本或從設定檔讀取
 
@@ -729,6 +732,9 @@ _get_error_details() {
         "E_FFMPEG_MUX")
             error_message="${RED}原因: FFmpeg 最終封裝失敗 (合併影像/音訊/字幕/封面時出錯)。\n      ${YELLOW}建議: \n      1. 請查看上方紅色的 FFmpeg 錯誤輸出。\n      2. 常見原因包含：封面圖片格式不支援、標題含有特殊符號導致元數據寫入失敗。\n      3. 您可以嘗試「選項 2 (無標準化)」下載看是否成功。${RESET}"
             ;;
+        "E_DISK_SPACE")
+            error_message="${RED}原因: 預估處理過程的暫存空間峰值 (下載 + WAV 中間檔 + 編碼) 超過可用空間，已取消處理。\n      ${YELLOW}建議: 清理儲存空間後重試，或改用「無標準化」選項 (不需要 WAV 中間檔)。${RESET}"
+            ;;
         "E_FILE_NOT_FOUND")
             error_message="${RED}原因: 流程顯示成功，但找不到最終產出的檔案。\n      ${YELLOW}建議: 可能是因為下載被意外中斷或被防毒軟體/系統清理機制刪除。${RESET}"
             ;;
@@ -944,6 +950,7 @@ auto_update_script() {
         "$BASH_AUDIO_ENRICHER_SCRIPT_PATH"         # 音訊豐富化 Bash 控制器
         "$PYTHON_METADATA_ENRICHER_SCRIPT_PATH"    # 音訊豐富化 Python 核心
         "$INVIDIOUS_DOWNLOADER_SCRIPT_PATH"        # Invidious（下載備用方案）
+        "$PYTHON_BANDWIDTH_GOVERNOR_SCRIPT_PATH"   # 跨行程頻寬預算
         # 未來若有新腳本，直接在此處增加一行即可
     )
     
@@ -1391,11 +1398,11 @@ normalize_audio() {
     elif [ -n "$item_title" ]; then
         text_to_check="$item_title"
         title_source="變數(item_title)"
-    elif [ -n "$media_json" ]; then
-        local json_title=$(echo "$media_json" | jq -r '.title // empty')
+    elif [ -s "$info_json_file" ]; then
+        local json_title=$(jq -r '.title // empty' "$info_json_file" 2>/dev/null)
         if [ -n "$json_title" ]; then
             text_to_check="$json_title"
-            title_source="變數(media_json)"
+            title_source="info JSON"
         fi
     fi
 
@@ -1713,6 +1720,105 @@ process_local_mp4() {
     return $result
 }
 
+######################################################################
+# 取得單一 URL 的 info JSON (每個 URL 只解析一次元數據)
+# 優先經由 estimate_size.py --dump-info-json 寫出 (共用 info JSON 快取，不做格式選擇)，否則直接 yt-dlp --dump-json。
+# 之後的標題、ID、大小預估與下載 (--load-info-json) 皆讀取此檔案。
+# 參數: $1=URL, $2=輸出檔案, $3=錯誤日誌 (可選)；成功時返回 0
+######################################################################
+fetch_info_json() {
+    local url="$1"
+    local info_json_file="$2"
+    local log_file="${3:-/dev/null}"
+    local python_exec=""
+    if command -v python3 &> /dev/null; then python_exec="python3"; elif command -v python &> /dev/null; then python_exec="python"; fi
+
+    if [ -n "$python_exec" ] && [ -f "$PYTHON_ESTIMATOR_SCRIPT_PATH" ]; then
+        $python_exec "$PYTHON_ESTIMATOR_SCRIPT_PATH" "$url" --dump-info-json --info-json "$info_json_file" 2>> "$log_file"
+    fi
+    if [ ! -s "$info_json_file" ]; then
+        log_message "DEBUG" "estimate_size.py 未寫出 info JSON，改用 yt-dlp --dump-json: $url"
+        yt-dlp --no-warnings --dump-json "$url" > "$info_json_file" 2>> "$log_file" || rm -f "$info_json_file"
+    fi
+    [ -s "$info_json_file" ]
+}
+
+######################################################################
+# 估計帳本 (estimate_size.py --ledger / --record-actual)
+# 下載前記錄所選格式的預估大小，下載成功後回報實際下載的位元組數，供 estimate_size.py 學習修正係數。
+# 兩者都只讀取已取得的 info JSON，不重新解析元數據；失敗只記錄 DEBUG，不影響下載流程。
+# 參數: $1=info JSON, $2=格式選擇器 (必須與實際下載所用的 -f 相同)；ledger_record_actual 之後為已下載的檔案
+######################################################################
+ledger_record_estimate() {
+    local info_json_file="$1" selector="$2" python_exec=""
+    if command -v python3 &> /dev/null; then python_exec="python3"; elif command -v python &> /dev/null; then python_exec="python"; fi
+    [ -n "$python_exec" ] && [ -f "$PYTHON_ESTIMATOR_SCRIPT_PATH" ] && [ -s "$info_json_file" ] || return 0
+    $python_exec "$PYTHON_ESTIMATOR_SCRIPT_PATH" --info-json "$info_json_file" "$selector" --ledger > /dev/null 2>&1 \
+        || log_message "DEBUG" "無法寫入估計帳本 (預估): $selector"
+}
+
+ledger_record_actual() {
+    local info_json_file="$1" selector="$2" python_exec=""; shift 2
+    if command -v python3 &> /dev/null; then python_exec="python3"; elif command -v python &> /dev/null; then python_exec="python"; fi
+    [ -n "$python_exec" ] && [ -f "$PYTHON_ESTIMATOR_SCRIPT_PATH" ] && [ -s "$info_json_file" ] && [ $# -gt 0 ] || return 0
+    $python_exec "$PYTHON_ESTIMATOR_SCRIPT_PATH" --info-json "$info_json_file" "$selector" --record-actual "$@" 2>/dev/null \
+        || log_message "DEBUG" "無法寫入估計帳本 (實際大小): $selector"
+}
+
+######################################################################
+# 預估處理流程的暫存空間峰值 (下載 + WAV 中間檔 + 最終編碼，estimate_size.py --pipeline)，空間不足則拒絕處理
+# 參數: $1=info JSON, $2=格式選擇器, $3=管線 (mp3/mp4/mkv), $4=暫存目錄, 其餘傳給估計腳本 (例如 --no-normalize)
+# 返回 1 表示空間不足 (已顯示錯誤)；無法預估時返回 0，不阻擋處理
+######################################################################
+check_pipeline_disk_space() {
+    local info_json_file="$1" selector="$2" pipeline="$3" temp_dir="$4" python_exec=""; shift 4
+    local label="${pipeline^^}"
+    if command -v python3 &> /dev/null; then python_exec="python3"; elif command -v python &> /dev/null; then python_exec="python"; fi
+    [ -n "$python_exec" ] && [ -f "$PYTHON_ESTIMATOR_SCRIPT_PATH" ] && [ -s "$info_json_file" ] && command -v jq &> /dev/null || return 0
+
+    local pipeline_prediction peak_bytes available_kb
+    pipeline_prediction=$($python_exec "$PYTHON_ESTIMATOR_SCRIPT_PATH" --info-json "$info_json_file" "$selector" --pipeline "$pipeline" "$@" 2>> "$temp_dir/py_estimator_${pipeline}_stderr.log")
+    peak_bytes=$(echo "$pipeline_prediction" | jq -r '.peak // empty' 2>/dev/null)
+    available_kb=$(df -Pk "$temp_dir" 2>/dev/null | awk 'NR==2 {print $4}')
+    log_message "INFO" "暫存空間峰值預估 ($label): ${peak_bytes:-未知} bytes (階段: $(echo "$pipeline_prediction" | jq -r '.peak_phase // "?"' 2>/dev/null))，可用: ${available_kb:-未知} KB"
+    if [[ "$peak_bytes" =~ ^[0-9]+$ ]] && [[ "$available_kb" =~ ^[0-9]+$ ]] && [ "$peak_bytes" -gt $((available_kb * 1024)) ]; then
+        log_message "ERROR" "暫存空間不足 ($label)：預估峰值 $peak_bytes bytes > 可用 $((available_kb * 1024)) bytes，取消處理。"
+        echo -e "${RED}錯誤：儲存空間不足！預估處理峰值約 $(awk "BEGIN {printf \"%.1f\", $peak_bytes/1048576}") MB，可用僅 $(awk "BEGIN {printf \"%.1f\", $available_kb/1024}") MB。${RESET}"
+        return 1
+    fi
+    return 0
+}
+
+######################################################################
+# 在共用頻寬預算下執行 yt-dlp 下載
+# yt-dlp 啟動後無法調整速率：先由 bandwidth_governor.py 取得固定配額 (KB/s，0 表示不限速)，
+# 以 --limit-rate 傳入 (外部下載器如 aria2c 亦由 yt-dlp 轉換)，結束後釋放配額。
+# 配額由目前的 (子) shell 持有，shell 異常結束時由預算登記表自動清除。
+# 參數: 完整的 yt-dlp 指令陣列 (第一個元素為 yt-dlp)；返回 yt-dlp 的退出碼
+######################################################################
+run_yt_dlp_with_bandwidth_lease() {
+    local cmd="$1"; shift
+    local lease_pid="${BASHPID:-$$}"
+    local rate_args=() kbps="" python_exec=""
+    if command -v python3 &> /dev/null; then python_exec="python3"; elif command -v python &> /dev/null; then python_exec="python"; fi
+
+    if [ -n "$python_exec" ] && [ -f "$PYTHON_BANDWIDTH_GOVERNOR_SCRIPT_PATH" ]; then
+        kbps=$($python_exec "$PYTHON_BANDWIDTH_GOVERNOR_SCRIPT_PATH" limit --priority interactive --pid "$lease_pid" --name yt-dlp 2>/dev/null)
+        if [[ "$kbps" =~ ^[0-9]+$ ]] && [ "$kbps" -gt 0 ]; then
+            rate_args=(--limit-rate "${kbps}K")
+            log_message "DEBUG" "共用頻寬預算：yt-dlp 限速 ${kbps} KB/s (優先權: interactive)"
+        fi
+    fi
+
+    "$cmd" "${rate_args[@]}" "$@"
+    local exit_code=$?
+
+    if [ ${#rate_args[@]} -gt 0 ]; then
+        $python_exec "$PYTHON_BANDWIDTH_GOVERNOR_SCRIPT_PATH" release --pid "$lease_pid" > /dev/null 2>&1
+    fi
+    return $exit_code
+}
+
 ######################################################################
 # 處理單一 YouTube 音訊（MP3）下載與處理 (v7.0 - Modern UI & Responsive)
 ######################################################################
@@ -1743,16 +1849,18 @@ process_single_mp3() {
 
     ### --- 階段 0: 獲取元數據 --- ###
     # 不顯示進度條，這是前置作業
-    local media_json
+    local format_option="bestaudio[ext=m4a]/bestaudio"
+    local info_json_file="$temp_dir/info.json" # 元數據只解析一次，下載時以 --load-info-json 重用
     echo -e "${YELLOW}⏳ 正在解析媒體資訊...${RESET}"
     
-    media_json=$(yt-dlp --no-warnings --dump-json "$media_url" 2>"$temp_dir/yt-dlp-json-dump.log")
-    
-    if [ -z "$media_json" ]; then
+    if ! fetch_info_json "$media_url" "$info_json_file" "$temp_dir/yt-dlp-json-dump.log"; then
         log_message "ERROR" "E_YTDLP_JSON: 無法獲取元數據。"
         local raw_err_b64=$(echo "無法獲取元數據" | base64 -w 0)
         final_result_string="FAIL|${media_url}|E_YTDLP_JSON|${raw_err_b64}"
         goto_cleanup=true
+    elif ! check_pipeline_disk_space "$info_json_file" "$format_option" mp3 "$temp_dir"; then
+        final_result_string="FAIL|${media_url}|E_DISK_SPACE|$(echo "暫存空間不足" | base64 -w 0)"
+        goto_cleanup=true
     else
         goto_cleanup=false
     fi
@@ -1763,11 +1871,11 @@ process_single_mp3() {
 
     if ! $goto_cleanup; then
         # 解析 JSON
-        video_title=$(echo "$media_json" | jq -r '.title // "audio_$(date +%s_default)"')
-        video_id=$(echo "$media_json" | jq -r '.id // "id_$(date +%s_default)"')
-        artist_name=$(echo "$media_json" | jq -r '.artist // .uploader // "[不明]"')
-        album_artist_name=$(echo "$media_json" | jq -r '.uploader // "[不明]"')
-        duration_secs=$(echo "$media_json" | jq -r '.duration // 0')
+        video_title=$(jq -r '.title // "audio_$(date +%s_default)"' "$info_json_file")
+        video_id=$(jq -r '.id // "id_$(date +%s_default)"' "$info_json_file")
+        artist_name=$(jq -r '.artist // .uploader // "[不明]"' "$info_json_file")
+        album_artist_name=$(jq -r '.uploader // "[不明]"' "$info_json_file")
+        duration_secs=$(jq -r '.duration // 0' "$info_json_file")
         
         # --- 顯示現代化資訊卡片 ---
         clear
@@ -1811,13 +1919,13 @@ process_single_mp3() {
         print_sub "目標: 最佳 M4A/Audio"
         
         local temp_output_template="${temp_dir}/%(id)s.%(ext)s"
-        local format_option="bestaudio[ext=m4a]/bestaudio"
         
         # 使用 yt-dlp 原生進度條，但稍微縮排以符合 UI
         echo -e "${WHITE}│${RESET}" 
-        local yt_dlp_audio_args=(yt-dlp -f "$format_option" -o "$temp_output_template" "$media_url" --concurrent-fragments "$THREADS" --newline --progress)
+        local yt_dlp_audio_args=(yt-dlp -f "$format_option" -o "$temp_output_template" --load-info-json "$info_json_file" --concurrent-fragments "$THREADS" --newline --progress)
+        ledger_record_estimate "$info_json_file" "$format_option"
         
-        if ! "${yt_dlp_audio_args[@]}" 2> "$temp_dir/yt-dlp-audio-std.log"; then
+        if ! run_yt_dlp_with_bandwidth_lease "${yt_dlp_audio_args[@]}" 2> "$temp_dir/yt-dlp-audio-std.log"; then
             # 下載失敗區塊
             echo -e "${RED}└─ ❌ 下載失敗！${RESET}"
             draw_line "-" "$RED"
@@ -1835,6 +1943,8 @@ process_single_mp3() {
             if [ -z "$temp_audio_file" ]; then
                 log_message "ERROR" "找不到下載後的檔案。"
                 goto_cleanup=true
+            else
+                ledger_record_actual "$info_json_file" "$format_option" "$temp_audio_file"
             fi
         fi
     fi
@@ -1969,13 +2079,16 @@ process_single_mp3_no_normalize() {
     ### --- 通知閥值設定 --- ###
     local size_threshold_gb=0.1
 
-    local media_json
-    media_json=$(yt-dlp --no-warnings --dump-json "$media_url" 2>"$temp_dir/yt-dlp-json-dump.log")
-    if [ -z "$media_json" ]; then
+    local format_option="bestaudio/best"
+    local info_json_file="$temp_dir/info.json" # 元數據只解析一次，下載時以 --load-info-json 重用
+    if ! fetch_info_json "$media_url" "$info_json_file" "$temp_dir/yt-dlp-json-dump.log"; then
         log_message "ERROR" "E_YTDLP_JSON: (MP3 無標準化) 無法獲取媒體的 JSON 資訊。"
         local raw_err_b64=$(echo "無法獲取元數據" | base64 -w 0)
         final_result_string="FAIL|${media_url}|E_YTDLP_JSON|${raw_err_b64}"
         goto_cleanup=true
+    elif ! check_pipeline_disk_space "$info_json_file" "$format_option" mp3 "$temp_dir" --no-normalize; then
+        final_result_string="FAIL|${media_url}|E_DISK_SPACE|$(echo "暫存空間不足" | base64 -w 0)"
+        goto_cleanup=true
     else
         goto_cleanup=false
     fi
@@ -1984,10 +2097,10 @@ process_single_mp3_no_normalize() {
     local output_audio="" temp_audio_file=""
 
     if ! $goto_cleanup; then
-        video_title=$(echo "$media_json" | jq -r '.title // "audio_$(date +%s_default)"')
-        video_id=$(echo "$media_json" | jq -r '.id // "id_$(date +%s_default)"')
-        artist_name=$(echo "$media_json" | jq -r '.artist // .uploader // "[不明]"')
-        album_artist_name=$(echo "$media_json" | jq -r '.uploader // "[不明]"')
+        video_title=$(jq -r '.title // "audio_$(date +%s_default)"' "$info_json_file")
+        video_id=$(jq -r '.id // "id_$(date +%s_default)"' "$info_json_file")
+        artist_name=$(jq -r '.artist // .uploader // "[不明]"' "$info_json_file")
+        album_artist_name=$(jq -r '.uploader // "[不明]"' "$info_json_file")
         
         local sanitized_title
         local safe_chars_regex='[^a-zA-Z0-9\u4e00-\u9fff\u3000-\u303f\u3040-\u309f\u30a0-\u30ff\uff00-\uffef _.\[\]()-]'
@@ -2001,10 +2114,9 @@ process_single_mp3_no_normalize() {
         
         log_message "INFO" "(MP3 無標準化) 將下載音訊到臨時目錄: ${temp_dir}"
         local temp_output_template="${temp_dir}/%(id)s.%(ext)s"
-        local format_option="bestaudio/best"
-        local yt_dlp_audio_args=(yt-dlp -f "$format_option" -o "$temp_output_template" "$media_url" --concurrent-fragments "$THREADS" --extract-audio --audio-format mp3 --audio-quality 0)
+        local yt_dlp_audio_args=(yt-dlp -f "$format_option" -o "$temp_output_template" --load-info-json "$info_json_file" --concurrent-fragments "$THREADS" --extract-audio --audio-format mp3 --audio-quality 0)
         
-        if ! "${yt_dlp_audio_args[@]}" 2> "$temp_dir/yt-dlp-audio-std.log"; then
+        if ! run_yt_dlp_with_bandwidth_lease "${yt_dlp_audio_args[@]}" 2> "$temp_dir/yt-dlp-audio-std.log"; then
             log_message "WARNING" "(MP3 無標準化) yt-dlp 下載時回報錯誤。"
         fi
 
@@ -2100,13 +2212,17 @@ process_single_mp4() {
     ### --- 通知閥值設定 --- ###
     local duration_threshold_secs=1260 # 0.35 小時 (21 分鐘)
 
-    local media_json
-    media_json=$(yt-dlp --no-warnings --dump-json "$video_url" 2>"$temp_dir/yt-dlp-json-dump.log")
-    if [ -z "$media_json" ]; then
+    ### --- 核心修正：優化畫質選擇字串，優先保證畫質 --- ###
+    local format_option="bestvideo[height<=1440]+bestaudio/best[height<=1440]/best"
+    local info_json_file="$temp_dir/info.json" # 元數據只解析一次，下載與字幕皆以 --load-info-json 重用
+    if ! fetch_info_json "$video_url" "$info_json_file" "$temp_dir/yt-dlp-json-dump.log"; then
         log_message "ERROR" "E_YTDLP_JSON: 無法獲取媒體的 JSON 資訊。URL: $video_url"
         local raw_err_b64=$(echo "無法獲取元數據，無特定日誌檔案。" | base64 -w 0)
         final_result_string="FAIL|${video_url}|E_YTDLP_JSON|${raw_err_b64}"
         goto_cleanup=true
+    elif ! check_pipeline_disk_space "$info_json_file" "$format_option" mp4 "$temp_dir"; then
+        final_result_string="FAIL|${video_url}|E_DISK_SPACE|$(echo "暫存空間不足" | base64 -w 0)"
+        goto_cleanup=true
     else
         goto_cleanup=false
     fi
@@ -2116,9 +2232,9 @@ process_single_mp4() {
     local temp_video_file="" 
 
     if ! $goto_cleanup; then
-        video_title=$(echo "$media_json" | jq -r '.title // "video_$(date +%s_default)"')
-        video_id=$(echo "$media_json" | jq -r '.id // "id_$(date +%s_default)"')
-        duration_secs=$(echo "$media_json" | jq -r '.duration // 0')
+        video_title=$(jq -r '.title // "video_$(date +%s_default)"' "$info_json_file")
+        video_id=$(jq -r '.id // "id_$(date +%s_default)"' "$info_json_file")
+        duration_secs=$(jq -r '.duration // 0' "$info_json_file")
 
         if [[ "$mode" != "playlist_mode" ]]; then
             if (( $(echo "$duration_secs > $duration_threshold_secs" | bc -l) )); then
@@ -2140,13 +2256,13 @@ process_single_mp4() {
         log_message "INFO" "將下載影片到臨時目錄: ${temp_dir}"
         local temp_output_template="${temp_dir}/%(id)s.%(ext)s"
         
-        ### --- 核心修正：優化畫質選擇字串，優先保證畫質 --- ###
-        local format_option="bestvideo[height<=1440]+bestaudio/best[height<=1440]/best"
+        local yt_dlp_video_args=(yt-dlp -f "$format_option" -o "$temp_output_template" --load-info-json "$info_json_file" --concurrent-fragments "$THREADS")
         
-        local yt_dlp_video_args=(yt-dlp -f "$format_option" -o "$temp_output_template" "$video_url" --concurrent-fragments "$THREADS")
-        
-        if ! "${yt_dlp_video_args[@]}" 2> "$temp_dir/yt-dlp-video-std.log"; then
+        ledger_record_estimate "$info_json_file" "$format_option"
+        local yt_dlp_video_ok=true
+        if ! run_yt_dlp_with_bandwidth_lease "${yt_dlp_video_args[@]}" 2> "$temp_dir/yt-dlp-video-std.log"; then
             log_message "WARNING" "yt-dlp 影片下載時回報錯誤，將進行錯誤分析。"
+            yt_dlp_video_ok=false
         fi
 
         temp_video_file=$(find "$temp_dir" -maxdepth 1 -type f \( -name "*.mp4" -o -name "*.mkv" -o -name "*.webm" \) -print -quit)
@@ -2163,8 +2279,9 @@ process_single_mp4() {
             final_result_string="FAIL|${video_title}|${error_code_to_return}|${raw_err_b64}"
             goto_cleanup=true
         else
+            $yt_dlp_video_ok && ledger_record_actual "$info_json_file" "$format_option" "$temp_video_file"
             local target_sub_langs="zh-Hant,zh-TW,zh-Hans,zh-CN,zh"
-            local yt_dlp_subs_args=(yt-dlp --skip-download --write-subs --sub-lang "$target_sub_langs" --convert-subs srt -o "${temp_dir}/%(id)s.%(sublang)s.%(ext)s" "$video_url")
+            local yt_dlp_subs_args=(yt-dlp --skip-download --write-subs --sub-lang "$target_sub_langs" --convert-subs srt -o "${temp_dir}/%(id)s.%(sublang)s.%(ext)s" --load-info-json "$info_json_file")
             "${yt_dlp_subs_args[@]}" > /dev/null 2>&1
 
             local extension="${temp_video_file##*.}"
@@ -2306,13 +2423,17 @@ process_single_mp4_no_normalize() {
     ### --- 通知閥值設定 (易於修改) --- ###
     local size_threshold_gb=1.0
 
-    local media_json
-    media_json=$(yt-dlp --no-warnings --dump-json "$video_url" 2>"$temp_dir/yt-dlp-json-dump.log")
-    if [ -z "$media_json" ]; then
+    ### --- 核心修正：優化畫質選擇字串，優先保證畫質 --- ###
+    local format_option="bestvideo[height<=1440]+bestaudio/best[height<=1440]/best"
+    local info_json_file="$temp_dir/info.json" # 元數據只解析一次，下載時以 --load-info-json 重用
+    if ! fetch_info_json "$video_url" "$info_json_file" "$temp_dir/yt-dlp-json-dump.log"; then
         log_message "ERROR" "E_YTDLP_JSON: (無標準化) 無法獲取媒體的 JSON 資訊。URL: $video_url"
         local raw_err_b64=$(echo "無法獲取元數據，無特定日誌檔案。" | base64 -w 0)
         final_result_string="FAIL|${video_url}|E_YTDLP_JSON|${raw_err_b64}"
         goto_cleanup=true
+    elif ! check_pipeline_disk_space "$info_json_file" "$format_option" mp4 "$temp_dir" --no-normalize; then
+        final_result_string="FAIL|${video_url}|E_DISK_SPACE|$(echo "暫存空間不足" | base64 -w 0)"
+        goto_cleanup=true
     else
         goto_cleanup=false
     fi
@@ -2321,8 +2442,8 @@ process_single_mp4_no_normalize() {
     local final_video_file="" temp_video_file="" 
 
     if ! $goto_cleanup; then
-        video_title=$(echo "$media_json" | jq -r '.title // "video_$(date +%s_default)"')
-        video_id=$(echo "$media_json" | jq -r '.id // "id_$(date +%s_default)"')
+        video_title=$(jq -r '.title // "video_$(date +%s_default)"' "$info_json_file")
+        video_id=$(jq -r '.id // "id_$(date +%s_default)"' "$info_json_file")
         
         local sanitized_title
         local safe_chars_regex='[^a-zA-Z0-9\u4e00-\u9fff\u3000-\u303f\u3040-\u309f\u30a0-\u30ff\uff00-\uffef _.\[\]()-]'
@@ -2337,13 +2458,13 @@ process_single_mp4_no_normalize() {
         log_message "INFO" "(無標準化) 將下載影片到臨時目錄: ${temp_dir}"
         local temp_output_template="${temp_dir}/%(id)s.%(ext)s"
         
-        ### --- 核心修正：優化畫質選擇字串，優先保證畫質 --- ###
-        local format_option="bestvideo[height<=1440]+bestaudio/best[height<=1440]/best"
-        
-        local yt_dlp_video_args=(yt-dlp -f "$format_option" -o "$temp_output_template" "$video_url" --concurrent-fragments "$THREADS" --merge-output-format mp4 --write-subs --embed-subs --sub-lang "zh-Hant,zh-TW,zh-Hans,zh-CN,zh,zh-Hant-AAj-uoGhMZA")
+        local yt_dlp_video_args=(yt-dlp -f "$format_option" -o "$temp_output_template" --load-info-json "$info_json_file" --concurrent-fragments "$THREADS" --merge-output-format mp4 --write-subs --embed-subs --sub-lang "zh-Hant,zh-TW,zh-Hans,zh-CN,zh,zh-Hant-AAj-uoGhMZA")
         
-        if ! "${yt_dlp_video_args[@]}" 2> "$temp_dir/yt-dlp-video-std.log"; then
+        ledger_record_estimate "$info_json_file" "$format_option"
+        local yt_dlp_video_ok=true
+        if ! run_yt_dlp_with_bandwidth_lease "${yt_dlp_video_args[@]}" 2> "$temp_dir/yt-dlp-video-std.log"; then
             log_message "WARNING" "(無標準化) yt-dlp 影片下載時回報錯誤，將進行錯誤分析。"
+            yt_dlp_video_ok=false
         fi
 
         temp_video_file=$(find "$temp_dir" -maxdepth 1 -type f \( -name "*.mp4" -o -name "*.mkv" -o -name "*.webm" \) -print -quit)
@@ -2360,6 +2481,7 @@ process_single_mp4_no_normalize() {
             final_result_string="FAIL|${video_title}|${error_code_to_return}|${raw_err_b64}"
             goto_cleanup=true
         else
+            $yt_dlp_video_ok && ledger_record_actual "$info_json_file" "$format_option" "$temp_video_file" # 內嵌字幕只增加數 KB
             local extension="${temp_video_file##*.}"
             final_video_file="${DOWNLOAD_PATH}/${final_base_name}.${extension}"
             
@@ -2453,9 +2575,16 @@ process_single_mp4_no_normalize_sections() {
     echo -e "${YELLOW}處理 YouTube 影片 (無標準化，指定時段 $start_time-$end_time)：$video_url${RESET}"
     log_message "INFO" "處理 YouTube 影片 (無標準化，時段 $start_time-$end_time): $video_url"
 
-    # --- 獲取標題和 ID ---
-    video_title=$(yt-dlp --get-title "$video_url" 2>/dev/null) || video_title="video_section_$(date +%s)"
-    video_id=$(yt-dlp --get-id "$video_url" 2>/dev/null) || video_id="id_section_$(date +%s)"
+    # --- 獲取標題和 ID (元數據只解析一次，影片與字幕下載皆以 --load-info-json 重用) ---
+    local info_json_file="$temp_dir/info.json"
+    local yt_dlp_source_args=("$video_url")
+    if fetch_info_json "$video_url" "$info_json_file" "$temp_dir/yt-dlp-json-dump.log"; then
+        yt_dlp_source_args=(--load-info-json "$info_json_file")
+        video_title=$(jq -r '.title // empty' "$info_json_file" 2>/dev/null)
+        video_id=$(jq -r '.id // empty' "$info_json_file" 2>/dev/null)
+    fi
+    [ -z "$video_title" ] && video_title="video_section_$(date +%s)"
+    [ -z "$video_id" ] && video_id="id_section_$(date +%s)"
     sanitized_title=$(echo "${video_title}" | sed 's@[/\\:*?"<>|]@_@g')
 
     # --- 構建檔名 ---
@@ -2488,7 +2617,7 @@ process_single_mp4_no_normalize_sections() {
             -f "$format_option"
             --download-sections "*${start_time}-${end_time}"
             -o "$initial_output_video_file" # 直接輸出到預期的分段檔名
-            "$video_url"
+            "${yt_dlp_source_args[@]}"
             --newline
             --concurrent-fragments "$THREADS"
             --merge-output-format mp4
@@ -2496,7 +2625,7 @@ process_single_mp4_no_normalize_sections() {
         log_message "INFO" "執行 yt-dlp (無標準化，時段，影音): ${yt_dlp_dl_args[*]}"
         echo -e "${CYAN}提示：分段下載可能不會顯示即時進度，請耐心等候...${RESET}"
 
-        if ! "${yt_dlp_dl_args[@]}" 2> "$temp_dir/yt-dlp-sections-video.log"; then
+        if ! run_yt_dlp_with_bandwidth_lease "${yt_dlp_dl_args[@]}" 2> "$temp_dir/yt-dlp-sections-video.log"; then
             log_message "ERROR" "影片指定時段下載失敗 (無標準化)...查看 $temp_dir/yt-dlp-sections-video.log"
             echo -e "${RED}錯誤：影片指定時段下載失敗！${RESET}"
             [ -s "$temp_dir/yt-dlp-sections-video.log" ] && cat "$temp_dir/yt-dlp-sections-video.log"
@@ -2531,7 +2660,7 @@ process_single_mp4_no_normalize_sections() {
             yt-dlp
             --skip-download ${subtitle_options_cmd}
             -o "${base_name_for_subs_dl}.%(ext)s" # 使用不含時段的基礎名
-            "$video_url"
+            "${yt_dlp_source_args[@]}"
         )
         log_message "INFO" "執行 yt-dlp (僅字幕): ${yt_dlp_sub_args[*]}"
         if ! "${yt_dlp_sub_args[@]}" 2> "$temp_dir/yt-dlp-sections-subs.log"; then
@@ -2688,22 +2817,15 @@ process_single_mkv() {
     local audio_temp_file="${temp_dir}/audio_stream.m4a"
     local normalized_audio_m4a="$temp_dir/audio_normalized.m4a"
     local sub_temp_template="${temp_dir}/sub_stream.%(ext)s"
-    local video_title video_id sanitized_title sanitized_title_id output_base_name # 提前聲明
+    local info_json_file="${temp_dir}/info.json" # 元數據只解析一次：大小預估、標題與下載皆讀取此檔案
+    local yt_dlp_source_args=("$video_url") # 若 info JSON 可用，改為 --load-info-json
+    local video_title="" video_id="" sanitized_title sanitized_title_id output_base_name # 提前聲明
 
     echo -e "${YELLOW}處理 YouTube 影片 (輸出 MKV)：$video_url${RESET}"
     log_message "INFO" "處理 YouTube MKV: $video_url"
     log_message "INFO" "將嘗試請求以下字幕 (格式: $subtitle_format_pref): $target_sub_langs"
     echo -e "${YELLOW}將嘗試下載繁/簡/通用中文字幕 (保留樣式)...${RESET}"
 
-    video_title=$(yt-dlp --get-title "$video_url" 2>/dev/null) || video_title="video_$(date +%s)"
-    video_id=$(yt-dlp --get-id "$video_url" 2>/dev/null) || video_id="id_$(date +%s)"
-    sanitized_title=$(echo "${video_title}" | sed 's@[/\\:*?"<>|]@_@g')
-    # sanitized_title_id=$(echo "${video_title}_${video_id}" | sed 's@[/\\:*?"<>|]@_@g') # 如果檔名太長，這個可能導致問題
-                                                                                   # 應使用 yt-dlp 的模板功能來控制檔名
-    # 修正：讓 yt-dlp 的 -o 參數來構建檔名，避免手動拼接 video_id 導致過長
-    output_base_name="$DOWNLOAD_PATH/${sanitized_title} [${video_id}]" # 基礎名，不含後綴
-    output_mkv="${output_base_name}_normalized.mkv" # 預期最終檔名
-
     # --- 使用 Python 估計大小並決定是否通知 ---
     local yt_dlp_format_string_estimate="bestvideo[ext=mp4][height<=1440]+bestaudio[ext=m4a]/bestvideo[ext=mp4]+bestaudio/best[ext=mp4]/best"
     echo -e "${YELLOW}正在預估檔案大小 (使用 Python 腳本)...${RESET}"
@@ -2712,9 +2834,13 @@ process_single_mkv() {
     local python_exec=""
     if command -v python3 &> /dev/null; then python_exec="python3"; elif command -v python &> /dev/null; then python_exec="python"; fi
 
+    # 先取得 info JSON；取得成功時估計腳本只讀此檔案 (不帶 URL)，不再重新解析元數據
+    local estimator_source_args=("$video_url")
+    fetch_info_json "$video_url" "$info_json_file" "$temp_dir/yt-dlp-json-dump.log" && estimator_source_args=()
+
     if [ -n "$python_exec" ] && [ -f "$PYTHON_ESTIMATOR_SCRIPT_PATH" ]; then
-        log_message "DEBUG" "Calling Python estimator (MKV): $python_exec \"$PYTHON_ESTIMATOR_SCRIPT_PATH\" \"$video_url\" \"$yt_dlp_format_string_estimate\""
-        python_estimate_output=$($python_exec "$PYTHON_ESTIMATOR_SCRIPT_PATH" "$video_url" "$yt_dlp_format_string_estimate" 2> "$temp_dir/py_estimator_mkv_stderr.log")
+        log_message "DEBUG" "Calling Python estimator (MKV): $python_exec \"$PYTHON_ESTIMATOR_SCRIPT_PATH\" ${estimator_source_args[*]} \"$yt_dlp_format_string_estimate\" --info-json \"$info_json_file\" --ledger"
+        python_estimate_output=$($python_exec "$PYTHON_ESTIMATOR_SCRIPT_PATH" "${estimator_source_args[@]}" "$yt_dlp_format_string_estimate" --info-json "$info_json_file" --ledger 2> "$temp_dir/py_estimator_mkv_stderr.log")
         local py_exit_code=$?
         if [ $py_exit_code -eq 0 ] && [[ "$python_estimate_output" =~ ^[0-9]+$ ]]; then
             estimated_size_bytes="$python_estimate_output"
@@ -2740,6 +2866,30 @@ process_single_mkv() {
     fi
     # --- 預估大小結束 ---
 
+    # --- 預估處理流程的暫存空間峰值 (下載 + WAV 中間檔 + 最終編碼)，空間不足則拒絕處理 ---
+    if ! check_pipeline_disk_space "$info_json_file" "$yt_dlp_format_string_estimate" mkv "$temp_dir"; then
+        rm -rf "$temp_dir"
+        return 1
+    fi
+
+    # --- 重用已取得的 info JSON (標題、ID 與後續下載皆不再重新解析) ---
+    if [ -s "$info_json_file" ]; then
+        yt_dlp_source_args=(--load-info-json "$info_json_file")
+        log_message "INFO" "將重用 info JSON 進行下載，跳過重複的元數據解析: $info_json_file"
+    fi
+    if [ -s "$info_json_file" ] && command -v jq &> /dev/null; then
+        video_title=$(jq -r '.title // empty' "$info_json_file" 2>/dev/null)
+        video_id=$(jq -r '.id // empty' "$info_json_file" 2>/dev/null)
+    fi
+    [ -z "$video_title" ] && video_title="video_$(date +%s)"
+    [ -z "$video_id" ] && video_id="id_$(date +%s)"
+    sanitized_title=$(echo "${video_title}" | sed 's@[/\\:*?"<>|]@_@g')
+    # sanitized_title_id=$(echo "${video_title}_${video_id}" | sed 's@[/\\:*?"<>|]@_@g') # 如果檔名太長，這個可能導致問題
+                                                                                   # 應使用 yt-dlp 的模板功能來控制檔名
+    # 修正：讓 yt-dlp 的 -o 參數來構建檔名，避免手動拼接 video_id 導致過長
+    output_base_name="$DOWNLOAD_PATH/${sanitized_title} [${video_id}]" # 基礎名，不含後綴
+    output_mkv="${output_base_name}_normalized.mkv" # 預期最終檔名
+
     mkdir -p "$DOWNLOAD_PATH";
     if [ ! -w "$DOWNLOAD_PATH" ]; then
         log_message "ERROR" "無法寫入下載目錄 (MKV): $DOWNLOAD_PATH"; echo -e "${RED}錯誤：無法寫入目錄${RESET}";
@@ -2749,10 +2899,10 @@ process_single_mkv() {
     # --- 下載視訊流 ---
     if [ $result -eq 0 ]; then
         echo -e "${YELLOW}開始下載最佳視訊流...${RESET}"
-        if ! yt-dlp -f 'bv[ext=mp4][height<=1440]' --no-warnings -o "$video_temp_file" "$video_url" 2> "$temp_dir/yt-dlp-video.log"; then
+        if ! run_yt_dlp_with_bandwidth_lease yt-dlp -f 'bv[ext=mp4][height<=1440]' --no-warnings -o "$video_temp_file" "${yt_dlp_source_args[@]}" 2> "$temp_dir/yt-dlp-video.log"; then
             echo -e "${YELLOW}警告：未找到 <=1440p 的 MP4 視訊流，嘗試下載最佳 MP4 視訊流...${RESET}"
             log_message "WARNING" "未找到 <=1440p 的 MP4 視訊流，嘗試最佳 MP4 for $video_url"
-            if ! yt-dlp -f 'bv[ext=mp4]/bestvideo[ext=mp4]' --no-warnings -o "$video_temp_file" "$video_url" 2> "$temp_dir/yt-dlp-video-fallback.log"; then # 使用不同日誌檔名
+            if ! run_yt_dlp_with_bandwidth_lease yt-dlp -f 'bv[ext=mp4]/bestvideo[ext=mp4]' --no-warnings -o "$video_temp_file" "${yt_dlp_source_args[@]}" 2> "$temp_dir/yt-dlp-video-fallback.log"; then # 使用不同日誌檔名
                 log_message "ERROR" "視訊流下載失敗（包括備選方案）...查看 $temp_dir/yt-dlp-video.log 和 $temp_dir/yt-dlp-video-fallback.log";
                 echo -e "${RED}錯誤：視訊流下載失敗！${RESET}";
                 result=1;
@@ -2769,7 +2919,7 @@ process_single_mkv() {
     # --- 下載音訊流 ---
     if [ $result -eq 0 ]; then
         echo -e "${YELLOW}開始下載最佳音訊流...${RESET}"
-        if ! yt-dlp -f 'ba[ext=m4a]' --no-warnings -o "$audio_temp_file" "$video_url" 2> "$temp_dir/yt-dlp-audio.log"; then
+        if ! run_yt_dlp_with_bandwidth_lease yt-dlp -f 'ba[ext=m4a]' --no-warnings -o "$audio_temp_file" "${yt_dlp_source_args[@]}" 2> "$temp_dir/yt-dlp-audio.log"; then
             log_message "ERROR" "音訊流下載失敗...查看 $temp_dir/yt-dlp-audio.log"; echo -e "${RED}錯誤：音訊流下載失敗！${RESET}";
             result=1;
         fi
@@ -2784,7 +2934,7 @@ process_single_mkv() {
     # --- 下載字幕 ---
     if [ $result -eq 0 ]; then
         echo -e "${YELLOW}開始下載字幕 (格式: ${subtitle_format_pref})...${RESET}"
-        yt-dlp --write-subs --sub-format "$subtitle_format_pref" --sub-lang "$target_sub_langs" --skip-download -o "$sub_temp_template" "$video_url" > "$temp_dir/yt-dlp-subs.log" 2>&1
+        yt-dlp --write-subs --sub-format "$subtitle_format_pref" --sub-lang "$target_sub_langs" --skip-download -o "$sub_temp_template" "${yt_dlp_source_args[@]}" > "$temp_dir/yt-dlp-subs.log" 2>&1
         # 查找字幕檔案
         subtitle_files=() # 清空以防萬一
         for lang_code in "zh-Hant" "zh-TW" "zh-Hans" "zh-CN" "zh"; do
@@ -2869,6 +3019,8 @@ process_single_mkv() {
     # 只有當處理成功 (result=0) 且最終檔案已生成時，才清理原始下載的視訊和音訊流
     # 如果 output_mkv 成功生成，則 video_temp_file 和 normalized_audio_m4a 就不再需要了
     if [ $result -eq 0 ] && [ -f "$output_mkv" ]; then
+        # 將實際下載大小回報給估計帳本，供 estimate_size.py 學習修正係數
+        ledger_record_actual "$info_json_file" "$yt_dlp_format_string_estimate" "$video_temp_file" "$audio_temp_file"
         safe_remove "$video_temp_file"
         # audio_temp_file 被 normalize_audio 用作輸入，其輸出是 normalized_audio_m4a
         # 所以 audio_temp_file 也應該在 normalize_audio 成功後就可以清理了
@@ -2949,9 +3101,16 @@ _process_single_other_site() {
         log_message "INFO" "通用下載 標準化：播放清單模式。"
     fi
 
-    local item_title sanitized_title video_id
-    item_title=$(yt-dlp --get-title "$item_url" 2>/dev/null) || item_title="media_item_$(date +%s)"
-    video_id=$(yt-dlp --get-id "$item_url" 2>/dev/null) || video_id="no_id_$(date +%s)"
+    local item_title="" sanitized_title video_id=""
+    local info_json_file="$temp_dir/info.json" # 元數據只解析一次，下載、檔名與縮圖皆以 --load-info-json 重用
+    local yt_dlp_source_args=("$item_url")
+    if fetch_info_json "$item_url" "$info_json_file" "$temp_dir/yt-dlp-json-dump.log"; then
+        yt_dlp_source_args=(--load-info-json "$info_json_file")
+        item_title=$(jq -r '.title // empty' "$info_json_file" 2>/dev/null)
+        video_id=$(jq -r '.id // empty' "$info_json_file" 2>/dev/null)
+    fi
+    [ -z "$item_title" ] && item_title="media_item_$(date +%s)"
+    [ -z "$video_id" ] && video_id="no_id_$(date +%s)"
     sanitized_title=$(echo "${item_title}" | sed 's@[/\\:*?"<>|]@_@g')
     log_message "DEBUG" "基礎標題: '$item_title', ID: '$video_id', 清理後: '$sanitized_title'"
 
@@ -3023,10 +3182,12 @@ _process_single_other_site() {
     fi
     
     actual_yt_dlp_args+=(-o "$chosen_output_template")
-    actual_yt_dlp_args+=("$item_url")
+    actual_yt_dlp_args+=("${yt_dlp_source_args[@]}")
 
     log_message "INFO" "${progress_prefix}執行下載 (標準化流程): ${actual_yt_dlp_args[*]}"
-    if "${actual_yt_dlp_args[@]}" 2> "$temp_dir/yt-dlp-other-std.log"; then
+    local download_selector="${bili_format_select:-$generic_format_select}"
+    ledger_record_estimate "$info_json_file" "$download_selector"
+    if run_yt_dlp_with_bandwidth_lease "${actual_yt_dlp_args[@]}" 2> "$temp_dir/yt-dlp-other-std.log"; then
         download_success=true
         final_output_template_used="$chosen_output_template"
     else
@@ -3046,13 +3207,14 @@ _process_single_other_site() {
              else format_for_getfn="bestaudio/best"; fi
         fi
 
-        local yt_dlp_getfn_args=(yt-dlp --no-warnings --print filename -f "$format_for_getfn" -o "$final_output_template_used" "$item_url")
+        local yt_dlp_getfn_args=(yt-dlp --no-warnings --print filename -f "$format_for_getfn" -o "$final_output_template_used" "${yt_dlp_source_args[@]}")
         local actual_download_path=$( "${yt_dlp_getfn_args[@]}" | tr -d '\n' )
         local getfn_exit_code=$?
         log_message "DEBUG" "獲取檔名命令(標準化流程)退出碼: $getfn_exit_code, 獲取的路徑: '$actual_download_path'"
 
         if [ $getfn_exit_code -eq 0 ] && [ -n "$actual_download_path" ] && [ -f "$actual_download_path" ]; then
             main_media_file="$actual_download_path"
+            ledger_record_actual "$info_json_file" "$download_selector" "$main_media_file"
             log_message "INFO" "${progress_prefix}找到主檔案: $main_media_file";
             base_name_calculated_from_file=$(basename "$main_media_file" | sed 's/\.[^.]*$//')
             log_message "DEBUG" "從檔案計算出的 Base Name: [$base_name_calculated_from_file]"
@@ -3103,7 +3265,7 @@ _process_single_other_site() {
             local thumb_dl_template="${media_dir}/${base_name_calculated_from_file}.%(ext)s"
             log_message "DEBUG" "嘗試使用縮圖模板: $thumb_dl_template"
             
-            if ! yt-dlp --no-warnings --skip-download --write-thumbnail -o "$thumb_dl_template" "$item_url" 2> "$temp_dir/yt-dlp-thumb.log"; then
+            if ! yt-dlp --no-warnings --skip-download --write-thumbnail -o "$thumb_dl_template" "${yt_dlp_source_args[@]}" 2> "$temp_dir/yt-dlp-thumb.log"; then
                 log_message "WARNING" "...下載縮圖指令失敗或無縮圖，詳見 $temp_dir/yt-dlp-thumb.log"
             fi
             thumbnail_file=$(find "$media_dir" -maxdepth 1 -type f -iname "${base_name_calculated_from_file}.*" \
@@ -3235,9 +3397,16 @@ _process_single_other_site_no_normalize() {
         log_message "INFO" "通用下載 無標準化：播放清單模式。"
     fi
 
-    local item_title sanitized_title video_id
-    item_title=$(yt-dlp --get-title "$item_url" 2>/dev/null) || item_title="media_item_$(date +%s)"
-    video_id=$(yt-dlp --get-id "$item_url" 2>/dev/null) || video_id="no_id_$(date +%s)"
+    local item_title="" sanitized_title video_id=""
+    local info_json_file="$temp_dir/info.json" # 元數據只解析一次，下載、檔名與縮圖皆以 --load-info-json 重用
+    local yt_dlp_source_args=("$item_url")
+    if fetch_info_json "$item_url" "$info_json_file" "$temp_dir/yt-dlp-json-dump.log"; then
+        yt_dlp_source_args=(--load-info-json "$info_json_file")
+        item_title=$(jq -r '.title // empty' "$info_json_file" 2>/dev/null)
+        video_id=$(jq -r '.id // empty' "$info_json_file" 2>/dev/null)
+    fi
+    [ -z "$item_title" ] && item_title="media_item_$(date +%s)"
+    [ -z "$video_id" ] && video_id="no_id_$(date +%s)"
     sanitized_title=$(echo "${item_title}" | sed 's@[/\\:*?"<>|]@_@g')
     log_message "DEBUG" "基礎標題: '$item_title', ID: '$video_id', 清理後: '$sanitized_title'"
 
@@ -3315,10 +3484,13 @@ _process_single_other_site_no_normalize() {
     fi
     
     actual_yt_dlp_args+=(-o "$chosen_output_template")
-    actual_yt_dlp_args+=("$item_url")
+    actual_yt_dlp_args+=("${yt_dlp_source_args[@]}")
 
     log_message "INFO" "${progress_prefix}執行下載 (無標準化): ${actual_yt_dlp_args[*]}"
-    if "${actual_yt_dlp_args[@]}" 2> "$temp_dir/yt-dlp-other-nonorm.log"; then
+    local download_selector="" # MP3 由 yt-dlp 轉檔後刪除原檔，留下的檔案大小不是下載大小，不記入帳本
+    [ "$choice_format" = "mp4" ] && download_selector="${bili_format_select:-$generic_format_select}"
+    [ -n "$download_selector" ] && ledger_record_estimate "$info_json_file" "$download_selector"
+    if run_yt_dlp_with_bandwidth_lease "${actual_yt_dlp_args[@]}" 2> "$temp_dir/yt-dlp-other-nonorm.log"; then
         download_success=true
         final_output_template_used="$chosen_output_template" 
     else
@@ -3344,13 +3516,13 @@ _process_single_other_site_no_normalize() {
 
         if [ "$choice_format" = "mp3" ]; then
             local temp_name_for_mp3_base
-            temp_name_for_mp3_base=$(yt-dlp --no-warnings --get-filename -f "$format_for_getfn" -o "$final_output_template_used" "$item_url" | sed 's/\.[^.]*$//')
+            temp_name_for_mp3_base=$(yt-dlp --no-warnings --get-filename -f "$format_for_getfn" -o "$final_output_template_used" "${yt_dlp_source_args[@]}" | sed 's/\.[^.]*$//')
              if [ -n "$temp_name_for_mp3_base" ]; then
                 actual_download_path="${temp_name_for_mp3_base}.mp3"
                 getfn_exit_code=0
              fi
         else # For MP4
-             actual_download_path=$( "${yt_dlp_getfn_args[@]}" "$item_url" | tr -d '\n' )
+             actual_download_path=$( "${yt_dlp_getfn_args[@]}" "${yt_dlp_source_args[@]}" | tr -d '\n' )
              getfn_exit_code=$?
         fi
 
@@ -3358,6 +3530,7 @@ _process_single_other_site_no_normalize() {
 
         if [ $getfn_exit_code -eq 0 ] && [ -n "$actual_download_path" ] && [ -f "$actual_download_path" ]; then
             main_media_file="$actual_download_path"
+            [ -n "$download_selector" ] && ledger_record_actual "$info_json_file" "$download_selector" "$main_media_file"
             log_message "INFO" "${progress_prefix}成功定位到下載檔案: $main_media_file"
             result=0
 
@@ -5119,8 +5292,49 @@ process_invidious_entry() {
     
     # --- 步驟 2: 獲取使用者輸入 (簡化，因為目標明確) ---
     local input_url
-    read -p "請輸入 YouTube 影片網址: " input_url
+    read -p "請輸入 YouTube 影片、播放清單或頻道網址: " input_url
     if [ -z "$input_url" ]; then echo -e "${YELLOW}已取消。${RESET}"; return 0; fi
+    # 後續一律由 audio_enricher.sh 標準化並轉成 320k MP3：以此為下載器的選擇策略，高於 320 kbps 的來源串流不會帶來任何好處
+    # 有 ffmpeg 時邊下載邊做 loudnorm 第一遍分析 (<檔案>.loudnorm.json)，audio_enricher.sh 會直接沿用
+    local downloader_opts=(--target mp3 --max-bitrate 320)
+    command -v ffmpeg &> /dev/null && downloader_opts+=(--analyze-loudness)
+
+    # --- 播放清單 / 頻道：下載器逐項輸出 NDJSON，每個檔案一落地就交給 audio_enricher.sh ---
+    if [[ ! "$input_url" =~ [?\&]v= ]] && [[ "$input_url" =~ (list=|/channel/|/@|/c/|/user/) ]]; then
+        if ! command -v jq &> /dev/null; then
+            echo -e "${RED}錯誤：處理播放清單 / 頻道需要 'jq'！${RESET}"; read -p "按 Enter 返回..."; return 1
+        fi
+        local temp_dir_invidious=$(mktemp -d)
+        local ndjson_line item_status item_path item_title ok_count=0 fail_count=0
+        log_message "INFO" "Invidious 流程 (播放清單 / 頻道): $input_url，臨時目錄 $temp_dir_invidious"
+        echo -e "\n${CYAN}>>> 正在逐項下載並處理播放清單 / 頻道...${RESET}"
+        while IFS= read -r ndjson_line; do
+            [ "$(echo "$ndjson_line" | jq -r '.type // empty' 2>/dev/null)" = "item" ] || continue
+            item_status=$(echo "$ndjson_line" | jq -r '.status // empty')
+            item_path=$(echo "$ndjson_line" | jq -r '.path // empty')
+            item_title=$(echo "$ndjson_line" | jq -r '.title // .id // empty')
+            if [ "$item_status" = "ok" ] && [ -f "$item_path" ]; then
+                echo -e "${CYAN}-------------------------------------------------${RESET}"
+                echo -e "${GREEN}已下載：$item_title，開始處理...${RESET}"
+                if DOWNLOAD_PATH="$DOWNLOAD_PATH" "$BASH_AUDIO_ENRICHER_SCRIPT_PATH" "$item_path" < /dev/null; then
+                    ok_count=$((ok_count + 1))
+                else
+                    fail_count=$((fail_count + 1)); log_message "ERROR" "Invidious 流程：處理失敗 '$item_title'"
+                fi
+                rm -f "$item_path" "$item_path.loudnorm.json"
+            else
+                fail_count=$((fail_count + 1))
+                log_message "ERROR" "Invidious 流程：下載失敗 '$item_title': $(echo "$ndjson_line" | jq -r '.error // empty')"
+                echo -e "${RED}下載失敗：$item_title${RESET}"
+            fi
+        done < <("$python_cmd" "$INVIDIOUS_DOWNLOADER_SCRIPT_PATH" "${downloader_opts[@]}" "$input_url" "$temp_dir_invidious")
+        echo -e "${CYAN}-------------------------------------------------${RESET}"
+        echo -e "${GREEN}播放清單 / 頻道處理完成：成功 $ok_count 項，失敗 $fail_count 項。${RESET}"
+        log_message "INFO" "Invidious 流程 (播放清單 / 頻道) 完成：成功 $ok_count，失敗 $fail_count"
+        rm -rf "$temp_dir_invidious"
+        read -p "按 Enter 返回..."
+        return 0
+    fi
 
     # --- 步驟 3: 分發任務 - 下載階段 ---
     echo -e "\n${CYAN}>>> 階段一：呼叫 Invidious 下載器獲取原始音訊...${RESET}"
@@ -5128,7 +5342,7 @@ process_invidious_entry() {
     log_message "INFO" "Invidious 流程：創建臨時目錄 $temp_dir_invidious"
     
     local raw_audio_file
-    raw_audio_file=$("$python_cmd" "$INVIDIOUS_DOWNLOADER_SCRIPT_PATH" "$input_url" "$temp_dir_invidious")
+    raw_audio_file=$("$python_cmd" "$INVIDIOUS_DOWNLOADER_SCRIPT_PATH" "${downloader_opts[@]}" "$input_url" "$temp_dir_invidious")
     local download_exit_code=$?
     
     if [ $download_exit_code -ne 0 ] || [ -z "$raw_audio_file" ] || [ ! -f "$raw_audio_file" ]; then
@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 # sync_helper.py
-# 版本: v2.0.1 - 優化 run_command 以解決進度條緩衝問題
-# 保持與 v2.0.0 的功能一致，僅修改命令執行方式
+# 版本: v2.1.0 - rsync 的 --bwlimit 由跨行程頻寬預算 (bandwidth_governor.py) 決定
+# v2.0.1 - 優化 run_command 以解決進度條緩衝問題
 
 import argparse
 import os
@@ -14,9 +14,15 @@ import sys
 import pty
 import select
 
+# 同目錄的跨行程頻寬預算；沒有時只使用 --bwlimit
+try:
+    import bandwidth_governor
+except ImportError:
+    bandwidth_governor = None
+
 
 # --- 全域變數 ---
-SCRIPT_VERSION = "v2.0.1"
+SCRIPT_VERSION = "v2.1.0"
 
 # --- 日誌輔助函數 (保持不變) ---
 def print_info(message):
@@ -134,6 +140,7 @@ def main():
 
     parser.add_argument("--progress-style", choices=['default', 'total'], default='default', help="進度顯示樣式: 'default' (每個檔案) 或 'total' (總進度)。")
     parser.add_argument("--bwlimit", type=int, default=0, help="限制頻寬 (單位 KB/s)，0 為不限制。")
+    parser.add_argument("--priority", choices=["interactive", "normal", "background"], default="background", help="在共用頻寬預算中的優先權 (預設: background)。")
 
     parser.add_argument("--dry-run", action="store_true", help="執行模擬運行，顯示將要執行的操作而不實際傳輸。")
     parser.add_argument("--rsync-path", default="rsync", help="rsync 可執行檔的路徑。")
@@ -201,9 +208,21 @@ def main():
         rsync_command.append("--dry-run")
         print_warning("--- 正在以乾跑 (Dry Run) 模式執行 ---")
 
-    if args.bwlimit > 0:
-        rsync_command.extend(["--bwlimit", str(args.bwlimit)])
-        print_info(f"頻寬限制已設定為 {args.bwlimit} KB/s。")
+    bwlimit = args.bwlimit
+    if bandwidth_governor is not None and not args.dry_run:
+        # rsync 執行中無法調整速率，因此向共用預算取得固定配額並保留到同步結束
+        try:
+            lease = bandwidth_governor.reserve_fixed(args.priority, "sync_helper", limit_kbps=args.bwlimit or None)
+        except OSError as e:
+            lease = None
+            print_warning(f"無法使用共用頻寬預算：{e}")
+        if lease is not None:
+            bwlimit = lease.kbps
+            print_debug(f"共用頻寬預算分配 {lease.kbps} KB/s (優先權: {args.priority})。", args.debug)
+
+    if bwlimit > 0:
+        rsync_command.extend(["--bwlimit", str(bwlimit)])
+        print_info(f"頻寬限制已設定為 {bwlimit} KB/s。")
 
     ssh_options = f"{args.ssh_path} -p {args.target_ssh_port}"
     if args.ssh_key_path:
@@ -0,0 +1,168 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import estimate_size
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'estimate')
+EXTRACTORS = {'youtube', 'youtube_music', 'bilibili', 'soundcloud'}
+
+
+def _load_fixtures():
+    fixtures = []
+    for name in sorted(os.listdir(FIXTURE_DIR)):
+        if not name.endswith('.json') or name == 'baseline.json': continue
+        with open(os.path.join(FIXTURE_DIR, name), 'r', encoding='utf-8') as f: fixtures.append(json.load(f))
+    return fixtures
+
+
+FIXTURES = _load_fixtures()
+CASES = [(fixture, case) for fixture in FIXTURES for case in fixture['cases']]
+
+
+def _run_main_quietly(argv):
+    """Runs main() in-process with argv; returns (stdout, exit status)."""
+    saved_argv, out, status = sys.argv, io.StringIO(), 0
+    sys.argv = ["estimate_size.py"] + argv
+    try:
+        with contextlib.redirect_stdout(out):
+            try: estimate_size.main()
+            except SystemExit as e: status = e.code or 0
+    finally: sys.argv = saved_argv
+    return out.getvalue(), status
+
+
+@pytest.fixture(autouse=True)
+def cold_selection():
+    estimate_size.reset_selection_caches()
+
+
+def test_fixtures_cover_every_extractor():
+    assert CASES, "no fixture cases found"
+    assert {fixture['name'] for fixture in FIXTURES} >= EXTRACTORS
+
+
+def test_every_case_has_an_actual_size_and_a_baseline():
+    with open(os.path.join(FIXTURE_DIR, 'baseline.json'), 'r', encoding='utf-8') as f: baseline = json.load(f)
+    for fixture, case in CASES:
+        assert case['actual_size'] > 0
+        assert set(baseline[f"{fixture['name']}|{case['selector']}"]) == {'select_cold_ms', 'error_pct'}
+
+
+@pytest.mark.parametrize('fixture, case', CASES, ids=[f"{fixture['name']}:{case['selector']}" for fixture, case in CASES])
+def test_selection_matches_yt_dlp(fixture, case):
+    info = fixture['info']
+    estimate = estimate_size.estimate_selection(estimate_size.get_available_formats(info), case['selector'], info.get('duration'))
+    assert estimate['format_ids'] == case['expected_format_ids']
+    assert estimate['size'] > 0
+
+
+@pytest.mark.parametrize('fixture', FIXTURES, ids=[fixture['name'] for fixture in FIXTURES])
+def test_main_prints_one_estimate_per_selector(fixture, tmp_path):
+    info_path = tmp_path / 'info.json'
+    info_path.write_text(json.dumps(fixture['info']), encoding='utf-8')
+    selectors = [case['selector'] for case in fixture['cases']]
+    out, status = _run_main_quietly(["--info-json", str(info_path), "--no-cache", "--selectors", *selectors])
+    assert status == 0
+    records = [json.loads(line) for line in out.splitlines()]
+    assert [record['selector'] for record in records] == selectors
+    assert [record['format_ids'] for record in records] == [case['expected_format_ids'] for case in fixture['cases']]
+
+
+def test_suite_passes_on_committed_fixtures():
+    out = io.StringIO()
+    summary = estimate_size.run_fixture_suite(FIXTURE_DIR, out=out)
+    assert summary['cases'] == len(CASES)
+    assert summary['failed'] == 0
+
+
+def _copy_fixture(tmp_path, name='youtube'):
+    for filename in (f'{name}.json', 'baseline.json'):
+        (tmp_path / filename).write_bytes(open(os.path.join(FIXTURE_DIR, filename), 'rb').read())
+    return str(tmp_path)
+
+
+def test_suite_fails_when_selection_gets_slower(tmp_path, monkeypatch):
+    select = estimate_size.select_best_filtered_format
+    def slow_select(*args, **kwargs):
+        time.sleep(0.002)
+        return select(*args, **kwargs)
+    monkeypatch.setattr(estimate_size, 'select_best_filtered_format', slow_select)
+    out = io.StringIO()
+    summary = estimate_size.run_fixture_suite(_copy_fixture(tmp_path), runs=1, out=out)
+    assert summary['failed'] == summary['cases'] > 0
+    results = [json.loads(line) for line in out.getvalue().splitlines()[:-1]]
+    assert all(any(reason.startswith('select_cold_ms') for reason in result['regressions']) for result in results)
+
+
+def test_suite_fails_when_estimates_get_less_accurate(tmp_path, monkeypatch):
+    estimate = estimate_size.estimate_selection
+    def inflated_estimate(*args, **kwargs):
+        result = estimate(*args, **kwargs)
+        return dict(result, size=int(result['size'] * 1.05))
+    monkeypatch.setattr(estimate_size, 'estimate_selection', inflated_estimate)
+    out = io.StringIO()
+    summary = estimate_size.run_fixture_suite(_copy_fixture(tmp_path), runs=1, out=out)
+    assert summary['failed'] == summary['cases'] > 0
+    results = [json.loads(line) for line in out.getvalue().splitlines()[:-1]]
+    assert all(any(reason.startswith('error') for reason in result['regressions']) for result in results)
+
+
+def test_suite_fails_on_cases_missing_from_the_baseline(tmp_path):
+    fixtures_dir = _copy_fixture(tmp_path)
+    (tmp_path / 'baseline.json').write_text('{}', encoding='utf-8')
+    summary = estimate_size.run_fixture_suite(fixtures_dir, runs=1, out=io.StringIO())
+    assert summary['failed'] == summary['cases'] > 0
+    summary = estimate_size.run_fixture_suite(fixtures_dir, runs=5, update_baseline=True, out=io.StringIO())
+    assert summary['failed'] == 0
+    assert estimate_size.run_fixture_suite(fixtures_dir, runs=5, out=io.StringIO())['failed'] == 0
+
+
+def test_suite_fails_without_cases(tmp_path):
+    summary = estimate_size.run_fixture_suite(str(tmp_path), runs=1, out=io.StringIO())
+    assert summary['cases'] == 0
+    _, status = _run_main_quietly(["--run-fixtures", "--fixtures-dir", str(tmp_path), "--fixture-runs", "1"])
+    assert status == 2
+
+
+@pytest.mark.parametrize('budget_args', [["--max-bytes", "lots"], ["--max-bytes", "lots", "--time-budget", "30", "--throughput", "2M"]],
+                         ids=['size-budget', 'with-time-budget'])
+def test_invalid_max_bytes_is_rejected(budget_args, tmp_path):
+    info_path = tmp_path / 'info.json'
+    info_path.write_text(json.dumps(FIXTURES[0]['info']), encoding='utf-8')
+    out, status = _run_main_quietly(["--info-json", str(info_path), "--no-cache", *budget_args, "bestaudio"])
+    assert (out, status) == ('', 1)
+
+
+def test_time_budget_alone_caps_the_selection(tmp_path):
+    info_path = tmp_path / 'info.json'
+    info_path.write_text(json.dumps(FIXTURES[0]['info']), encoding='utf-8')
+    out, status = _run_main_quietly(["--info-json", str(info_path), "--no-cache", "--time-budget", "30", "--throughput", "2M", "bestaudio"])
+    estimate = json.loads(out)
+    assert status == 0 and estimate['max_bytes'] == 60_000_000 and 0 < estimate['size'] <= 60_000_000
+
+
+def test_dump_info_json_extracts_once_without_selecting(tmp_path, monkeypatch):
+    info, url, calls = FIXTURES[0]['info'], 'https://www.youtube.com/watch?v=fixture', []
+    def extract(url, backend='auto'):
+        calls.append(url)
+        return json.loads(json.dumps(info))
+    def no_selection(*args): raise AssertionError("--dump-info-json must not evaluate a selector")
+    monkeypatch.setattr(estimate_size, 'extract_media_info', extract)
+    monkeypatch.setattr(estimate_size, 'evaluate_selector', no_selection)
+    info_path = tmp_path / 'info.json'
+    for _ in range(2): # The second call reuses the still-valid file
+        out, status = _run_main_quietly([url, "--dump-info-json", "--info-json", str(info_path), "--no-cache"])
+        assert (out, status) == ('', 0)
+    assert calls == [url]
+    assert json.loads(info_path.read_text(encoding='utf-8'))['id'] == info['id']
+
+    out, status = _run_main_quietly([url, "--dump-info-json", "--no-cache"])
+    assert status == 0 and json.loads(out)['id'] == info['id']
+    assert calls == [url, url]
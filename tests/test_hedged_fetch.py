@@ -0,0 +1,93 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('cloudscraper')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import invidious_downloader
+
+STREAMS = {'title': 'Stub video', 'audioStreams': [{'url': 'http://127.0.0.1/audio', 'bitrate': 128000}]}
+SLOW_SECONDS = 2.0
+
+
+class _StubPipedHandler(BaseHTTPRequestHandler):
+    """/slow answers after SLOW_SECONDS, /fail answers 500, /fast answers at once."""
+
+    def do_GET(self):
+        instance = self.path.split('/')[1]
+        if instance == 'fail':
+            self.send_response(500); self.send_header('Content-Length', '0'); self.end_headers(); return
+        if instance == 'slow': time.sleep(SLOW_SECONDS)
+        body = json.dumps(STREAMS).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def piped_stub(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubPipedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    health_path = tmp_path / 'health.json'
+    monkeypatch.setattr(invidious_downloader, 'INSTANCE_HEALTH_PATH', str(health_path))
+    monkeypatch.setattr(invidious_downloader, 'CURL_CFFI_AVAILABLE', False)
+    monkeypatch.setattr(invidious_downloader, 'PIPED_HEDGE_DELAY', 0.2)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    yield {name: f"{base}/{name}" for name in ('slow', 'fail', 'fast')}, health_path
+    server.shutdown()
+    server.server_close()
+
+
+def _seed(health_path, health):
+    health_path.write_text(json.dumps(health), encoding='utf-8')
+
+
+def test_fast_instance_wins_and_cancelled_loser_keeps_its_failure_rate(piped_stub):
+    urls, health_path = piped_stub
+    # Ranked slow, fail, fast: the slow one starts first and is still running when fast answers
+    _seed(health_path, {urls['slow']: {'latency': 0.1, 'failure': 0.05, 'samples': 3},
+                        urls['fail']: {'latency': 0.2, 'failure': 0.0, 'samples': 3},
+                        urls['fast']: {'latency': 0.3, 'failure': 0.0, 'samples': 3}})
+
+    start = time.monotonic()
+    data = asyncio.run(invidious_downloader._hedged_fetch('streams/abc', [urls['fast'], urls['fail'], urls['slow']]))
+    assert data == STREAMS
+    assert time.monotonic() - start < SLOW_SECONDS
+
+    health = json.loads(health_path.read_text(encoding='utf-8'))
+    slow, fail, fast = health[urls['slow']], health[urls['fail']], health[urls['fast']]
+    # Cancelled loser: latency moves towards the time it ran, failure rate and samples untouched
+    assert slow['samples'] == 3
+    assert slow['failure'] == 0.05
+    assert slow['latency'] > 0.1
+    # Failing instance: one failed sample, latency untouched
+    assert fail['samples'] == 4
+    assert fail['failure'] == pytest.approx(invidious_downloader.HEALTH_EWMA_ALPHA)
+    assert fail['latency'] == 0.2
+    # Winner: one successful sample
+    assert fast['samples'] == 4
+    assert fast['failure'] == 0.0
+    assert 0 < fast['latency'] < 0.3
+
+
+def test_total_timeout_counts_as_failure(piped_stub, monkeypatch):
+    urls, health_path = piped_stub
+    monkeypatch.setattr(invidious_downloader, 'PIPED_TOTAL_TIMEOUT', 0.5)
+
+    assert asyncio.run(invidious_downloader._hedged_fetch('streams/abc', [urls['slow']])) is None
+
+    slow = json.loads(health_path.read_text(encoding='utf-8'))[urls['slow']]
+    assert slow['samples'] == 1
+    assert slow['failure'] == pytest.approx(invidious_downloader.HEALTH_EWMA_ALPHA)
+    assert slow['latency'] == pytest.approx(0.5, abs=0.3)
@@ -0,0 +1,111 @@
+import os
+import sys
+import threading
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import estimate_size
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'estimate')
+
+
+class _CountingHandler(SimpleHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.path)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def manifest_server():
+    _CountingHandler.requests_seen = []
+    server = HTTPServer(('127.0.0.1', 0), partial(_CountingHandler, directory=FIXTURE_DIR))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    estimate_size._manifest_cache.clear()
+    yield f"http://127.0.0.1:{server.server_address[1]}", _CountingHandler.requests_seen
+    server.shutdown()
+    server.server_close()
+    estimate_size._manifest_cache.clear()
+
+
+def _dash_format(base, format_id):
+    return {'format_id': format_id, 'protocol': 'http_dash_segments', 'url': f"{base}/manifest.mpd", 'manifest_url': f"{base}/manifest.mpd"}
+
+
+def test_mpd_is_fetched_and_parsed_once_per_manifest(manifest_server, monkeypatch):
+    base, requests_seen = manifest_server
+    parses = []
+    parse = estimate_size.parse_mpd_representations
+    monkeypatch.setattr(estimate_size, 'parse_mpd_representations', lambda text: parses.append(1) or parse(text))
+
+    audio = estimate_size.fetch_manifest_segments(_dash_format(base, '140'))
+    video = estimate_size.fetch_manifest_segments(_dash_format(base, 'dash-137'))
+    again = estimate_size.fetch_manifest_segments(_dash_format(base, '140'))
+
+    assert requests_seen == ['/manifest.mpd']
+    assert len(parses) == 1
+    assert audio['init_size'] == 600
+    assert [seg['size'] for seg in audio['segments']] == [1000, 2000, 3000]
+    assert [seg['duration'] for seg in audio['segments']] == [4.0, 4.0, 4.0]
+    assert video['init_size'] == 1000
+    assert [seg['size'] for seg in video['segments']] == [10000, 20000, 30000]
+    assert again is audio
+
+
+def test_unknown_representation_returns_none(manifest_server):
+    base, _ = manifest_server
+    assert estimate_size.fetch_manifest_segments(_dash_format(base, '999')) is None
+
+
+def test_hls_media_playlist(manifest_server):
+    base, requests_seen = manifest_server
+    fmt = {'format_id': 'hls-1', 'protocol': 'm3u8_native', 'url': f"{base}/media.m3u8"}
+    first = estimate_size.fetch_manifest_segments(fmt)
+    second = estimate_size.fetch_manifest_segments(fmt)
+    assert requests_seen == ['/media.m3u8']
+    assert first is second
+    assert first['init_size'] == 500
+    assert [seg['size'] for seg in first['segments']] == [1000, 2000, 3000]
+
+
+def test_section_size_counts_init_segment_per_section(manifest_server):
+    base, _ = manifest_server
+    manifest = estimate_size.fetch_manifest_segments(_dash_format(base, '140'))
+    full_size = estimate_size.size_from_segments(manifest['segments'], manifest['init_size'], 12)
+    assert full_size == 6600
+    row = {'size': full_size, 'duration': 12, 'has_video': False, 'segments': manifest['segments'], 'init_size': manifest['init_size']}
+
+    # One section inside the first segment: that segment plus the init segment
+    assert estimate_size.section_size(row, [(0, 2)]) == 1000 + 600
+    # Two sections each re-fetch the init segment
+    assert estimate_size.section_size(row, [(0, 2), (9, 11)]) == 1000 + 3000 + 2 * 600
+    # The whole duration matches the full size
+    assert estimate_size.section_size(row, [(0, 12)]) == full_size
+
+
+def test_section_size_without_segment_sizes_scales_media_only():
+    segments = [{'duration': 4.0, 'size': None} for _ in range(3)]
+    row = {'size': 6600, 'duration': 12, 'has_video': False, 'segments': segments, 'init_size': 600}
+    assert estimate_size.section_size(row, [(0, 12)]) == 6600
+    assert estimate_size.section_size(row, [(0, 2)]) == 2000 + 600
+
+
+def test_estimate_many_keeps_probed_sizes_when_the_table_cache_moves_on(monkeypatch):
+    formats = [{'format_id': 'a', 'url': 'https://media.invalid/a', 'protocol': 'https', 'vcodec': 'none', 'acodec': 'opus', 'tbr': 128},
+               {'format_id': 'v', 'url': 'https://media.invalid/v', 'protocol': 'https', 'vcodec': 'vp9', 'acodec': 'none', 'tbr': 2000}]
+    def probe(rows):
+        for row in rows: row['size'], row['method'] = 1000 + row['rank'], 'probe'
+        estimate_size.get_format_table([{'format_id': 'other', 'filesize': 1}]) # Another formats list replaces the cached table
+    estimate_size.reset_selection_caches()
+    monkeypatch.setattr(estimate_size, 'probe_row_sizes', probe)
+    estimates = estimate_size.estimate_many(formats, ['bestaudio', 'bv+ba'], duration=60, probe=True)
+    assert [(part['format_id'], part['size'], part['method']) for part in estimates['bestaudio']['parts']] == [('a', 1000, 'probe')]
+    assert estimates['bv+ba']['size'] == 2001
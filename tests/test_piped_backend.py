@@ -0,0 +1,163 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import estimate_size
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+URL = f"https://www.youtube.com/watch?v={VIDEO_ID}"
+STREAMS = {
+    'title': 'Fixture video', 'uploader': 'Fixture Channel', 'duration': 212,
+    'audioStreams': [
+        {'url': 'https://media.invalid/140', 'itag': 140, 'mimeType': 'audio/mp4', 'codec': 'mp4a.40.2', 'bitrate': 130000,
+         'contentLength': 3433514, 'quality': '128 kbps', 'audioTrackType': 'ORIGINAL'},
+        {'url': 'https://media.invalid/251', 'itag': 251, 'mimeType': 'audio/webm', 'codec': 'opus', 'bitrate': 135000,
+         'contentLength': 3573830, 'quality': '160 kbps'},
+        {'url': 'https://media.invalid/250', 'itag': 250, 'mimeType': 'audio/webm', 'codec': 'opus', 'bitrate': 70000, 'quality': '64 kbps'},
+        {'url': 'https://media.invalid/251-dub', 'itag': 251, 'mimeType': 'audio/webm', 'codec': 'opus', 'bitrate': 135000,
+         'contentLength': 3600000, 'audioTrackId': 'de.3', 'audioTrackLocale': 'de', 'audioTrackType': 'DUBBED'},
+        {'url': None, 'itag': 249, 'mimeType': 'audio/webm', 'codec': 'opus', 'bitrate': 50000},
+    ],
+    'videoStreams': [
+        {'url': 'https://media.invalid/137', 'itag': 137, 'mimeType': 'video/mp4', 'codec': 'avc1.640028', 'bitrate': 4367000,
+         'width': 1920, 'height': 1080, 'fps': 25, 'videoOnly': True, 'contentLength': 115767254, 'quality': '1080p'},
+        {'url': 'https://media.invalid/248', 'itag': 248, 'mimeType': 'video/webm', 'codec': 'vp9', 'bitrate': 2646000,
+         'width': 1920, 'height': 1080, 'fps': 25, 'videoOnly': True, 'contentLength': 70145322, 'quality': '1080p'},
+        {'url': 'https://media.invalid/18', 'itag': 18, 'mimeType': 'video/mp4', 'codec': 'avc1.42001E, mp4a.40.2', 'bitrate': 503000,
+         'width': 640, 'height': 360, 'fps': 25, 'videoOnly': False, 'quality': '360p'},
+    ],
+}
+
+
+class _FakePipedHandler(BaseHTTPRequestHandler):
+    """Serves /streams/<id> from `responses` ({id: (status, body)}) and records every path requested."""
+    responses = {}
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.path)
+        status, body = self.responses.get(self.path.rsplit('/', 1)[-1], (404, {'error': 'not found'}))
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def piped_server(tmp_path, monkeypatch):
+    _FakePipedHandler.responses = {VIDEO_ID: (200, STREAMS)}
+    _FakePipedHandler.requests_seen = []
+    server = HTTPServer(('127.0.0.1', 0), _FakePipedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(estimate_size, 'PIPED_INSTANCE', f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(estimate_size, 'PIPED_STREAMS_CACHE_DIR', str(tmp_path / 'piped_streams_cache'))
+    yield _FakePipedHandler
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def yt_dlp_backend(monkeypatch):
+    """Replaces the yt-dlp backends with a recorder, so fallbacks are observable without network access."""
+    calls = []
+    def extract(url):
+        calls.append(url)
+        return {'id': VIDEO_ID, 'title': 'From yt-dlp', 'formats': [], '_source': 'yt-dlp'}
+    monkeypatch.setattr(estimate_size, 'load_yt_dlp_module', lambda: object())
+    monkeypatch.setattr(estimate_size, 'extract_media_info_module', extract)
+    monkeypatch.setattr(estimate_size, 'extract_media_info_subprocess', extract)
+    return calls
+
+
+def test_streams_to_info_maps_fields_and_sorts_worst_to_best():
+    info = estimate_size.piped_streams_to_info(STREAMS, VIDEO_ID)
+    assert info['id'] == VIDEO_ID and info['title'] == 'Fixture video' and info['duration'] == 212
+    assert info['_source'] == 'piped'
+    formats = {fmt['format_id']: fmt for fmt in info['formats']}
+    assert [fmt['format_id'] for fmt in info['formats']] == ['251-de.3', '140', '250', '251', '18', '137', '248']
+
+    assert formats['140'] == {'format_id': '140', 'url': 'https://media.invalid/140', 'protocol': 'https', 'ext': 'm4a', 'vcodec': 'none',
+                              'acodec': 'mp4a.40.2', 'tbr': 130.0, 'abr': 130.0, 'filesize': 3433514, 'format_note': '128 kbps',
+                              'language': None, 'audio_track_type': 'ORIGINAL', 'duration': 212}
+    assert formats['251-de.3']['language'] == 'de'
+    assert (formats['137']['vcodec'], formats['137']['acodec'], formats['137']['vbr'], formats['137']['height']) == ('avc1.640028', 'none', 4367.0, 1080)
+    assert (formats['18']['vcodec'], formats['18']['acodec'], formats['18']['ext']) == ('avc1.42001E', 'mp4a.40.2', 'mp4')
+    assert 'vbr' not in formats['18']
+
+
+def test_streams_to_info_size_methods():
+    info = estimate_size.piped_streams_to_info(STREAMS, VIDEO_ID)
+    formats = {fmt['format_id']: fmt for fmt in info['formats']}
+    assert estimate_size.get_format_size_with_method(formats['251']) == (3573830, 'filesize')
+    assert estimate_size.get_format_size_with_method(formats['250']) == (70 * 1000 // 8 * 212, 'bitrate')
+    assert estimate_size.get_format_size_with_method(formats['18']) == (503 * 1000 // 8 * 212, 'bitrate')
+
+
+@pytest.mark.parametrize('selector, format_ids, methods', [
+    ('bestaudio', ['251'], ['filesize']),
+    ('bv+ba/b', ['248', '251'], ['filesize', 'filesize']),
+    ('bv[ext=mp4]+ba[ext=m4a]', ['137', '140'], ['filesize', 'filesize']),
+    ('b', ['18'], ['bitrate']),
+])
+def test_selection_on_piped_info(selector, format_ids, methods):
+    estimate_size.reset_selection_caches()
+    info = estimate_size.piped_streams_to_info(STREAMS, VIDEO_ID)
+    estimate = estimate_size.estimate_selection(estimate_size.get_available_formats(info), selector, info['duration'])
+    assert estimate['format_ids'] == format_ids
+    assert [part['method'] for part in estimate['parts']] == methods
+
+
+def test_streams_without_urls_are_rejected():
+    with pytest.raises(ValueError):
+        estimate_size.piped_streams_to_info({'audioStreams': [{'url': None, 'itag': 140}], 'videoStreams': []}, VIDEO_ID)
+
+
+def test_piped_backend_fetches_once_then_uses_the_streams_cache(piped_server, yt_dlp_backend):
+    info = estimate_size.extract_media_info(URL, backend='piped')
+    again = estimate_size.extract_media_info(URL, backend='piped')
+    assert piped_server.requests_seen == [f"/streams/{VIDEO_ID}"]
+    assert info['_source'] == again['_source'] == 'piped'
+    assert info['formats'] == again['formats']
+    assert yt_dlp_backend == []
+    assert os.path.exists(os.path.join(estimate_size.PIPED_STREAMS_CACHE_DIR, f"{VIDEO_ID}.json"))
+
+
+@pytest.mark.parametrize('status, body', [
+    (500, {'error': 'Internal Server Error'}),
+    (200, {'error': 'Video unavailable', 'message': 'This video is private'}),
+    (200, {'title': 'No streams', 'audioStreams': [], 'videoStreams': []}),
+])
+def test_piped_errors_fall_back_to_yt_dlp(piped_server, yt_dlp_backend, status, body):
+    piped_server.responses = {VIDEO_ID: (status, body)}
+    info = estimate_size.extract_media_info(URL, backend='piped')
+    assert info['_source'] == 'yt-dlp'
+    assert yt_dlp_backend == [URL]
+    assert piped_server.requests_seen == [f"/streams/{VIDEO_ID}"]
+    assert not os.path.exists(os.path.join(estimate_size.PIPED_STREAMS_CACHE_DIR, f"{VIDEO_ID}.json"))
+
+
+def test_unreachable_instance_falls_back_to_yt_dlp(yt_dlp_backend, monkeypatch, tmp_path):
+    server = HTTPServer(('127.0.0.1', 0), _FakePipedHandler)
+    port = server.server_address[1]
+    server.server_close()
+    monkeypatch.setattr(estimate_size, 'PIPED_INSTANCE', f"http://127.0.0.1:{port}")
+    monkeypatch.setattr(estimate_size, 'PIPED_STREAMS_CACHE_DIR', str(tmp_path))
+    assert estimate_size.extract_media_info(URL, backend='piped')['_source'] == 'yt-dlp'
+    assert yt_dlp_backend == [URL]
+
+
+def test_non_youtube_urls_skip_piped(piped_server, yt_dlp_backend):
+    url = 'https://soundcloud.com/fixture-artist/fixture-track'
+    assert estimate_size.extract_media_info(url, backend='piped')['_source'] == 'yt-dlp'
+    assert piped_server.requests_seen == []
+    assert yt_dlp_backend == [url]
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import estimate_size
+
+FORMATS = [{'format_id': 'v', 'vcodec': 'avc1.640028', 'acodec': 'none'}, {'format_id': 'a', 'vcodec': 'none', 'acodec': 'mp4a.40.2'}]
+VIDEO, AUDIO, DURATION = 50_000_000, 2_000_000, 100
+WAV = DURATION * estimate_size.PCM_BYTES_PER_SECOND  # 17,640,000
+MP3 = 4_040_000                                       # 100 s at 320 kbps, +1% container overhead
+AAC = 3_232_000                                       # 100 s at 256 kbps, +1% container overhead
+MUXED = int((VIDEO + AAC) * estimate_size.PIPELINE_CONTAINER_OVERHEAD)
+
+
+def _estimate(*format_ids):
+    sizes = {'v': VIDEO, 'a': AUDIO}
+    return {'parts': [{'format_id': format_id, 'size': sizes[format_id]} for format_id in format_ids]}
+
+
+CASES = [
+    # (id, parts, pipeline, normalize, high_dynamic, expected phases, final)
+    ('mp3-high-dynamic', ('a',), 'mp3', True, True,
+     [('download', AUDIO), ('wav_extract', AUDIO + WAV), ('dynaudnorm', AUDIO + 2 * WAV), ('loudnorm', AUDIO + 3 * WAV),
+      ('encode', AUDIO + 2 * WAV + MP3), ('embed', AUDIO + 2 * MP3)], MP3),
+    ('mp3-normal-dynamic', ('a',), 'mp3', True, False,
+     [('download', AUDIO), ('wav_extract', AUDIO + WAV), ('loudnorm', AUDIO + 2 * WAV), ('encode', AUDIO + 2 * WAV + MP3),
+      ('embed', AUDIO + 2 * MP3)], MP3),
+    ('mp3-no-normalize', ('a',), 'mp3', False, True,
+     [('download', AUDIO), ('convert', AUDIO + MP3)], MP3),
+    ('mp4-merged-high-dynamic', ('v', 'a'), 'mp4', True, True,
+     [('download', 2 * (VIDEO + AUDIO)), ('wav_extract', VIDEO + AUDIO + WAV), ('dynaudnorm', VIDEO + AUDIO + 2 * WAV),
+      ('loudnorm', VIDEO + AUDIO + 3 * WAV), ('encode', VIDEO + AUDIO + 2 * WAV + AAC), ('mux', VIDEO + AUDIO + AAC + MUXED)], MUXED),
+    ('mp4-merged-no-normalize', ('v', 'a'), 'mp4', False, True,
+     [('download', 2 * (VIDEO + AUDIO))], VIDEO + AUDIO),
+    ('mp4-single-file-no-normalize', ('v',), 'mp4', False, False,
+     [('download', VIDEO)], VIDEO),
+    ('mkv-high-dynamic', ('v', 'a'), 'mkv', True, True,
+     [('download', VIDEO + AUDIO), ('wav_extract', VIDEO + AUDIO + WAV), ('dynaudnorm', VIDEO + AUDIO + 2 * WAV),
+      ('loudnorm', VIDEO + AUDIO + 3 * WAV), ('encode', VIDEO + AUDIO + 2 * WAV + AAC), ('mux', VIDEO + AUDIO + AAC + MUXED)], MUXED),
+    ('mkv-normal-dynamic', ('v', 'a'), 'mkv', True, False,
+     [('download', VIDEO + AUDIO), ('wav_extract', VIDEO + AUDIO + WAV), ('loudnorm', VIDEO + AUDIO + 2 * WAV),
+      ('encode', VIDEO + AUDIO + 2 * WAV + AAC), ('mux', VIDEO + AUDIO + AAC + MUXED)], MUXED),
+]
+
+
+@pytest.mark.parametrize('parts, pipeline, normalize, high_dynamic, phases, final', [case[1:] for case in CASES], ids=[case[0] for case in CASES])
+def test_phase_sums(parts, pipeline, normalize, high_dynamic, phases, final):
+    estimate = _estimate(*parts)
+    prediction = estimate_size.predict_pipeline_disk(FORMATS, estimate, DURATION, pipeline, normalize=normalize, high_dynamic=high_dynamic)
+    assert [(phase['phase'], phase['bytes']) for phase in prediction['phases']] == phases
+    assert prediction['final'] == final
+    assert prediction['download'] == sum(part['size'] for part in estimate['parts'])
+    peak_phase, peak = max(phases, key=lambda phase: phase[1])
+    assert (prediction['peak_phase'], prediction['peak']) == (peak_phase, peak)
+
+
+def test_sections_scale_the_wav_and_encode_phases():
+    seconds = 20 # Two 10 s sections
+    wav, mp3 = seconds * estimate_size.PCM_BYTES_PER_SECOND, 808_000
+    prediction = estimate_size.predict_pipeline_disk(FORMATS, _estimate('a'), DURATION, 'mp3', sections=[(0, 10), (50, 60)])
+    assert [(phase['phase'], phase['bytes']) for phase in prediction['phases']] == [
+        ('download', AUDIO), ('wav_extract', AUDIO + wav), ('dynaudnorm', AUDIO + 2 * wav), ('loudnorm', AUDIO + 3 * wav),
+        ('encode', AUDIO + 2 * wav + mp3), ('embed', AUDIO + 2 * mp3)]
+    assert (prediction['peak_phase'], prediction['final']) == ('loudnorm', mp3)
+
+
+def test_unknown_duration_leaves_out_the_wav_and_encoded_files():
+    prediction = estimate_size.predict_pipeline_disk(FORMATS, _estimate('v', 'a'), None, 'mkv')
+    assert [phase['bytes'] for phase in prediction['phases']] == [VIDEO + AUDIO] * 5 + [VIDEO + AUDIO + prediction['final']]
+    assert prediction['final'] == int(VIDEO * estimate_size.PIPELINE_CONTAINER_OVERHEAD)
+    assert prediction['peak_phase'] == 'mux'
@@ -0,0 +1,166 @@
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('cloudscraper')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import invidious_downloader
+
+MIN_SEGMENT = 64 * 1024
+PAYLOAD = random.Random(4321).randbytes(1024 * 1024 + 777)
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves PAYLOAD with Range support. Knobs (class attributes, reset per test):
+    drop_starts: Range starts whose first response is cut off halfway; slow_starts: Range starts sent in slow 16 KiB chunks;
+    ranges: False ignores Range headers (plain 200 responses).
+    """
+    protocol_version = 'HTTP/1.1'
+    ranges, etag = True, '"v1"'
+    drop_starts, slow_starts, requests_seen = set(), set(), []
+
+    def do_GET(self):
+        start, end = 0, len(PAYLOAD) - 1
+        range_header = self.headers.get('Range')
+        if range_header and self.ranges:
+            first, last = range_header.split('=', 1)[1].split('-')
+            start, end = int(first), min(int(last or end), end)
+        self.requests_seen.append((start, end) if range_header else None)
+        body = PAYLOAD[start:end + 1]
+        self.send_response(206 if range_header and self.ranges else 200)
+        if range_header and self.ranges: self.send_header('Content-Range', f"bytes {start}-{end}/{len(PAYLOAD)}")
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        if start in self.drop_starts and len(body) > 1:
+            self.drop_starts.discard(start)
+            self.wfile.write(body[:len(body) // 2]); self.wfile.flush()
+            self.close_connection = True
+            return
+        step = 16 * 1024 if start in self.slow_starts else len(body) or 1
+        for offset in range(0, len(body), step):
+            self.wfile.write(body[offset:offset + step])
+            if start in self.slow_starts: time.sleep(0.02)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def range_server(monkeypatch):
+    _RangeHandler.ranges, _RangeHandler.etag = True, '"v1"'
+    _RangeHandler.drop_starts, _RangeHandler.slow_starts, _RangeHandler.requests_seen = set(), set(), []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(invidious_downloader, 'SEGMENT_MIN_SIZE', MIN_SEGMENT)
+    monkeypatch.setattr(invidious_downloader, 'get_bandwidth_governor', lambda: None)
+    yield f"http://127.0.0.1:{server.server_address[1]}/media.bin", _RangeHandler
+    server.shutdown()
+    server.server_close()
+
+
+def _media_requests(handler):
+    """Range requests other than the bytes=0-0 size probe."""
+    return [r for r in handler.requests_seen if r != (0, 0)]
+
+
+def _requested_ranges(handler):
+    """Union of the requested byte ranges as [start, end) lists (stolen halves overlap the request they came from)."""
+    return invidious_downloader._merge_ranges([[start, end + 1] for start, end in _media_requests(handler)])
+
+
+def test_full_download(range_server, tmp_path):
+    url, handler = range_server
+    output_path = tmp_path / 'media.bin'
+    assert invidious_downloader.download_file_segmented(url, str(output_path), connections=4)
+    assert output_path.read_bytes() == PAYLOAD
+    assert not os.path.exists(f"{output_path}.part") and not os.path.exists(f"{output_path}.part.json")
+    assert {(0, 262338), (262339, 524677), (524678, 787016), (787017, 1049352)} <= set(_media_requests(handler))
+    assert _requested_ranges(handler) == [[0, len(PAYLOAD)]]
+
+
+def test_dropped_segment_is_retried_from_where_it_stopped(range_server, tmp_path):
+    url, handler = range_server
+    handler.drop_starts = {262339}
+    output_path = tmp_path / 'media.bin'
+    assert invidious_downloader.download_file_segmented(url, str(output_path), connections=4)
+    assert output_path.read_bytes() == PAYLOAD
+    assert [r[0] for r in _media_requests(handler)].count(262339) == 1 # Resumed from its position, not restarted
+    assert any(262339 < start < 524678 for start, _ in _media_requests(handler))
+
+
+def test_idle_connection_steals_from_a_slow_segment(range_server, tmp_path):
+    url, handler = range_server
+    handler.slow_starts = {0}
+    output_path = tmp_path / 'media.bin'
+    assert invidious_downloader.download_file_segmented(url, str(output_path), connections=2)
+    assert output_path.read_bytes() == PAYLOAD
+    stolen = [r for r in _media_requests(handler) if 0 < r[0] <= 524676]
+    assert stolen and all(end <= 524676 for _, end in stolen)
+
+
+def _interrupted_download(output_path, url, completed, etag='"v1"'):
+    """Leaves the .part / .part.json an interrupted run would: completed ranges hold real bytes, the rest is garbage."""
+    part = bytearray(b'\xff' * len(PAYLOAD))
+    for start, end in completed: part[start:end] = PAYLOAD[start:end]
+    with open(f"{output_path}.part", 'wb') as f: f.write(part)
+    invidious_downloader.save_resume_state(f"{output_path}.part.json", {'url': url, 'total_size': len(PAYLOAD), 'etag': etag, 'completed': completed})
+
+
+def test_resume_fetches_only_missing_ranges(range_server, tmp_path):
+    url, handler = range_server
+    output_path = tmp_path / 'media.bin'
+    _interrupted_download(output_path, url, [[0, 300000], [600000, 700000]])
+    assert invidious_downloader.download_file_segmented(url, str(output_path), connections=2)
+    assert output_path.read_bytes() == PAYLOAD
+    assert _requested_ranges(handler) == [[300000, 600000], [700000, len(PAYLOAD)]]
+
+
+def test_truncated_resume_state_starts_over(range_server, tmp_path):
+    url, handler = range_server
+    output_path = tmp_path / 'media.bin'
+    _interrupted_download(output_path, url, [[0, 300000]])
+    state_path = f"{output_path}.part.json"
+    text = open(state_path, encoding='utf-8').read()
+    with open(state_path, 'w', encoding='utf-8') as f: f.write(text[:len(text) // 2])
+    assert invidious_downloader.download_file_segmented(url, str(output_path), connections=2)
+    assert output_path.read_bytes() == PAYLOAD
+    assert _requested_ranges(handler) == [[0, len(PAYLOAD)]]
+
+
+def test_changed_etag_discards_partial_download(range_server, tmp_path):
+    url, handler = range_server
+    output_path = tmp_path / 'media.bin'
+    _interrupted_download(output_path, url, [[0, 300000]], etag='"v0"')
+    assert invidious_downloader.download_file_segmented(url, str(output_path), connections=2)
+    assert output_path.read_bytes() == PAYLOAD
+    assert _requested_ranges(handler) == [[0, len(PAYLOAD)]]
+
+
+def test_fallback_to_single_connection_removes_segment_artifacts(range_server, tmp_path):
+    url, handler = range_server
+    handler.ranges = False
+    output_path = tmp_path / 'media.bin'
+    _interrupted_download(output_path, url, [[0, 300000]])
+    assert invidious_downloader.download_file_segmented(url, str(output_path), connections=4)
+    assert output_path.read_bytes() == PAYLOAD
+    assert not os.path.exists(f"{output_path}.part") and not os.path.exists(f"{output_path}.part.json")
+
+
+def test_segment_state_splits_missing_ranges_and_steals(monkeypatch):
+    monkeypatch.setattr(invidious_downloader, 'SEGMENT_MIN_SIZE', 10)
+    state = invidious_downloader._SegmentState(100, 2, 'http://x', completed=[[0, 20], [40, 50]])
+    assert state.downloaded == 30
+    assert [(seg['start'], seg['end']) for seg in state.pending] == [(20, 40), (50, 85), (85, 100)]
+    first, second, _ = state.next_segment(), state.next_segment(), state.next_segment()
+    first['pos'] = 40; state.finish(first)
+    stolen = state.next_segment() # Steals the back half of the segment with the most left (50-85)
+    assert (stolen['start'], stolen['end'], second['end']) == (67, 85, 67)
+    assert state.next_segment() is None # 85-100 and 67-85 are each under 2 * SEGMENT_MIN_SIZE
+    assert state.completed_ranges() == [[0, 50]]
@@ -0,0 +1,103 @@
+import io
+import json
+import os
+import random
+import sys
+
+import pytest
+
+pytest.importorskip('cloudscraper')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import invidious_downloader
+
+PAYLOAD = random.Random(1234).randbytes(3 * 1024 * 1024 + 12345) # Not a multiple of any chunk size
+
+
+class _TrickleRaw(io.BytesIO):
+    """A raw stream that returns at most `limit` bytes per readinto, like a socket."""
+    def __init__(self, data, limit):
+        super().__init__(data)
+        self.limit = limit
+
+    def readinto(self, buffer):
+        return super().readinto(memoryview(buffer)[:self.limit])
+
+
+class _FakeResponse:
+    def __init__(self, data, encoding=None, limit=1 << 30):
+        self.headers = {'content-encoding': encoding} if encoding else {}
+        self.raw = _TrickleRaw(data, limit)
+        self.data = data
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.data), 100000): yield self.data[start:start + 100000]
+
+
+class _Analyzer:
+    def __init__(self): self.fed = bytearray()
+    def feed(self, view): self.fed += view
+
+
+class _Governor:
+    rate = 512 * 1024
+    def __init__(self): self.consumed = 0
+    def consume(self, n): self.consumed += n
+
+
+def _progress_lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+@pytest.mark.parametrize('encoding, limit', [(None, 1 << 30), (None, 7919), ('gzip', 1 << 30)], ids=['raw', 'raw-trickle', 'iter_content'])
+def test_stream_to_file_is_byte_exact(tmp_path, monkeypatch, encoding, limit):
+    monkeypatch.setattr(invidious_downloader, 'PROGRESS_MACHINE_INTERVAL', 0)
+    output_path = tmp_path / 'out.bin'
+    progress, analyzer, governor = io.StringIO(), _Analyzer(), _Governor()
+    reporter = invidious_downloader.ProgressReporter(len(PAYLOAD), progress, interactive=False)
+
+    done = invidious_downloader._stream_to_file(_FakeResponse(PAYLOAD, encoding, limit), str(output_path), len(PAYLOAD),
+                                                analyzer=analyzer, reporter=reporter, governor=governor)
+
+    assert done == len(PAYLOAD)
+    assert output_path.read_bytes() == PAYLOAD
+    assert bytes(analyzer.fed) == PAYLOAD
+    assert governor.consumed == len(PAYLOAD)
+    lines = _progress_lines(progress)
+    assert lines[-1]['bytes'] == lines[-1]['total'] == len(PAYLOAD)
+    assert [line['bytes'] for line in lines] == sorted(line['bytes'] for line in lines)
+
+
+def test_stream_to_file_empty_body(tmp_path):
+    progress = io.StringIO()
+    reporter = invidious_downloader.ProgressReporter(0, progress, interactive=False)
+    assert invidious_downloader._stream_to_file(_FakeResponse(b''), str(tmp_path / 'empty.bin'), 0, reporter=reporter) == 0
+    assert (tmp_path / 'empty.bin').read_bytes() == b''
+    assert _progress_lines(progress)[-1] == {'type': 'progress', 'bytes': 0, 'total': None, 'rate': 0}
+
+
+@pytest.fixture
+def served_payload(tmp_path):
+    path = tmp_path / 'served' / 'payload.bin'
+    path.parent.mkdir()
+    path.write_bytes(PAYLOAD)
+    url, server = invidious_downloader._serve_local_file(str(path))
+    yield str(path), url
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_file_over_local_http(served_payload, tmp_path, monkeypatch):
+    monkeypatch.setattr(invidious_downloader, 'get_bandwidth_governor', lambda: None)
+    _, url = served_payload
+    output_path = tmp_path / 'downloaded.bin'
+    assert invidious_downloader.download_file(url, str(output_path))
+    assert output_path.read_bytes() == PAYLOAD
+
+
+def test_benchmark_download_io_serves_local_files(served_payload):
+    path, _ = served_payload
+    results = invidious_downloader.benchmark_download_io(path, runs=1)
+    assert set(results) == {'legacy', 'adaptive'}
+    for sample in results.values():
+        assert sample['bytes'] == len(PAYLOAD)
+        assert sample['mb_per_s'] > 0